@@ -17,10 +17,20 @@
 
 """ This module implements platform metrics data analysis. """
 import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
 from scipy import stats
+from sklearn import mixture
+from sklearn.covariance import MinCovDet
 from gmmfense import GmmFense
+from container import STATS, stat_column
+from perfmon import EVENTS, parse_events
+import tsstore
+import mvmodel
 
 
 def get_quartile(args, mdf, is_upper):
@@ -102,6 +112,51 @@ def partition_utilization(cpu_number, step=50):
     return utilization_bar
 
 
+def adaptive_partition(utils, bin_count, min_samples):
+    """
+    Partition utilization bins from observed utilization distribution, bin
+    edges are quantiles and sparse bins are merged into next bin, return
+    list of (lower, upper) bounds covering whole observed range
+        utils - observed utilization of workload
+        bin_count - maximal bin count
+        min_samples - minimal sample count of one bin
+    """
+    utils = np.sort(np.asarray(utils, dtype=float))
+    if len(utils) < min_samples:
+        return []
+    edges = np.unique(np.quantile(utils, np.linspace(0, 1, bin_count + 1)))
+    bounds = [edges[0]]
+    for edge in edges[1:-1]:
+        lower = np.searchsorted(utils, bounds[-1])
+        upper = np.searchsorted(utils, edge)
+        if upper - lower >= min_samples and\
+           len(utils) - upper >= min_samples:
+            bounds.append(edge)
+    bounds.append(edges[-1])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def utilization_bins(args, cpu_no, utils):
+    """
+    Get (lower, upper) bounds of utilization bins of one workload
+        args - model building arguments
+        cpu_no - processor count assigned to workload
+        utils - observed utilization of workload
+    """
+    if args.bins == 'adaptive':
+        return adaptive_partition(utils, args.bin_count, args.min_samples)
+    utilization_partition = partition_utilization(cpu_no, args.step)
+    length = len(utilization_partition)
+    bins = []
+    for index, lower_bound in enumerate(utilization_partition):
+        if index != length - 1:
+            higher_bound = utilization_partition[index + 1]
+        else:
+            higher_bound = lower_bound + args.step
+        bins.append((lower_bound, higher_bound))
+    return bins
+
+
 def init_wl(args):
     """
     Initialize and return workload information from configuration file
@@ -116,94 +171,371 @@ def init_wl(args):
     return workloadinfo
 
 
+def model_args(args):
+    """
+    Get arguments used in model building which can be passed to worker
+    processes, opened files in command line arguments can not be pickled
+        args - arguments from command line input
+    """
+    return argparse.Namespace(thresh=args.thresh, fense_type=args.fense_type,
+                              stat=args.stat, verbose=args.verbose,
+                              model=args.model, quantile=args.quantile,
+                              bins=args.bins, step=args.step,
+                              bin_count=args.bin_count,
+                              min_samples=args.min_samples,
+                              events=args.events)
+
+
+def build_model(args, job, cpu_no, jdata):
+    """
+    Build TDP threshold and thresholds of all utilization bins of one
+    workload, return (TDP threshold row, list of bin threshold rows), TDP
+    threshold row is None if workload never reaches high utilization
+        args - model building arguments
+        job - workload name
+        cpu_no - processor count assigned to workload
+        jdata - platform metrics dataframe of workload
+    """
+    utilization_threshold = cpu_no * 100 * 0.95
+    tdp_data = jdata[jdata['UTIL'] >= utilization_threshold]
+
+    util = tdp_data['UTIL']
+    freq = tdp_data['NF']
+
+    tdp_row = None
+    if not util.empty:
+        mean, std = stats.norm.fit(freq)
+
+        min_freq = min(freq)
+        fbar = mean - 3 * std
+        if min_freq < fbar:
+            fbar = min_freq
+        tdp_row = [utilization_threshold, mean, std, fbar]
+
+    thresh_rows = []
+    for lower_bound, higher_bound in utilization_bins(args, cpu_no,
+                                                      jdata['UTIL']):
+        jdataf = jdata[(jdata['UTIL'] >= lower_bound) &
+                       (jdata['UTIL'] <= higher_bound)]
+        if len(jdataf) < args.min_samples:
+            print('Job: ' + job + ', UTIL: [' + str(lower_bound) + ', ' +
+                  str(higher_bound) + '], skipped with ' + str(len(jdataf)) +
+                  ' samples')
+            continue
+        try:
+            cpi = jdataf[stat_column('CPI', args.stat)]
+            cpi_thresh = get_fense(args, cpi, True)
+
+            mpki = jdataf[stat_column('L3MPKI', args.stat)]
+            mpki_thresh = get_fense(args, mpki, True)
+
+            if args.stat == 'mean':
+                memb = jdataf['MBL'] + jdataf['MBR']
+            else:
+                memb = jdataf[stat_column('MB', args.stat)]
+            mb_thresh = get_fense(args, memb, False)
+
+            event_threshs = []
+            for event in args.events:
+                values = jdataf[event.metric].dropna()
+                event_threshs.append(get_fense(args, values, True)
+                                     if len(values) else float('nan'))
+        except ValueError as err:
+            print('Job: ' + job + ', UTIL: [' + str(lower_bound) + ', ' +
+                  str(higher_bound) + '], fail to build thresholds: ' +
+                  str(err))
+            continue
+
+        print('Job: {job}, UTIL: [{util_lower}, {util_higher}],\
+              CPI Threshold: {cpi_thres}, MKPI Threshold: {mkpi_thres},\
+              MB Threshold: {mb_thresh}'.format(job=job,
+                                                util_lower=lower_bound,
+                                                util_higher=higher_bound,
+                                                cpi_thres=cpi_thresh,
+                                                mkpi_thres=mpki_thresh,
+                                                mb_thresh=mb_thresh))
+        thresh_rows.append([lower_bound, higher_bound, cpi_thresh,
+                            mpki_thresh, mb_thresh] + event_threshs)
+    return tdp_row, thresh_rows
+
+
+def feature_data(args, jdata):
+    """
+    Get n x features array of multivariate model features
+        args - model building arguments
+        jdata - platform metrics dataframe
+    """
+    if args.stat == 'mean':
+        memb = jdata['MBL'] + jdata['MBR']
+    else:
+        memb = jdata[stat_column('MB', args.stat)]
+    return np.column_stack((jdata[stat_column('CPI', args.stat)],
+                            jdata[stat_column('L3MPKI', args.stat)],
+                            memb, jdata['NF'])).astype(float)
+
+
+def fit_components(args, data):
+    """
+    Fit mixture components of standardized feature vectors, return list of
+    (weight, mean, covariance) tuples
+        args - model building arguments
+        data - n x features array of standardized feature vectors
+    """
+    # keep covariance invertible when one feature barely changes
+    reg = np.eye(data.shape[1]) * 1e-3
+    if args.model == 'mahalanobis':
+        mcd = MinCovDet(random_state=1005).fit(data)
+        return [(1.0, mcd.location_, mcd.covariance_ + reg)]
+
+    lowest_bic = np.inf
+    for n_components in range(1, min(10, len(data) // 50) + 1):
+        gmm = mixture.GaussianMixture(n_components=n_components,
+                                      covariance_type='full',
+                                      reg_covar=1e-3, random_state=1005)
+        gmm.fit(data)
+        bic = gmm.bic(data)
+        if bic < lowest_bic:
+            lowest_bic = bic
+            best_gmm = gmm
+    return list(zip(best_gmm.weights_, best_gmm.means_,
+                    best_gmm.covariances_))
+
+
+def build_mv_model(args, cpu_no, jdata):
+    """
+    Build joint distribution of features in all utilization bins of one
+    workload, return list of bin model dicts, log likelihood threshold of
+    each bin is the configured quantile of training samples
+        args - model building arguments
+        cpu_no - processor count assigned to workload
+        jdata - platform metrics dataframe of workload
+    """
+    bins = []
+    for lower_bound, higher_bound in utilization_bins(args, cpu_no,
+                                                      jdata['UTIL']):
+        data = feature_data(args, jdata[(jdata['UTIL'] >= lower_bound) &
+                                        (jdata['UTIL'] <= higher_bound)])
+        if len(data) < max(args.min_samples, 10 * len(mvmodel.FEATURES)):
+            continue
+        center = data.mean(axis=0)
+        scale = data.std(axis=0)
+        scale[scale == 0] = 1
+        components = fit_components(args, (data - center) / scale)
+        model = {'util_start': float(lower_bound),
+                 'util_end': float(higher_bound),
+                 'center': center.tolist(), 'scale': scale.tolist(),
+                 'components': [{'weight': float(weight),
+                                 'mean': mean.tolist(),
+                                 'covariance': covariance.tolist()}
+                                for weight, mean, covariance in components]}
+        likelihood, _ = mvmodel.score(*mvmodel.MvBin(
+            dict(model, threshold=0)).expand(data))
+        model['threshold'] = float(np.quantile(likelihood, args.quantile))
+        if args.verbose:
+            print('UTIL: [' + str(lower_bound) + ', ' + str(higher_bound) +
+                  '], components: ' + str(len(components)) +
+                  ', log likelihood threshold: ' + str(model['threshold']))
+        bins.append(model)
+    return bins
+
+
+def write_models(models, events, fleet=False):
+    """
+    Write TDP thresholds and bin thresholds of all workloads into
+    tdp_thresh.csv and thresh.csv
+        models - list of (key columns, TDP threshold row, bin threshold rows,
+                 multivariate bin models) tuples, key columns are CID and
+                 CNAME, SKU and NODE follow in fleet mode
+        events - additional events whose metric thresholds follow MB_THRESH
+        fleet - True to write SKU and NODE columns
+    """
+    keys = 'CID,CNAME,SKU,NODE,' if fleet else 'CID,CNAME,'
+    with open('./thresh.csv', 'w') as threshf, \
+            open('./tdp_thresh.csv', 'w') as tdpf:
+        threshf.write(keys + 'UTIL_START,UTIL_END,' +
+                      'CPI_THRESH,MPKI_THRESH,MB_THRESH' + ''.join(
+                          [',' + event.metric + '_THRESH'
+                           for event in events]) + '\n')
+        tdpf.write(keys + 'UTIL,MEAN,STD,BAR\n')
+        for key, tdp_row, thresh_rows, _ in models:
+            key = ','.join([str(item) for item in key]) + ','
+            if tdp_row is not None:
+                tdpf.write(key + ','.join([str(item) for item in tdp_row]) +
+                           '\n')
+            for row in thresh_rows:
+                threshf.write(key + ','.join([str(item) for item in row]) +
+                              '\n')
+
+    names = ('cid', 'cname', 'sku', 'node')
+    entries = [dict(list(zip(names, [str(item) for item in key])) +
+                    [('bins', mv_bins)])
+               for key, _, _, mv_bins in models if mv_bins]
+    if entries:
+        with open('./mvmodel.json', 'w') as modelf:
+            json.dump(entries, modelf)
+
+
+def store_range(args):
+    """
+    Get start time of records read from metrics store
+        args - arguments from command line input
+    """
+    if args.since:
+        return time.time() - args.since * 3600
+    return None
+
+
+def load_metrics(args):
+    """
+    Load platform metrics from metrics store or metrics file
+        args - arguments from command line input
+    """
+    if args.store:
+        store = tsstore.TsStore(args.store)
+        mdf = store.frame(tsstore.METRIC, start=store_range(args))
+        store.close()
+        return mdf
+    return pd.read_csv(args.metric_file)
+
+
+def model_events(args, mdf):
+    """
+    Get additional events whose metric thresholds are built, all known
+    events recorded in metrics are used if events are not given
+        args - arguments from command line input
+        mdf - platform metrics dataframe
+    """
+    events = args.events if args.events is not None else EVENTS.values()
+    found = []
+    for event in events:
+        if event.metric in mdf.columns:
+            found.append(event)
+        elif args.events is not None:
+            print('Event metric ' + event.metric + ' is not recorded, its' +
+                  ' thresholds are skipped')
+    return found
+
+
 def process_by_partition(args, workloadinfo):
     """
     Process single bin and generate anomaly threshold data
         args - arguments from command line input
         workloadinfo - workload information of LC workload
     """
-    with open('./thresh.csv', 'w') as threshf:
-        threshf.write('CID,CNAME,UTIL_START,UTIL_END,' +
-                      'CPI_THRESH,MPKI_THRESH,MB_THRESH\n')
-
-    with open('./tdp_thresh.csv', 'w') as tdpf:
-        tdpf.write('CID,CNAME,UTIL,MEAN,STD,BAR\n')
-
-    mdf = pd.read_csv(args.metric_file)
+    mdf = load_metrics(args)
+    args.events = model_events(args, mdf)
     cids = mdf['CID'].unique()
 
+    models = []
     for cid in cids:
         jdata = mdf[mdf['CID'] == cid]
         job = jdata['CNAME'].values[0]
         cpu_no = workloadinfo[job]
+        tdp_row, thresh_rows = build_model(args, job, cpu_no, jdata)
+        mv_bins = build_mv_model(args, cpu_no, jdata)\
+            if args.model != 'fense' else []
+        models.append(((cid, job), tdp_row, thresh_rows, mv_bins))
+    write_models(models, args.events)
 
-        # TODO: make step configurable
-        utilization_partition = partition_utilization(cpu_no, 50)
-        length = len(utilization_partition)
 
-        utilization_threshold = cpu_no * 100 * 0.95
-        tdp_data = jdata[jdata['UTIL'] >= utilization_threshold]
+def init_nodes(args):
+    """
+    Initialize node inventory of fleet mode, return list of (node, SKU,
+    metrics file, utilization file) tuples, utilization file may be empty
+        args - arguments from command line input
+    """
+    nodes_df = pd.read_csv(args.fleet).fillna('')
+    nodes = []
+    for row_turple in nodes_df.iterrows():
+        row = row_turple[1]
+        nodes.append((str(row['NODE']), str(row['SKU']),
+                      row['METRIC_FILE'], row.get('UTIL_FILE', '')))
+    return nodes
 
-        util = tdp_data['UTIL']
-        freq = tdp_data['NF']
 
-        if not util.empty:
-            mean, std = stats.norm.fit(freq)
+def load_fleet_metrics(nodes):
+    """
+    Combine metrics files of all nodes into one dataframe, container ids
+    are dropped and NODE and SKU columns are added, so data of workload
+    instances on all nodes and across restarts falls into one class
+        nodes - node inventory
+    """
+    mdfs = []
+    for node, sku, metric_file, _ in nodes:
+        mdf = pd.read_csv(metric_file)
+        mdf = mdf.drop(columns=['CID'])
+        mdf['NODE'] = node
+        mdf['SKU'] = sku
+        mdfs.append(mdf)
+    return pd.concat(mdfs, ignore_index=True)
 
-            min_freq = min(freq)
-            fbar = mean - 3 * std
-            if min_freq < fbar:
-                fbar = min_freq
 
-            with open('./tdp_thresh.csv', 'a') as tdpf:
-                tdpf.write(cid + ',' + job + ',' + str(utilization_threshold) +
-                           ',' + str(mean) + ',' + str(std) +
-                           ',' + str(fbar) + '\n')
+def build_fleet_model(args, key, cpu_no, jdata):
+    """ build model of one workload class in worker process """
+    tdp_row, thresh_rows = build_model(args, key[1], cpu_no, jdata)
+    mv_bins = build_mv_model(args, cpu_no, jdata)\
+        if args.model != 'fense' else []
+    return key, tdp_row, thresh_rows, mv_bins
 
-        for index, util in enumerate(utilization_partition):
-            lower_bound = util
-            if index != length - 1:
-                higher_bound = utilization_partition[index + 1]
-            else:
-                higher_bound = lower_bound + 50
-            try:
-                jdataf = jdata[(jdata['UTIL'] >= lower_bound) &
-                               (jdata['UTIL'] <= higher_bound)]
 
-                cpi = jdataf['CPI']
-                cpi_thresh = get_fense(args, cpi, True)
+def process_fleet(args, workloadinfo):
+    """
+    Build one model per workload class, class is workload name on one SKU,
+    and node specific models of workloads on override nodes, models are
+    built in parallel worker processes
+        args - arguments from command line input
+        workloadinfo - workload information of LC workload
+    """
+    nodes = init_nodes(args)
+    mdf = load_fleet_metrics(nodes)
+    args.events = model_events(args, mdf)
+    overrides = set(args.override) if args.override else set()
+    margs = model_args(args)
+
+    tasks = []
+    for (sku, job), jdata in mdf.groupby(['SKU', 'CNAME']):
+        if job not in workloadinfo:
+            continue
+        cpu_no = workloadinfo[job]
+        if args.verbose:
+            print('workload ' + job + ' on ' + sku + ': ' + str(len(jdata)) +
+                  ' samples from ' + str(jdata['NODE'].nunique()) + ' nodes')
+        tasks.append((margs, ('', job, sku, ''), cpu_no, jdata))
+        for node, ndata in jdata.groupby('NODE'):
+            if node in overrides:
+                tasks.append((margs, ('', job, sku, node), cpu_no, ndata))
+
+    if args.jobs == 1:
+        models = [build_fleet_model(*task) for task in tasks]
+    else:
+        with Pool(args.jobs) as pool:
+            models = pool.starmap(build_fleet_model, tasks)
+    write_models(models, args.events, True)
 
-                mpki = jdataf['L3MPKI']
-                mpki_thresh = get_fense(args, mpki, True)
+    for node, _, _, util_file in nodes:
+        if util_file:
+            process_lc_max(args, util_file, './lcmax-' + node + '.txt')
 
-                memb = jdataf['MBL'] + jdataf['MBR']
-                mb_thresh = get_fense(args, memb, False)
-            except:
-                continue
-
-            print('Job: {job}, UTIL: [{util_lower}, {util_higher}],\
-                  CPI Threshold: {cpi_thres}, MKPI Threshold: {mkpi_thres},\
-                  MB Threshold: {mb_thresh}'.format(job=job,
-                                                    util_lower=lower_bound,
-                                                    util_higher=higher_bound,
-                                                    cpi_thres=cpi_thresh,
-                                                    mkpi_thres=mpki_thresh,
-                                                    mb_thresh=mb_thresh))
-
-            with open('./thresh.csv', 'a') as threshf:
-                threshf.write(cid + ',' + job + ',' + str(lower_bound) + ',' +
-                              str(higher_bound) + ',' + str(cpi_thresh) + ',' +
-                              str(mpki_thresh) + ',' + str(mb_thresh) + '\n')
-
-
-def process_lc_max():
-    """ Record maximal CPU utilization of all LC workloads """
-    udf = pd.read_csv('util.csv')
+
+def process_lc_max(args, util_file='util.csv', lcmax_file='./lcmax.txt'):
+    """
+    Record maximal CPU utilization of all LC workloads
+        args - arguments from command line input
+        util_file - utilization file collected from eris agent, None to
+                    read utilization from metrics store
+        lcmax_file - file to save maximal utilization
+    """
+    if util_file is None:
+        store = tsstore.TsStore(args.store)
+        udf = store.frame(tsstore.UTIL, cname='lcs', start=store_range(args))
+        store.close()
+    else:
+        udf = pd.read_csv(util_file)
     lcu = udf[udf['CNAME'] == 'lcs']
     lcu = lcu['UTIL']
     maxulc = int(lcu.max())
     print('Maxmium LC utilization: ', maxulc)
-    with open('./lcmax.txt', 'w') as lcmaxf:
+    with open(lcmax_file, 'w') as lcmaxf:
         lcmaxf.write(str(maxulc) + '\n')
 
 
@@ -213,8 +545,11 @@ def process(args):
         args - arguments from command line input
     """
     workloadinfo = init_wl(args)
+    if args.fleet:
+        process_fleet(args, workloadinfo)
+        return
     process_by_partition(args, workloadinfo)
-    process_lc_max()
+    process_lc_max(args, None if args.store else 'util.csv')
 
 
 def main():
@@ -237,9 +572,51 @@ def main():
                         detection', choices=['quartile', 'normal',
                                              'gmm-strict', 'gmm-normal'],
                         default='gmm-strict')
+    parser.add_argument('-s', '--stat', help='statistic of metrics samples\
+                        used to build thresholds, should match the one used\
+                        by eris agent in contention detection',
+                        choices=STATS, default='mean')
     parser.add_argument('-m', '--metric-file', help='metrics file collected\
-                        from eris agent', type=argparse.FileType('rt'),
+                        from eris agent, not used in fleet mode',
                         default='metrics.csv')
+    parser.add_argument('--bins', help='utilization bin partition, adaptive\
+                        chooses bin edges from quantiles of observed\
+                        utilization and merges sparse bins, fixed uses steps\
+                        from half to all requested processors',
+                        choices=['adaptive', 'fixed'], default='adaptive')
+    parser.add_argument('--bin-count', help='maximal bin count of adaptive\
+                        partition', type=int, default=8)
+    parser.add_argument('--min-samples', help='minimal sample count of one\
+                        bin', type=int, default=30)
+    parser.add_argument('--step', help='bin range of fixed partition',
+                        type=int, default=50)
+    parser.add_argument('--model', help='contention model type, fense builds\
+                        thresholds of each metric, mahalanobis and gmm build\
+                        joint distribution of CPI, MPKI, memory bandwidth\
+                        and frequency in each bin into mvmodel.json besides\
+                        thresholds', choices=['fense', 'mahalanobis', 'gmm'],
+                        default='fense')
+    parser.add_argument('--quantile', help='quantile of training sample log\
+                        likelihood used as contention threshold of\
+                        multivariate model', type=float, default=0.01)
+    parser.add_argument('--store', help='metrics store file kept by eris\
+                        agent, used instead of metrics file and util.csv')
+    parser.add_argument('--since', help='only use records of last hours in\
+                        metrics store', type=float)
+    parser.add_argument('--fleet', help='node inventory file with NODE, SKU,\
+                        METRIC_FILE and optional UTIL_FILE columns, metrics\
+                        of all nodes are combined and one model is built\
+                        for each workload name on each SKU')
+    parser.add_argument('--override', help='nodes which get node specific\
+                        models built from their own metrics in fleet mode',
+                        nargs='+', metavar='NODE')
+    parser.add_argument('-j', '--jobs', help='worker process number used to\
+                        build workload models in fleet mode', type=int,
+                        default=os.cpu_count())
+    parser.add_argument('--events', help='additional perf events given to\
+                        eris agent, thresholds of their metrics are built,\
+                        all known events found in metrics are used by\
+                        default', type=parse_events)
 
     args = parser.parse_args()
     if args.verbose:
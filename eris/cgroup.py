@@ -0,0 +1,297 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements cgroup file access on v1 and v2 hierarchy """
+
+import os
+from datetime import datetime
+
+WRITER = None
+
+
+def set_writer(writer):
+    """
+    Set function used to write cgroup files, writes are done in caller
+    context if no writer is set
+        writer - function takes cgroup file path and value
+    """
+    global WRITER
+    WRITER = writer
+
+
+def read(path):
+    """
+    Read content of one cgroup file, return empty string on failure
+        path - cgroup file path
+    """
+    try:
+        with open(path) as cgf:
+            return cgf.read().strip()
+    except IOError:
+        return ''
+
+
+def write_file(path, value):
+    """
+    Write value into one cgroup file immediately
+        path - cgroup file path
+        value - value to be written
+    """
+    try:
+        with open(path, 'w') as cgf:
+            cgf.write(str(value))
+    except IOError as err:
+        print(datetime.now().isoformat(' ') + ' fail to write ' + path +
+              ': ' + str(err))
+
+
+def write(path, value):
+    """
+    Write value into one cgroup file through configured writer
+        path - cgroup file path
+        value - value to be written
+    """
+    if WRITER is None:
+        write_file(path, value)
+    else:
+        WRITER(path, str(value))
+
+
+def parse_keyed(content):
+    """
+    Parse flat keyed cgroup file content such as cpu.stat
+        content - cgroup file content
+    """
+    values = dict()
+    for line in content.splitlines():
+        items = line.split()
+        if len(items) == 2:
+            try:
+                values[items[0]] = int(items[1])
+            except ValueError:
+                pass
+    return values
+
+
+def parse_pressure(content):
+    """
+    Parse pressure stall information file content, e.g. cpu.pressure
+        content - pressure file content
+    """
+    pressure = dict()
+    for line in content.splitlines():
+        items = line.split()
+        if not items:
+            continue
+        values = dict()
+        for item in items[1:]:
+            key, _, val = item.partition('=')
+            try:
+                values[key] = float(val)
+            except ValueError:
+                pass
+        pressure[items[0]] = values
+    return pressure
+
+
+class CgroupV1:
+    """
+    This class implements cgroup access on v1 hierarchy, each controller is
+    mounted separately and containers are created under docker parent
+    """
+    VERSION = 1
+
+    def __init__(self, root='/sys/fs/cgroup', parent='docker'):
+        self.root = root
+        self.parent = parent
+
+    def container_path(self, cid):
+        """
+        Get cgroup path of container relative to controller mount point
+            cid - container id
+        """
+        return self.parent + '/' + cid
+
+    def path(self, controller, cgpath, name=''):
+        """
+        Get absolute path of cgroup file
+            controller - cgroup controller name
+            cgpath - container cgroup path relative to mount point
+            name - cgroup file name
+        """
+        path = self.root + '/' + controller + '/' + cgpath
+        if name:
+            path = path + '/' + name
+        return path
+
+    def perf_event_path(self, cgpath):
+        """ get perf event cgroup directory of container """
+        return self.path('perf_event', cgpath)
+
+    def cpu_usage(self, cgpath):
+        """ get accumulated CPU usage of container in nanoseconds """
+        return int(read(self.path('cpu', cgpath, 'cpuacct.usage')))
+
+    def cpu_period(self, cgpath):
+        """ get CFS period of container in microseconds, 0 if unknown """
+        try:
+            return int(read(self.path('cpu', cgpath, 'cpu.cfs_period_us')))
+        except ValueError:
+            return 0
+
+    def set_quota(self, cgpath, quota, period):
+        """
+        Set CFS quota of container
+            quota - quota in microseconds, -1 for unlimited
+            period - CFS period in microseconds
+        """
+        write(self.path('cpu', cgpath, 'cpu.cfs_quota_us'), quota)
+
+    def set_share(self, cgpath, share):
+        """
+        Set CPU share of container
+            share - CPU share value
+        """
+        write(self.path('cpu', cgpath, 'cpu.shares'), share)
+
+    def cpuset(self, cgpath):
+        """ get cpu list string of container """
+        return read(self.path('cpuset', cgpath, 'cpuset.cpus'))
+
+    def set_cpuset(self, cgpath, cpus):
+        """
+        Set cpu list of container
+            cpus - cpu list string
+        """
+        write(self.path('cpuset', cgpath, 'cpuset.cpus'), cpus)
+
+    def cpu_stat(self, cgpath):
+        """ get CFS throttling statistics, throttled time in microseconds """
+        stat = parse_keyed(read(self.path('cpu', cgpath, 'cpu.stat')))
+        if 'throttled_time' in stat:
+            stat['throttled_usec'] = stat['throttled_time'] // 1000
+        return stat
+
+    def pressure(self, cgpath, resource):
+        """
+        Get pressure stall information of container, only available when
+        kernel exposes it on v1 hierarchy
+            resource - one of cpu, memory, io
+        """
+        return parse_pressure(read(self.path('cpuacct', cgpath,
+                                             resource + '.pressure')))
+
+    def pids(self, cgpath):
+        """ get all process ids of container """
+        return read(self.path('cpu', cgpath, 'tasks')).split()
+
+
+class CgroupV2(CgroupV1):
+    """
+    This class implements cgroup access on v2 unified hierarchy, containers
+    are created under docker parent or as systemd scopes
+    """
+    VERSION = 2
+
+    def container_path(self, cid):
+        scope = 'system.slice/docker-' + cid + '.scope'
+        if os.path.isdir(self.root + '/' + scope):
+            return scope
+        return self.parent + '/' + cid
+
+    def path(self, controller, cgpath, name=''):
+        path = self.root + '/' + cgpath
+        if name:
+            path = path + '/' + name
+        return path
+
+    def cpu_usage(self, cgpath):
+        stat = parse_keyed(read(self.path('cpu', cgpath, 'cpu.stat')))
+        if 'usage_usec' not in stat:
+            raise ValueError('no cpu usage in ' + cgpath)
+        return stat['usage_usec'] * 1000
+
+    def cpu_period(self, cgpath):
+        try:
+            return int(read(self.path('cpu', cgpath, 'cpu.max')).split()[1])
+        except (IndexError, ValueError):
+            return 0
+
+    def set_quota(self, cgpath, quota, period):
+        if quota < 0:
+            quota = 'max'
+        if not period:
+            period = 100000
+        write(self.path('cpu', cgpath, 'cpu.max'),
+              str(quota) + ' ' + str(period))
+
+    def set_share(self, cgpath, share):
+        # same conversion as container runtimes use from shares to weight
+        weight = 1 + (share - 2) * 9999 // 262142
+        write(self.path('cpu', cgpath, 'cpu.weight'),
+              min(max(weight, 1), 10000))
+
+    def cpuset(self, cgpath):
+        return read(self.path('cpuset', cgpath, 'cpuset.cpus.effective'))
+
+    def cpu_stat(self, cgpath):
+        return parse_keyed(read(self.path('cpu', cgpath, 'cpu.stat')))
+
+    def pressure(self, cgpath, resource):
+        return parse_pressure(read(self.path(resource, cgpath,
+                                             resource + '.pressure')))
+
+    def pids(self, cgpath):
+        return read(self.path('cpu', cgpath, 'cgroup.procs')).split()
+
+
+BACKEND = None
+
+
+def init_backend(version='auto', root='/sys/fs/cgroup'):
+    """
+    Initialize cgroup backend used by agent
+        version - cgroup version, 'auto' to detect from mounted hierarchy
+        root - cgroup file system mount point
+    """
+    global BACKEND
+    if version == 'auto':
+        if os.path.exists(root + '/cgroup.controllers'):
+            version = 'v2'
+        else:
+            version = 'v1'
+    if version == 'v2':
+        BACKEND = CgroupV2(root)
+    else:
+        BACKEND = CgroupV1(root)
+    return BACKEND
+
+
+def set_backend(cgroup_backend):
+    """
+    Set cgroup backend used by agent
+        cgroup_backend - backend object, e.g. CgroupV1 instance
+    """
+    global BACKEND
+    BACKEND = cgroup_backend
+
+
+def backend():
+    """ get cgroup backend, detect it on first use """
+    if BACKEND is None:
+        init_backend()
+    return BACKEND
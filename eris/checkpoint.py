@@ -0,0 +1,98 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements agent state checkpoint used in warm restart """
+
+import json
+import os
+import time
+from datetime import datetime
+
+VERSION = 1
+BOOT_ID = '/proc/sys/kernel/random/boot_id'
+
+
+def atomic_write(path, data):
+    """
+    Write file content atomically, readers see either old or new content
+    even if agent is killed while writing
+        path - file path
+        data - file content string
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as tmpf:
+        tmpf.write(data)
+        tmpf.flush()
+        os.fsync(tmpf.fileno())
+    os.replace(tmp, path)
+
+
+def boot_id():
+    """ get id of current boot, monotonic clock restarts with each boot """
+    try:
+        with open(BOOT_ID) as bootf:
+            return bootf.read().strip()
+    except IOError:
+        return ''
+
+
+def save(path, state):
+    """
+    Save agent state into checkpoint file, monotonic time of saving is
+    recorded along with boot id so freshness does not depend on wall clock
+        path - checkpoint file path
+        state - json serializable agent state
+    """
+    state = dict(state)
+    state['version'] = VERSION
+    state['boot_id'] = boot_id()
+    state['monotonic'] = time.monotonic()
+    state['wall'] = time.time()
+    atomic_write(path, json.dumps(state))
+
+
+def load(path, max_age):
+    """
+    Load agent state from checkpoint file, return None if checkpoint does
+    not exist, is from other boot or older than max_age
+        path - checkpoint file path
+        max_age - maximal checkpoint age in seconds
+    """
+    try:
+        with open(path) as checkpointf:
+            state = json.load(checkpointf)
+    except (IOError, ValueError) as err:
+        print(datetime.now().isoformat(' ') + ' ignore checkpoint ' + path +
+              ': ' + str(err))
+        return None
+
+    reason = None
+    age = time.monotonic() - state.get('monotonic', 0)
+    if state.get('version') != VERSION:
+        reason = 'unknown version ' + str(state.get('version'))
+    elif state.get('boot_id') != boot_id():
+        # monotonic time stamps and cgroup counters are from other boot
+        reason = 'node rebooted'
+    elif age < 0 or age > max_age:
+        reason = 'checkpoint age ' + '{:.0f}'.format(age) + 's'
+    if reason:
+        print(datetime.now().isoformat(' ') + ' ignore checkpoint ' + path +
+              ': ' + reason)
+        return None
+    print(datetime.now().isoformat(' ') + ' restore checkpoint ' + path +
+          ' saved ' + '{:.0f}'.format(age) + 's ago')
+    return state
@@ -0,0 +1,252 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements platform metrics collectors of containers """
+
+import asyncio
+import os
+import time
+from datetime import datetime
+import cgroup
+import perfmon
+from topology import CpuTopology
+
+
+def socket_metric(name, socket):
+    """
+    Get record name of metric measured on one socket, e.g. 'LLC occupancy:1'
+        name - metric name
+        socket - socket id, same as L3 monitoring domain id
+    """
+    return name + ':' + str(socket)
+
+
+class PgosCollector:
+    """
+    This class collects metrics by running pgos tool for each sample and
+    parsing its output, records are (cid, metric, timestamp, value) tuples
+    and one list of records is returned for each sample, window is seconds
+    counted in all samples of last collection
+    """
+
+    def __init__(self, binary='./pgos', events=None,
+                 group_size=perfmon.GROUP_SIZE, per=None, verbose=False):
+        """
+        Class constructor, arguments include:
+            binary - pgos tool path
+            events - list of (type, config, name) perf events counted in
+                     addition to instructions, cycles and LLC misses
+            group_size - programmable counters per logical processor
+            per - dict of event name to base event name, instructions or
+                  cycles, see perfmon.CgroupCounters
+            verbose - print pgos output
+        """
+        self.binary = binary
+        self.options = []
+        if events:
+            per = per if per else dict()
+            self.options = ['-events', ','.join(
+                [str(etype) + ':' + hex(config) + ':' +
+                 ('inst' if per.get(name) == 'instructions' else 'cyc') +
+                 ':' + name for etype, config, name in events]),
+                            '-group', str(group_size)]
+        self.verbose = verbose
+        self.window = 0
+
+    async def collect(self, containers, period, samples=1, keep=None):
+        """
+        Collect metrics of containers in back to back samples
+            containers - containers to be monitored
+            period - period of each sample in seconds
+            samples - sample count
+            keep - unused, pgos opens counters in each run
+        """
+        cids = dict()
+        cgps = []
+        for con in containers:
+            path = cgroup.backend().perf_event_path(con.cgpath)
+            # pgos names cgroup by last path component
+            cids[os.path.basename(path.rstrip('/'))] = con.cid
+            cgps.append(path)
+        if not cgps:
+            return []
+
+        # pgos takes whole seconds
+        period = max(1, int(period))
+        self.window = period * samples
+        period = str(period)
+        proc = await asyncio.create_subprocess_exec(
+            self.binary, '-cgroup', ','.join(cgps), '-period', period,
+            '-frequency', period, '-cycle', str(samples),
+            '-core', str(os.cpu_count()), *self.options,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        data = []
+        timestamp = None
+        try:
+            async for line in proc.stdout:
+                line = line.decode('utf-8').rstrip('\n')
+                if self.verbose:
+                    print(line)
+                items = line.split('\t')
+                if len(items) >= 4 and items[0] in cids:
+                    # all records of one pgos cycle share its timestamp
+                    if items[2] != timestamp:
+                        timestamp = items[2]
+                        data.append([])
+                    data[-1].append((cids[items[0]], items[1], items[2],
+                                     items[3]))
+            await proc.wait()
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            raise
+        return data
+
+    def close(self):
+        """ release collector resources """
+        pass
+
+
+class PerfCollector:
+    """
+    This class collects metrics in agent process, perf event groups of
+    container cgroups are kept open across samples and LLC occupancy and
+    memory bandwidth are read from resctrl monitor groups, window is seconds
+    counted in all samples of last collection
+    """
+    RESCTRL = '/sys/fs/resctrl'
+
+    def __init__(self, events=None, cpus=None, resctrl=RESCTRL,
+                 per_socket=False, group_size=perfmon.GROUP_SIZE, per=None,
+                 verbose=False):
+        """
+        Class constructor, arguments include:
+            events - list of (type, config, name) perf events, events are
+                     split into groups which fit programmable counters
+            cpus - logical processors to be monitored, all online if None
+            resctrl - resctrl file system mount point
+            per_socket - also collect LLC occupancy and memory bandwidth of
+                         each socket
+            group_size - programmable counters per logical processor
+            per - dict of event name to base event name, instructions or
+                  cycles, see perfmon.CgroupCounters
+            verbose - print collected records
+        """
+        self.events = events if events else perfmon.HW_EVENTS
+        self.cpus = cpus if cpus else CpuTopology().cpus
+        self.resctrl = resctrl
+        self.rdt = os.path.isdir(os.path.join(resctrl, 'mon_groups'))
+        self.per_socket = per_socket
+        self.group_size = group_size
+        self.per = per
+        self.verbose = verbose
+        self.window = 0
+        self.counters = dict()
+        self.groups = dict()
+
+    def __open(self, con):
+        if con.cid not in self.counters:
+            path = cgroup.backend().perf_event_path(con.cgpath)
+            try:
+                self.counters[con.cid] = perfmon.CgroupCounters(
+                    path, self.cpus, self.events, self.group_size, self.per)
+            except OSError as err:
+                print(datetime.now().isoformat(' ') +
+                      ' fail to open cgroup ' + path + ': ' + str(err))
+        ctrl = ''
+        if self.rdt and con.pids:
+            # BE processes are moved into CAT control group by pqos, monitor
+            # group must follow them or it would revert their allocation
+            ctrl = perfmon.find_ctrl_group(self.resctrl, con.pids[0])
+            group = self.groups.get(con.cid)
+            if group is not None and group.ctrl != ctrl:
+                self.groups.pop(con.cid).close()
+        if self.rdt and con.cid not in self.groups:
+            try:
+                self.groups[con.cid] = perfmon.ResctrlGroup(
+                    self.resctrl, 'eris-' + con.cid[:12], ctrl)
+            except OSError as err:
+                print(datetime.now().isoformat(' ') +
+                      ' fail to create resctrl monitor group: ' + str(err))
+        if con.cid in self.groups:
+            self.groups[con.cid].assign(con.pids)
+
+    def __prune(self, cids, keep):
+        for cid in list(self.counters):
+            if cid not in cids:
+                self.counters.pop(cid).close()
+        for cid in list(self.groups):
+            if cid not in cids and cid not in keep:
+                self.groups.pop(cid).close()
+
+    async def collect(self, containers, period, samples=1, keep=None):
+        """
+        Collect metrics of containers in back to back samples
+            containers - containers to be monitored
+            period - period of each sample in seconds
+            samples - sample count
+            keep - ids of containers not sampled in this cycle whose resctrl
+                   monitor groups are kept, perf events of them are closed
+        """
+        cids = set(con.cid for con in containers)
+        self.__prune(cids, keep if keep else set())
+        for con in containers:
+            self.__open(con)
+        for counters in self.counters.values():
+            counters.read()
+        groups = [(cid, group) for cid, group in self.groups.items()
+                  if cid in cids]
+        for _, group in groups:
+            group.update()
+
+        data = []
+        start = time.monotonic()
+        for _ in range(samples):
+            await asyncio.sleep(period)
+            data.append(self.__read(period, groups))
+        self.window = time.monotonic() - start
+        return data
+
+    def __read(self, period, groups):
+        timestamp = int(time.time())
+        records = []
+        for cid, counters in self.counters.items():
+            for (_, _, name), value in zip(self.events, counters.read()):
+                if value is not None:
+                    records.append((cid, name, timestamp, value))
+        for cid, group in groups:
+            domains = [(None, group.update())]
+            if self.per_socket:
+                domains.extend(sorted(group.domains.items()))
+            for socket, (occupancy, local, total) in domains:
+                for name, value in (
+                        ('LLC occupancy', occupancy // 1024),
+                        ('Memory bandwidth local',
+                         local / 1024.0 / 1024.0 / period),
+                        ('Memory bandwidth remote',
+                         max(total - local, 0) / 1024.0 / 1024.0 / period)):
+                    if socket is not None:
+                        name = socket_metric(name, socket)
+                    records.append((cid, name, timestamp, value))
+        if self.verbose:
+            for record in records:
+                print('\t'.join([str(item) for item in record]))
+        return records
+
+    def close(self):
+        """ close all counters and remove resctrl monitor groups """
+        self.__prune(set(), set())
@@ -19,11 +19,120 @@
 This module implements resource contention detection on one workload
 """
 
-import subprocess
+import bisect
 from datetime import datetime
+import math
 import time
 from enum import Enum
 from collections import deque
+import cgroup
+
+
+def parse_cpuset(cpus):
+    """
+    Parse cpu list format used by cpuset and sysfs, e.g. "0-3,8,10-11"
+        cpus - cpu list string
+    """
+    cpuset = []
+    for item in cpus.strip().split(','):
+        if not item:
+            continue
+        if '-' in item:
+            start, end = item.split('-')
+            cpuset.extend(range(int(start), int(end) + 1))
+        else:
+            cpuset.append(int(item))
+    return sorted(cpuset)
+
+
+def format_cpuset(cpuset):
+    """
+    Format cpus into cpu list string used by cpuset, e.g. "0-3,8"
+        cpuset - iterable of cpu numbers
+    """
+    items = []
+    start = end = None
+    for cpu in sorted(cpuset):
+        if start is not None and cpu == end + 1:
+            end = cpu
+            continue
+        if start is not None:
+            items.append(str(start) if start == end else
+                         str(start) + '-' + str(end))
+        start = end = cpu
+    if start is not None:
+        items.append(str(start) if start == end else
+                     str(start) + '-' + str(end))
+    return ','.join(items)
+
+
+STATS = ('mean', 'p50', 'p95', 'max')
+SAMPLE_METRICS = ('CPI', 'L3MPKI', 'MB')
+# additional perf events of all containers, see perfmon.Event
+EVENTS = []
+
+
+def set_events(events):
+    """
+    Set additional perf events collected, recorded and used in detection
+        events - list of perfmon.Event
+    """
+    EVENTS[:] = events
+
+
+def event_columns():
+    """ get metrics file columns of additional events, counter then metric """
+    return [name for event in EVENTS for name in (event.column, event.metric)]
+
+
+def stat_column(metric, stat):
+    """
+    Get metric column name of one distribution statistic, e.g. CPI_P95
+        metric - metric name, one of CPI, L3MPKI, MB
+        stat - statistic name in STATS
+    """
+    if stat == 'mean':
+        return metric
+    return metric + '_' + stat.upper()
+
+
+def socket_column(metric, socket):
+    """
+    Get metric column name of one socket, e.g. L3OCC_S1
+        metric - metric name, one of L3OCC, MBL, MBR, MB
+        socket - socket id
+    """
+    return metric + '_S' + str(socket)
+
+
+def percentile(values, quantile):
+    """
+    Get nearest rank percentile of values
+        values - list of values
+        quantile - quantile between 0 and 1
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    rank = int(math.ceil(quantile * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def find_bin(bins, utils, starts=None):
+    """
+    Find utilization bin of given utilization by binary search, last bin
+    covers utilization above it and utilization in gap between bins falls
+    into lower bin
+        bins - list of bins sorted by util_start
+        utils - CPU utilization
+        starts - util_start of each bin, computed from bins if not given
+    """
+    if starts is None:
+        starts = [thresh['util_start'] for thresh in bins]
+    index = bisect.bisect_right(starts, utils) - 1
+    if index < 0:
+        return None
+    return bins[index]
 
 
 class Contention(Enum):
@@ -42,20 +151,37 @@ class Container:
     """
 
     def __init__(self, cid, cn, pids, verbose, thresh=[], tdp_thresh=[],
-                 history_depth=5):
+                 history_depth=5, cgpath=None, stat='mean'):
         self.cid = cid
         self.name = cn
         self.pids = pids
+        if cgpath is None:
+            cgpath = cgroup.backend().container_path(cid)
+        self.cgpath = cgpath
         self.cpu_usage = 0
         self.utils = 0
         self.timestamp = 0.0
-        self.thresh = thresh
-        self.tdp_thresh = tdp_thresh
+        self.set_thresh(thresh, tdp_thresh)
         self.verbose = verbose
         self.metrics = dict()
         self.history_depth = history_depth + 1
         self.metrics_history = deque([], self.history_depth)
         self.cpusets = []
+        self.pressure = dict()
+        self.cpu_stat = dict()
+        self.throttled_ratio = 0
+        self.stat = stat
+        self.sockets = []
+
+    def set_thresh(self, thresh, tdp_thresh):
+        """
+        set contention thresholds of container workload
+            thresh - thresholds of utilization bins
+            tdp_thresh - TDP thresholds
+        """
+        self.thresh = thresh
+        self.bin_starts = [bin_thresh['util_start'] for bin_thresh in thresh]
+        self.tdp_thresh = tdp_thresh
 
     '''
     add metric data to metrics history
@@ -72,31 +198,109 @@ class Container:
             return 0
 
         if length == 1:
-            return self.metrics_history[length - 1][columnname]
+            return self.metrics_history[length - 1].get(columnname, 0)
 
         data_sum = 0
 
         for x in range(length - 1):
-            data_sum = data_sum + self.metrics_history[x][columnname]
+            data_sum = data_sum + self.metrics_history[x].get(columnname, 0)
 
-        data_delta = self.metrics_history[length - 1][columnname] -\
+        data_delta = self.metrics_history[length - 1].get(columnname, 0) -\
             data_sum / (length - 1)
 
         return data_delta
 
-    def get_llcoccupany_delta(self):
-        return self.get_history_delta_by_Type('L3OCC')
+    def get_llcoccupany_delta(self, socket=None):
+        if socket is None:
+            return self.get_history_delta_by_Type('L3OCC')
+        return self.get_history_delta_by_Type(socket_column('L3OCC', socket))
 
     def get_freq_delta(self):
         return self.get_history_delta_by_Type('NF')
 
-    def get_latest_mbt(self):
-        return self.metrics['MBL'] + self.metrics['MBR']
+    def get_latest_mbt(self, socket=None):
+        if socket is None:
+            return self.metrics.get('MBL', 0) + self.metrics.get('MBR', 0)
+        return self.metrics.get(socket_column('MB', socket), 0)
+
+    def active_sockets(self, share):
+        """
+        Get sockets where container holds at least given share of its LLC
+        occupancy or memory bandwidth, None if per socket metrics are not
+        collected
+            share - minimal share between 0 and 1
+        """
+        if not self.sockets:
+            return None
+        active = []
+        for name in ('L3OCC', 'MB'):
+            total = sum([self.metrics.get(socket_column(name, socket), 0)
+                         for socket in self.sockets])
+            if total > 0:
+                active.extend([socket for socket in self.sockets
+                               if self.metrics.get(socket_column(
+                                   name, socket), 0) >= total * share])
+        return sorted(set(active)) if active else list(self.sockets)
 
     def get_metrics(self):
         """ retrieve container platform metrics """
         return self.metrics
 
+    def update_samples(self, samples):
+        """
+        update metrics from samples collected in one metric cycle, counters
+        are accumulated and CPI, L3MPKI, MB distribution statistics of all
+        samples are calculated
+            samples - list of metrics dict, one per sample
+        """
+        metrics = self.metrics
+        for name in ('CYC', 'INST', 'L3MISS'):
+            metrics[name] = sum([sample.get(name, 0) for sample in samples])
+        for event in EVENTS:
+            # event whose group was not scheduled has no value in a sample,
+            # its count is extrapolated from samples it was counted in
+            counted = [sample[event.column] for sample in samples
+                       if event.column in sample]
+            if counted:
+                metrics[event.column] = sum(counted) * len(samples) //\
+                    len(counted)
+            else:
+                metrics.pop(event.column, None)
+        metrics['L3OCC'] = samples[-1].get('L3OCC', 0)
+        for name in ('MBL', 'MBR'):
+            metrics[name] = sum([sample.get(name, 0)
+                                 for sample in samples]) / len(samples)
+        metrics['MB'] = metrics['MBL'] + metrics['MBR']
+
+        # per socket values of L3 monitoring domains
+        self.sockets = sorted(set([socket for sample in samples
+                                   for socket in sample.get('SOCKETS', {})]))
+        for socket in self.sockets:
+            values = [sample.get('SOCKETS', {}).get(socket, {})
+                      for sample in samples]
+            metrics[socket_column('L3OCC', socket)] = values[-1].get('L3OCC',
+                                                                     0)
+            for name in ('MBL', 'MBR'):
+                metrics[socket_column(name, socket)] = sum(
+                    [value.get(name, 0) for value in values]) / len(values)
+            metrics[socket_column('MB', socket)] =\
+                metrics[socket_column('MBL', socket)] +\
+                metrics[socket_column('MBR', socket)]
+
+        values = dict([(name, []) for name in SAMPLE_METRICS])
+        for sample in samples:
+            inst = sample.get('INST', 0)
+            if inst:
+                values['CPI'].append(sample.get('CYC', 0) / inst)
+                values['L3MPKI'].append(sample.get('L3MISS', 0) * 1000 /
+                                        inst)
+            values['MB'].append(sample.get('MBL', 0) + sample.get('MBR', 0))
+        for name in SAMPLE_METRICS:
+            metrics[stat_column(name, 'p50')] = percentile(values[name], 0.5)
+            metrics[stat_column(name, 'p95')] = percentile(values[name], 0.95)
+            metrics[stat_column(name, 'max')] = max(values[name]) \
+                if values[name] else 0
+
     def update_pids(self, pids):
         """
         update process ids of one Container
@@ -104,50 +308,143 @@ class Container:
         """
         self.pids = pids
 
-    def update_cpu_usage(self):
-        """ calculate cpu usage of container """
-        cur = time.time() * 1e9
-        result = subprocess.run(['cat', '/sys/fs/cgroup/cpu/docker/' +
-                                 self.cid + '/cpuacct.usage'],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        res = result.stdout.decode('utf-8').strip()
+    def update_cpusets(self):
+        """ update cpus allowed to container from cpuset cgroup """
         try:
-            usg = int(res)
-            if self.cpu_usage != 0:
+            self.cpusets = parse_cpuset(cgroup.backend().cpuset(self.cgpath))
+        except ValueError:
+            self.cpusets = []
+
+    def update_pressure(self):
+        """ update pressure stall information of container """
+        backend = cgroup.backend()
+        for resource in ('cpu', 'memory', 'io'):
+            self.pressure[resource] = backend.pressure(self.cgpath, resource)
+
+    def update_cpu_stat(self):
+        """ update ratio of CFS periods throttled since last update """
+        stat = cgroup.backend().cpu_stat(self.cgpath)
+        last = self.cpu_stat
+        self.cpu_stat = stat
+        periods = stat.get('nr_periods', 0) - last.get('nr_periods', 0)
+        if last and periods > 0:
+            self.throttled_ratio = (stat.get('nr_throttled', 0) -
+                                    last.get('nr_throttled', 0)) / periods
+        else:
+            self.throttled_ratio = 0
+
+    def update_cpu_usage(self, timestamp=None):
+        """
+        calculate cpu usage of container
+            timestamp - monotonic time of this sample, window between
+                        samples is measured by current monotonic time if
+                        not given
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        try:
+            usg = cgroup.backend().cpu_usage(self.cgpath)
+            # usage below baseline is counted by a new cgroup of restarted
+            # container, e.g. baseline restored from checkpoint, so only
+            # baseline is taken
+            if self.cpu_usage != 0 and timestamp > self.timestamp and\
+                    usg >= self.cpu_usage:
                 self.utils = (usg - self.cpu_usage) * 100 /\
-                    (cur - self.timestamp)
+                    ((timestamp - self.timestamp) * 1e9)
             self.cpu_usage = usg
-            self.timestamp = cur
+            self.timestamp = timestamp
         except ValueError:
             pass
 
+    @staticmethod
+    def __encode_metrics(metrics):
+        metrics = metrics.copy()
+        if 'TIME' in metrics:
+            metrics['TIME'] = metrics['TIME'].timestamp()
+        return metrics
+
+    @staticmethod
+    def __decode_metrics(metrics):
+        if 'TIME' in metrics:
+            metrics['TIME'] = datetime.fromtimestamp(metrics['TIME'])
+        return metrics
+
+    def checkpoint(self):
+        """ get CPU usage baseline and metrics history of container """
+        return {'name': self.name, 'cpu_usage': self.cpu_usage,
+                'timestamp': self.timestamp, 'utils': self.utils,
+                'cpu_stat': self.cpu_stat,
+                'metrics': Container.__encode_metrics(self.metrics),
+                'history': [Container.__encode_metrics(metrics)
+                            for metrics in self.metrics_history]}
+
+    def restore(self, state):
+        """
+        Restore container state saved by checkpoint in same boot, CPU usage
+        timestamp is monotonic time so utilization of first cycle covers
+        agent restart
+            state - container state
+        """
+        self.cpu_usage = state['cpu_usage']
+        self.timestamp = state['timestamp']
+        self.utils = state['utils']
+        self.cpu_stat = state['cpu_stat']
+        self.metrics = Container.__decode_metrics(state['metrics'])
+        self.metrics_history.extend([Container.__decode_metrics(metrics)
+                                     for metrics in state['history']])
+
     def __detect_in_bin(self, thresh):
         metrics = self.metrics
-        if metrics['CPI'] > thresh['cpi']:
-            if metrics['L3MPKI'] > thresh['mpki']:
+        cpi = metrics[stat_column('CPI', self.stat)]
+        if cpi > thresh['cpi']:
+            if metrics[stat_column('L3MPKI', self.stat)] > thresh['mpki']:
                 print('Last Level Cache contention is detected at ' +
                       datetime.now().isoformat(' '))
                 print('Latency critical container ' + self.name + ', CPI = ' +
-                      str(metrics['CPI']) + ', MKPI = ' +
-                      str(metrics['L3MPKI']) + '\n')
+                      str(cpi) + ', MKPI = ' +
+                      str(metrics[stat_column('L3MPKI', self.stat)]) + '\n')
                 return Contention.LLC
-            if metrics['MBL'] + metrics['MBR'] < thresh['mb']:
+            # memory stall events tell bandwidth contention apart from
+            # core contention, bandwidth drop alone is used without them
+            stalls = self.__exceeded(thresh, 'mem')
+            if stalls or stalls is None and\
+               metrics[stat_column('MB', self.stat)] < thresh['mb']:
                 print('Memory Bandwidth contention detected at ' +
                       datetime.now().isoformat(' '))
                 print('Latency critical container ' + self.name + ', CPI = ' +
-                      str(metrics['CPI']) + ', MBL = ' + str(metrics['MBL']) +
-                      ', MBR = ' + str(metrics['MBR']) + '\n')
+                      str(cpi) + ', MBL = ' + str(metrics['MBL']) +
+                      ', MBR = ' + str(metrics['MBR']) + ''.join(
+                          [', ' + stall for stall in stalls or []]) + '\n')
                 return Contention.MEM_BW
 
             print('Performance is impacted at ' +
                   datetime.now().isoformat(' '))
             print('Latency critical container ' + self.name +
-                  ' CPI exceeds threshold, value = ', str(metrics['CPI']))
+                  ' CPI exceeds threshold, value = ', str(cpi))
+            core = self.__exceeded(thresh, 'core')
+            if core:
+                print('Core resources shared with hyperthread sibling are' +
+                      ' contended, ' + ', '.join(core) + '\n')
             return Contention.UNKN
 
         return None
 
+    def __exceeded(self, thresh, kind):
+        """
+        Get descriptions of additional event metrics of one kind which exceed
+        thresholds, None if no such metric has threshold
+        """
+        exceeded = None
+        for event in EVENTS:
+            limit = thresh.get(event.metric)
+            if event.kind != kind or limit is None or math.isnan(limit):
+                continue
+            exceeded = exceeded if exceeded is not None else []
+            value = self.metrics.get(event.metric, 0)
+            if value > limit:
+                exceeded.append(event.metric + ' = ' + str(value))
+        return exceeded
+
     def tdp_contention_detect(self):
         """ detect TDP contention in container """
         if not self.tdp_thresh:
@@ -164,23 +461,19 @@ class Container:
 
         return None
 
+    def find_bin(self):
+        """ find thresholds of utilization bin of current utilization """
+        return find_bin(self.thresh, self.utils, self.bin_starts)
+
     def contention_detect(self):
         """ detect resouce contention after find proper utilization bin """
         if not self.thresh:
             return None
 
-        for i in range(0, len(self.thresh)):
-            thresh = self.thresh[i]
-            if self.utils < thresh['util_start']:
-                if i == 0:
-                    return None
-
-                return self.__detect_in_bin(self.thresh[i - 1])
-
-            if self.utils >= thresh['util_start']:
-                if self.utils < thresh['util_end'] or\
-                   i == len(self.thresh) - 1:
-                    return self.__detect_in_bin(thresh)
+        thresh = self.find_bin()
+        if thresh is None:
+            return None
+        return self.__detect_in_bin(thresh)
 
     def __str__(self):
         metrics = self.metrics
@@ -190,4 +483,8 @@ class Container:
             str(metrics['L3MPKI']) + ',' + str(metrics['L3MISS']) + ',' +\
             str(metrics['NF']) + ',' + str(self.utils) + ',' +\
             str(metrics['L3OCC']) + ',' + str(metrics['MBL']) + ',' +\
-            str(metrics['MBR']) + '\n'
+            str(metrics['MBR']) + ''.join(
+                [',' + str(metrics[stat_column(name, stat)])
+                 for name in SAMPLE_METRICS for stat in STATS[1:]]) +\
+            ''.join([',' + str(metrics.get(name, ''))
+                     for name in event_columns()]) + '\n'
@@ -0,0 +1,110 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements CPU frequency control based on cpufreq sysfs """
+
+import os
+from datetime import datetime
+import cgroup
+from container import parse_cpuset
+from mresource import Resource
+
+
+class CpuFreq(Resource):
+    """
+    This class is the resource class of CPU frequency, it caps maximal
+    frequency on processors used by BE workloads to reduce their power draw
+    when TDP contention is detected on LC workloads
+    """
+    SYSFS_CPU = '/sys/devices/system/cpu'
+
+    def __init__(self, init_level=Resource.BUGET_LEV_FULL,
+                 sysfs_root=SYSFS_CPU, verbose=False):
+        super().__init__(init_level)
+        self.sysfs_root = sysfs_root
+        self.verbose = verbose
+        self.online = self.__read_cpus('online')
+        self.freq_min = self.__read_freq(0, 'cpuinfo_min_freq')
+        self.freq_max = self.__read_freq(0, 'cpuinfo_max_freq')
+        self.capped = set()
+        self.update()
+
+    def __read_cpus(self, name):
+        try:
+            with open(os.path.join(self.sysfs_root, name)) as cpusf:
+                return parse_cpuset(cpusf.read())
+        except (IOError, ValueError):
+            return list(range(os.cpu_count()))
+
+    def __freq_path(self, cpu, name):
+        return os.path.join(self.sysfs_root, 'cpu' + str(cpu), 'cpufreq',
+                            name)
+
+    def __read_freq(self, cpu, name):
+        try:
+            with open(self.__freq_path(cpu, name)) as freqf:
+                return int(freqf.read().strip())
+        except (IOError, ValueError):
+            return 0
+
+    def __set_max_freq(self, cpu, freq):
+        # written through agent writer like cgroup files
+        cgroup.write(self.__freq_path(cpu, 'scaling_max_freq'), freq)
+
+    def update(self):
+        if self.is_full_level():
+            self.freq = self.freq_max
+        elif self.is_min_level():
+            self.freq = self.freq_min
+        else:
+            self.freq = int(self.freq_min + (self.freq_max - self.freq_min) *
+                            self.quota_level / Resource.BUGET_LEV_MAX)
+
+    def budgeting(self, containers):
+        if not self.freq_max:
+            return
+
+        cpus = set()
+        cns = []
+        for con in containers:
+            con.update_cpusets()
+            cpus.update(con.cpusets)
+            cns.append(con.name)
+
+        if cpus.issuperset(self.online):
+            # BE workloads are not pinned, capping would slow LC down too
+            if self.verbose:
+                print(datetime.now().isoformat(' ') + ' best effort ' +
+                      'containers share all processors, skip frequency cap')
+            cpus = set()
+
+        for cpu in self.capped - cpus:
+            self.__set_max_freq(cpu, self.freq_max)
+
+        if self.is_full_level():
+            for cpu in cpus:
+                self.__set_max_freq(cpu, self.freq_max)
+            self.capped = set()
+        else:
+            for cpu in cpus:
+                self.__set_max_freq(cpu, self.freq)
+            self.capped = cpus
+
+        if cpus:
+            print(datetime.now().isoformat(' ') +
+                  ' set best effort container ' + ','.join(cns) +
+                  ' max frequency to ' + str(self.freq))
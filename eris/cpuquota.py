@@ -17,8 +17,8 @@
 
 """ This module implements CPU cycle control based on CFS quota """
 
-import subprocess
 from datetime import datetime
+import cgroup
 from mresource import Resource
 
 
@@ -56,30 +56,15 @@ class CpuQuota(Resource):
         self.quota_max = lc_max_util * CpuQuota.CPU_QUOTA_PERCENT
         self.quota_step = self.quota_max / Resource.BUGET_LEV_MAX
 
-    @staticmethod
-    def __get_cfs_period(container):
-        result = subprocess.run(['cat', '/sys/fs/cgroup/cpu/docker/' +
-                                 container.cid + '/cpu.cfs_period_us'],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        res = result.stdout.decode('utf-8').strip()
-        try:
-            period = int(res)
-            return period
-        except ValueError:
-            return 0
-
     def __set_quota(self, container, quota):
-        period = self.__get_cfs_period(container)
+        backend = cgroup.backend()
+        period = backend.cpu_period(container.cgpath)
         if period != 0 and quota != CpuQuota.CPU_QUOTA_DEFAULT\
            and quota != CpuQuota.CPU_QUOTA_MIN:
             rquota = int(quota * period / CpuQuota.CPU_QUOTA_CORE)
         else:
             rquota = quota
-        subprocess.Popen('echo ' + str(rquota) + ' > ' +
-                         '/sys/fs/cgroup/cpu/docker/' +
-                         container.cid + '/cpu.cfs_quota_us',
-                         shell=True)
+        backend.set_quota(container.cgpath, rquota, period)
         print(datetime.now().isoformat(' ') + ' set container ' +
               container.name + ' cpu quota to ' + str(rquota))
 
@@ -89,10 +74,7 @@ class CpuQuota(Resource):
         Set CPU share in container
             share - given CPU share value
         """
-        subprocess.Popen('echo ' + str(share) + ' > ' +
-                         '/sys/fs/cgroup/cpu/docker/' +
-                         container.cid + '/cpu.shares',
-                         shell=True)
+        cgroup.backend().set_share(container.cgpath, share)
         print(datetime.now().isoformat(' ') + ' set container ' +
               container.name + ' cpu share to ' + str(share))
 
@@ -0,0 +1,97 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements BE core isolation control based on cpuset """
+
+import math
+from datetime import datetime
+import cgroup
+from container import format_cpuset
+from mresource import Resource
+
+
+class CpuSet(Resource):
+    """
+    This class is the resource class of BE physical cores, BE workloads are
+    pinned to physical cores whose hyperthread siblings are not used by busy
+    LC workloads, resource level decides how many of those cores BE can use
+    """
+    LC_BUSY_UTIL = 50
+
+    def __init__(self, topology, init_level=Resource.BUGET_LEV_MIN,
+                 verbose=False):
+        super().__init__(init_level)
+        self.topology = topology
+        self.verbose = verbose
+        self.reserved = set()
+        self.cpus = []
+        self.update()
+
+    def update(self):
+        candidates = [core for core in reversed(self.topology.cores)
+                      if core not in self.reserved]
+        if not candidates:
+            # every core is used by LC, keep BE on the last one
+            candidates = self.topology.cores[-1:]
+
+        if self.is_full_level():
+            count = len(candidates)
+        else:
+            count = max(1, int(math.ceil(len(candidates) * self.quota_level /
+                                         Resource.BUGET_LEV_MAX)))
+        cpus = []
+        for core in candidates[:count]:
+            cpus.extend(core)
+        self.cpus = sorted(cpus)
+
+    def update_lc(self, lc_containers, be_containers):
+        """
+        Update physical cores used by busy LC workloads, BE workloads are
+        moved off those cores if they overlap
+            lc_containers - all LC workload containers
+            be_containers - all BE workload containers
+        """
+        online = set(self.topology.cpus)
+        reserved = set()
+        for con in lc_containers:
+            con.update_cpusets()
+            if not con.cpusets or online.issubset(con.cpusets):
+                # LC is not pinned, cpuset can not isolate it from BE
+                continue
+            if con.utils < CpuSet.LC_BUSY_UTIL:
+                continue
+            for cpu in con.cpusets:
+                reserved.add(self.topology.core_of(cpu))
+
+        if reserved != self.reserved:
+            self.reserved = reserved
+            self.update()
+            if be_containers:
+                self.budgeting(be_containers)
+
+    def budgeting(self, containers):
+        cpus = format_cpuset(self.cpus)
+        cns = []
+        for con in containers:
+            cgroup.backend().set_cpuset(con.cgpath, cpus)
+            con.cpusets = list(self.cpus)
+            cns.append(con.name)
+
+        if cns:
+            print(datetime.now().isoformat(' ') +
+                  ' set best effort container ' + ','.join(cns) +
+                  ' cpuset to ' + cpus)
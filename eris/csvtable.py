@@ -0,0 +1,56 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements lightweight loader of small csv files """
+
+import csv
+
+
+def read_table(source, numeric=()):
+    """
+    Read csv file into list of row dicts, agent loads workload configuration
+    and thresholds with it so pandas is not needed at startup
+        source - file path or opened file object
+        numeric - columns converted to float, empty value is NaN
+    """
+    if isinstance(source, str):
+        with open(source, newline='') as csvf:
+            return read_table(csvf, numeric)
+    rows = []
+    for row in csv.DictReader(source):
+        for name in numeric:
+            if name in row:
+                row[name] = float(row[name]) if row[name] else float('nan')
+        rows.append(row)
+    return rows
+
+
+def group_rows(rows, key):
+    """
+    Group rows by value of key column, groups keep order of first row
+        rows - list of row dicts
+        key - key column name
+    """
+    groups = dict()
+    order = []
+    for row in rows:
+        value = row[key]
+        if value not in groups:
+            groups[value] = []
+            order.append(value)
+        groups[value].append(row)
+    return [(value, groups[value]) for value in order]
@@ -0,0 +1,332 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements container discovery """
+
+import ctypes
+import json
+import os
+import re
+import select
+import struct
+from collections import namedtuple
+from datetime import datetime
+import cgroup
+
+
+class DockerDiscovery:
+    """
+    This class discovers containers from docker, container list is cached
+    and refreshed when docker container events are received, it is not
+    cached while event stream is broken
+    """
+
+    def __init__(self):
+        import docker
+        self.client = docker.from_env()
+        self.containers = None
+        self.events = None
+        self.watching = False
+
+    def list(self):
+        """ list all running containers """
+        containers = self.containers
+        if containers is None:
+            containers = self.client.containers.list()
+            if self.watching:
+                self.containers = containers
+        return containers
+
+    @staticmethod
+    def pids(container):
+        """
+        list all process id of one container
+            container - container object listed from docker
+        """
+        res = container.top()
+        procs = res['Processes']
+        pids = []
+        if procs:
+            for pid in procs:
+                pids.append(pid[1])
+        return pids
+
+    @staticmethod
+    def cgpath(container):
+        """
+        get cgroup path of container, None to use default path of backend
+            container - container object listed from docker
+        """
+        return None
+
+    def watch(self):
+        """ return blocking iterator of docker container events """
+        self.events = self.client.events(decode=True,
+                                         filters={'type': 'container'})
+        self.watching = True
+        return self.events
+
+    def handle_event(self, event):
+        """
+        Invalidate cached container list on container life cycle event
+            event - docker event
+        """
+        action = event.get('Action', event.get('status'))
+        if action in ('start', 'die', 'destroy', 'rename', 'pause',
+                      'unpause'):
+            self.containers = None
+
+    def reset(self):
+        """ drop cached container list after event stream breaks """
+        self.watching = False
+        self.containers = None
+
+    def close(self):
+        """ stop watching docker events """
+        if self.events is not None:
+            self.events.close()
+
+
+CgroupContainer = namedtuple('CgroupContainer', ['id', 'name', 'cgpath',
+                                                 'labels'])
+
+# container runtimes create container cgroups with these names, pod sandbox
+# labels are read from OCI bundle config.json written by containerd, docker
+# container name is read from its config.v2.json like docker API lists it
+DEFAULT_RULES = [
+    {'path': r'kubepods[^/]*(/[^/]+)?/[^/]*pod(?P<pod>[0-9a-f_-]+)[^/]*/'
+             r'(cri-containerd-)?(?P<cid>[0-9a-f]{64})(\.scope)?$',
+     'name': '{namespace}/{container}',
+     'bundle': '/run/containerd/io.containerd.runtime.v2.task/k8s.io/{cid}'},
+    {'path': r'(docker/|system\.slice/docker-)(?P<cid>[0-9a-f]{64})'
+             r'(\.scope)?$',
+     'name': '{name}',
+     'bundle': '/var/lib/docker/containers/{cid}'},
+]
+# short label names of kubernetes CRI annotations
+LABEL_ALIASES = {'io.kubernetes.cri.sandbox-namespace': 'namespace',
+                 'io.kubernetes.cri.sandbox-name': 'pod',
+                 'io.kubernetes.cri.container-name': 'container',
+                 'io.kubernetes.cri.container-type': 'type'}
+
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ONLYDIR = 0x1000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class CgroupDiscovery:
+    """
+    This class discovers containers by walking cgroup hierarchy without
+    calling container runtime, cgroup path of each container is matched
+    with path rules and its name is built from path groups and labels in
+    container bundle. Container list is cached and refreshed when inotify
+    reports cgroup directories created or removed, container named by cid
+    because its labels are not readable yet is matched again in next list
+    """
+    MAX_DEPTH = 6
+
+    def __init__(self, rules=None, verbose=False):
+        """
+        Class constructor, arguments include:
+            rules - list of rule dicts, 'path' is regular expression matched
+                    with cgroup path relative to hierarchy root and has cid
+                    group, 'name' is format string of container name with
+                    path groups and labels, optional 'bundle' is format
+                    string of directory of OCI config.json whose
+                    annotations are labels, or of docker config.v2.json
+                    whose labels and name label are used
+            verbose - print discovered containers
+        """
+        self.rules = [(re.compile(rule['path']), rule.get('name', '{cid}'),
+                       rule.get('bundle'))
+                      for rule in (rules if rules else DEFAULT_RULES)]
+        self.verbose = verbose
+        self.root = cgroup.backend().path('cpu', '').rstrip('/')
+        self.containers = None
+        self.known = dict()
+        self.pending = False
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.closed = False
+
+    @staticmethod
+    def load_rules(path):
+        """
+        Load discovery rules from json file
+            path - rule file path, list of rule dicts
+        """
+        with open(path) as rulef:
+            return json.load(rulef)
+
+    def __watch_dir(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'),
+                                         IN_CREATE | IN_DELETE | IN_ONLYDIR)
+        if wd < 0 and self.verbose:
+            print(datetime.now().isoformat(' ') + ' fail to watch ' + path +
+                  ': ' + os.strerror(ctypes.get_errno()))
+
+    @staticmethod
+    def __labels(bundle):
+        try:
+            with open(os.path.join(bundle, 'config.json')) as configf:
+                annotations = json.load(configf).get('annotations', dict())
+        except (IOError, ValueError):
+            try:
+                with open(os.path.join(bundle, 'config.v2.json')) as configf:
+                    config = json.load(configf)
+            except (IOError, ValueError):
+                return dict()
+            labels = dict(config.get('Config', dict()).get('Labels') or {})
+            labels['name'] = config.get('Name', '').lstrip('/')
+            return labels
+        labels = dict(annotations)
+        for name, alias in LABEL_ALIASES.items():
+            if name in annotations:
+                labels[alias] = annotations[name]
+        return labels
+
+    def __match(self, cgpath):
+        """ return (container or None, whether its name is resolved) """
+        for pattern, name, bundle in self.rules:
+            match = pattern.search(cgpath)
+            if match is None:
+                continue
+            values = dict([(key, value) for key, value in
+                           match.groupdict().items() if value is not None])
+            labels = dict()
+            if bundle:
+                labels = CgroupDiscovery.__labels(bundle.format(**values))
+                if labels.get('type') == 'sandbox':
+                    # pod sandbox pause container is not a workload
+                    return None, True
+            values.update(labels)
+            try:
+                return CgroupContainer(values['cid'], name.format(**values),
+                                       cgpath, labels), True
+            except KeyError:
+                return CgroupContainer(values['cid'], values['cid'], cgpath,
+                                       labels), False
+        return None, True
+
+    def __walk(self, path, cgpath, depth, found):
+        self.__watch_dir(path)
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return
+        for name in names:
+            child = os.path.join(path, name)
+            if not os.path.isdir(child):
+                continue
+            child_cgpath = cgpath + '/' + name if cgpath else name
+            if child_cgpath in self.known:
+                container = self.known[child_cgpath]
+            else:
+                container, resolved = self.__match(child_cgpath)
+                # bundle may be written after cgroup is created, fallback
+                # name is not cached and looked up again in next list
+                if resolved:
+                    self.known[child_cgpath] = container
+                else:
+                    self.pending = True
+            if container is not None:
+                found.append(container)
+            elif depth < CgroupDiscovery.MAX_DEPTH:
+                self.__walk(child, child_cgpath, depth + 1, found)
+
+    def list(self):
+        """ list all running containers """
+        containers = self.containers
+        if containers is None:
+            containers = []
+            self.known = dict([(cgpath, container) for cgpath, container in
+                               self.known.items()
+                               if os.path.isdir(self.root + '/' + cgpath)])
+            self.pending = False
+            self.__walk(self.root, '', 0, containers)
+            if not self.pending:
+                self.containers = containers
+            if self.verbose:
+                print(datetime.now().isoformat(' ') + ' discovered ' +
+                      ', '.join([con.name + ' ' + con.cgpath
+                                 for con in containers]))
+        return containers
+
+    @staticmethod
+    def pids(container):
+        """
+        list all process id of one container
+            container - container listed from cgroup hierarchy
+        """
+        try:
+            return cgroup.backend().pids(container.cgpath)
+        except (IOError, OSError):
+            return []
+
+    @staticmethod
+    def cgpath(container):
+        """
+        get cgroup path of container
+            container - container listed from cgroup hierarchy
+        """
+        return container.cgpath
+
+    def watch(self):
+        """ return blocking iterator of cgroup directory events """
+        while not self.closed:
+            try:
+                readable, _, _ = select.select([self.fd], [], [], 1)
+                if not readable:
+                    continue
+                data = os.read(self.fd, 65536)
+            except (OSError, ValueError):
+                # descriptor is closed on shutdown or no event is left
+                continue
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset = offset + INOTIFY_EVENT.size + length
+                yield mask
+
+    def handle_event(self, event):
+        """
+        Invalidate cached container list when cgroup directory is created
+        or removed, whole hierarchy is matched again when inotify queue
+        overflows as events are lost
+            event - inotify event mask
+        """
+        if event & IN_Q_OVERFLOW:
+            self.known = dict()
+            self.containers = None
+        elif event & (IN_CREATE | IN_DELETE):
+            self.containers = None
+
+    def reset(self):
+        """ drop cached container list after event stream breaks """
+        self.containers = None
+
+    def close(self):
+        """ stop watching cgroup directories """
+        self.closed = True
+        os.close(self.fd)
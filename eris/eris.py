@@ -20,21 +20,38 @@
 
 import os
 import argparse
+import asyncio
+import math
+import platform
 import subprocess
-from datetime import datetime
-import threading
-import time
 import sys
-import traceback
-import pandas as pd
-import docker
-import numpy as np
-from container import Contention, Container
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+import cgroup
+import checkpoint
+import llcoccup
+from container import Contention, Container, SAMPLE_METRICS, STATS,\
+    EVENTS, stat_column, set_events, event_columns
 from mresource import Resource
 from cpuquota import CpuQuota
 from llcoccup import LlcOccup
-from naivectrl import NaiveController
-from prometheus import PrometheusClient
+from membw import MemBw
+from cpufreq import CpuFreq
+from cpuset import CpuSet
+from topology import CpuTopology
+from naivectrl import NaiveController, PerSocketController
+from collector import PgosCollector, PerfCollector
+from perfmon import GROUP_SIZE, HW_EVENTS, group_events, parse_events
+from fastpath import FastPathDetector
+from nodemetrics import NodeMetrics
+from replay import ReplayBackend, ReplayRecorder, read_traces
+from csvtable import read_table, group_rows
+from sampling import SamplingPolicy
+from selfmon import SelfMonitor, process_age, read_stat
+from shmsnap import SnapshotWriter
+from scheduler import Scheduler
+from instrument import AgentStats
 
 
 class Context:
@@ -50,30 +67,82 @@ class Context:
         self.be_set = {}
         self.cpuq = None
         self.llc = None
+        self.mba = None
+        self.cpuf = None
+        self.cpuset = None
         self.controllers = {}
+        self.sockets = []
+        self.socket_res = dict()
         self.util_cons = dict()
         self.metric_cons = dict()
         self.thresh_map = dict()
         self.tdp_thresh_map = dict()
+        self.mvmodel = None
+        self.sampling = None
+        self.selfmon = None
+        self.shm = None
+        self.sku = ''
+        self.node_name = ''
         self.prometheus = None
-
-
-def set_metrics(ctx, data):
+        self.scheduler = None
+        self.discovery = None
+        self.collector = None
+        self.fastpath = None
+        self.node = None
+        self.store = None
+        self.restored = {'util': dict(), 'metric': dict()}
+        self.fastpath_timeout = 0
+        self.stats = AgentStats()
+
+
+THRESH_COLUMNS = ('UTIL_START', 'UTIL_END', 'CPI_THRESH', 'MPKI_THRESH',
+                  'MB_THRESH')
+TDP_COLUMNS = ('UTIL', 'MEAN', 'STD', 'BAR')
+REPLAY_COLUMNS = [('cycles', 'CYC'), ('instructions', 'INST'),
+                  ('LLC misses', 'L3MISS'), ('LLC occupancy', 'L3OCC'),
+                  ('Memory bandwidth local', 'MBL'),
+                  ('Memory bandwidth remote', 'MBR')]
+SOCKET_COLUMNS = {'LLC occupancy': 'L3OCC', 'Memory bandwidth local': 'MBL',
+                  'Memory bandwidth remote': 'MBR'}
+# multiple of monitor intervals while agent overhead is backed off
+BACKOFF_STRETCH = 2
+# minimal share of LC workload LLC occupancy or memory bandwidth on a
+# socket for its contention to be attributed and controlled on that socket
+SOCKET_SHARE = 0.2
+
+
+def set_metrics(ctx, data, window=None, shed=False, recorded=None,
+                sampled=None):
     """
-    This function collect metrics from pgos tool and trigger resource
-    contention detection and control
+    This function collect metrics from metrics collector and trigger resource
+    contention detection and control, return dict of container id to
+    contentions detected on LC containers
         ctx - agent context
-        data - metrics data collected from pgos
+        data - list of metrics records collected in each sample, record is
+               (cid, metric, timestamp, value) tuple
+        window - seconds platform counters were counted in this metrics
+                 cycle, metric interval is used if not given
+        shed - skip optional work such as recording if True
+        recorded - dict of container id to recorded metrics which override
+                   collected ones, used in replay
+        sampled - ids of containers sampled in this cycle, metrics of
+                  other containers are not fresh and skipped, all
+                  containers are sampled if None
     """
     timestamp = datetime.now()
-    for line in data:
-        items = line.split('\t')
-        if len(items) >= 4:
-            cid = items[0]
-            metric_name = items[1]
-            val = items[3]
-            container = ctx.metric_cons[cid]
-            metrics = container.get_metrics()
+    if window is None:
+        window = ctx.args.metric_interval
+    record = ctx.args.record and not shed
+    stats = ctx.stats
+    parse_start = time.perf_counter()
+    samples = dict()
+    event_names = dict([(event.name, event.column) for event in EVENTS])
+    for records in data:
+        values = dict()
+        for cid, metric_name, _, val in records:
+            if cid not in ctx.metric_cons:
+                continue
+            metrics = values.setdefault(cid, dict())
             if metric_name == 'cycles':
                 metrics['CYC'] = int(val)
             elif metric_name == 'instructions':
@@ -86,11 +155,30 @@ def set_metrics(ctx, data):
                 metrics['MBL'] = float(val)
             elif metric_name == 'Memory bandwidth remote':
                 metrics['MBR'] = float(val)
+            elif metric_name in event_names:
+                metrics[event_names[metric_name]] = int(float(val))
+            elif ':' in metric_name:
+                name, socket = metric_name.rsplit(':', 1)
+                if name in SOCKET_COLUMNS:
+                    sockets = metrics.setdefault('SOCKETS', dict())
+                    sockets.setdefault(int(socket), dict())[
+                        SOCKET_COLUMNS[name]] = float(val)
+        for cid, metrics in values.items():
+            samples.setdefault(cid, []).append(metrics)
+    for cid, metrics in samples.items():
+        ctx.metric_cons[cid].update_samples(metrics)
+        if recorded and cid in recorded:
+            ctx.metric_cons[cid].get_metrics().update(recorded[cid])
+    stats.observe('metric_parse', time.perf_counter() - parse_start)
 
     contention = {Contention.LLC: False, Contention.MEM_BW: False,
-                  Contention.UNKN: False}
+                  Contention.UNKN: False, Contention.TDP: False}
     contention_map = {}
+    detected = {}
+    snapshot = []
+    lcs = []
     bes = []
+    scored = []
     findbe = False
     for cid, con in ctx.metric_cons.items():
         if ctx.args.key_cid:
@@ -99,91 +187,241 @@ def set_metrics(ctx, data):
             key = con.name
 
         if key in ctx.lc_set:
-            con.update_cpu_usage()
+            lcs.append(con)
+            with stats.phase('cgroup_read'):
+                con.update_cpu_usage()
             metrics = con.get_metrics()
-            if metrics:
-                metrics['TIME'] = timestamp
-                if metrics['INST'] == 0:
-                    metrics['CPI'] = 0
-                    metrics['L3MPKI'] = 0
-                else:
-                    metrics['CPI'] = metrics['CYC'] / metrics['INST']
-                    metrics['L3MPKI'] = metrics['L3MISS'] * 1000 /\
-                        metrics['INST']
-                if con.utils == 0:
-                    metrics['NF'] = 0
-                else:
-                    metrics['NF'] = int(metrics['CYC'] /
-                                        ctx.args.metric_interval /
-                                        10000 / con.utils)
+            if metrics and (sampled is None or cid in sampled):
+                calc_metrics(con, timestamp, window)
                 if ctx.args.detect:
                     con.update_metrics_history()
 
-                if ctx.args.record:
-                    with open('./metrics.csv', 'a') as metricf:
+                if record:
+                    with stats.phase('record'), \
+                            open('./metrics.csv', 'a') as metricf:
                         metricf.write(str(con))
+                if ctx.store and not shed:
+                    with stats.phase('record'):
+                        store_metrics(ctx.store, con)
 
-                    if ctx.args.enable_prometheus:
-                        ctx.prometheus.send_metrics(con.name, con.utils,
-                                                    metrics['CYC'],
-                                                    metrics['L3MISS'],
-                                                    metrics['INST'],
-                                                    metrics['NF'],
-                                                    metrics['MBR'] +
-                                                    metrics['MBL'],
-                                                    metrics['L3OCC'], 0)
-
+                contentions = set()
                 if ctx.args.detect:
-                    contend = con.contention_detect()
+                    with stats.phase('detect'):
+                        contend = con.contention_detect()\
+                            if ctx.mvmodel is None else None
+                        tdp_contend = con.tdp_contention_detect()
                     if_contended = False
 
                     if contend is not None:
                         if_contended = True
                         contention[contend] = True
+                        contentions.add(contend)
 
-                    tdp_contend = con.tdp_contention_detect()
                     if tdp_contend is not None:
                         if_contended = True
                         contention[tdp_contend] = True
+                        contentions.add(tdp_contend)
 
                     if if_contended:
                         contention_map[con] = contention.copy()
+                        detected[cid] = contentions
+                    if ctx.mvmodel:
+                        scored.append((key, con, contentions))
+
+                if ctx.prometheus or ctx.shm:
+                    snapshot.append((cid, con.name, 'LC', metrics.copy(),
+                                     contentions))
 
         if key in ctx.be_set:
             findbe = True
             bes.append(con)
+            if ctx.args.collect_be and con.get_metrics() and\
+               (sampled is None or cid in sampled):
+                with stats.phase('cgroup_read'):
+                    con.update_cpu_usage()
+                calc_metrics(con, timestamp, window)
+                if ctx.args.detect:
+                    con.update_metrics_history()
+                if ctx.prometheus or ctx.shm:
+                    snapshot.append((cid, con.name, 'BE',
+                                     con.get_metrics().copy(), set()))
+
+    if scored:
+        # all LC containers are scored in one pass
+        with stats.phase('detect'):
+            results = ctx.mvmodel.detect([con for _, con, _ in scored],
+                                         [key for key, _, _ in scored])
+        for (_, con, contentions), contend in zip(scored, results):
+            if contend is not None:
+                contention[contend] = True
+                contentions.add(contend)
+                contention_map[con] = contention.copy()
+                detected[con.cid] = contentions
+
+    if ctx.prometheus:
+        ctx.prometheus.update_metrics(snapshot)
+        if ctx.node:
+            ctx.prometheus.update_node(ctx.node.sockets)
+    if ctx.shm:
+        ctx.shm.update_metrics(snapshot)
 
     if ctx.args.detect:
+        attribute_start = time.perf_counter()
         for container_contended, contention_list in contention_map.items():
             for contention_type, contention_type_if_happened\
                     in contention_list.items():
                 if contention_type_if_happened and\
                    contention_type != Contention.UNKN:
-                    resource_delta_max = -np.Inf
-                    suspect = "unknown"
-
-                    for cid, container in ctx.metric_cons.items():
-                        delta = 0
-                        if cid == container_contended.cid:
-                            continue
-                        if contention_type == Contention.LLC:
-                            delta = container.get_llcoccupany_delta()
-                        elif contention_type == Contention.MEM_BW:
-                            delta = container.get_latest_mbt()
-                        elif contention_type == Contention.TDP:
-                            delta = container.get_freq_delta()
-
-                        if delta > 0 and delta > resource_delta_max:
-                            resource_delta_max = delta
-                            suspect = container.name
-
-                    print('Contention %s for container %s: Suspect is %s' %
-                          (contention_type, container_contended.name, suspect))
+                    sockets = None
+                    if ctx.args.per_socket and\
+                       contention_type != Contention.TDP:
+                        sockets = container_contended.active_sockets(
+                            SOCKET_SHARE)
+                    for socket in sockets if sockets else [None]:
+                        suspect = find_suspect(ctx, container_contended,
+                                               contention_type, socket)
+                        print('Contention %s for container %s: Suspect is %s'
+                              % (contention_type, container_contended.name,
+                                 suspect) + ('' if socket is None else
+                                             ' on socket ' + str(socket)))
+                    if ctx.node and contention_type == Contention.MEM_BW:
+                        print('Node memory bandwidth headroom ' +
+                              '{:.0%}'.format(ctx.node.mb_headroom_ratio()) +
+                              ', per socket (MB/s) ' + ', '.join(
+                                  [str(socket) + ': ' +
+                                   '{:.1f}'.format(metrics['MB_HEADROOM'])
+                                   for socket, metrics in
+                                   sorted(ctx.node.sockets.items())]))
+                    elif ctx.node and contention_type == Contention.LLC:
+                        print('Node LLC headroom (KB) ' + ', '.join(
+                            [str(socket) + ': ' +
+                             str(metrics['LLC_HEADROOM'])
+                             for socket, metrics in
+                             sorted(ctx.node.sockets.items())]))
+        stats.observe('attribute', time.perf_counter() - attribute_start)
+
+    with stats.phase('control'):
+        if findbe and ctx.args.control and ctx.args.detect and ctx.fastpath:
+            quota_controller = ctx.controllers[Contention.CPU_CYC]
+            if quota_controller.provisional:
+                confirmed = True in contention.values()
+                quota_controller.confirm(bes, confirmed)
+                stats.count('fastpath_confirm' if confirmed else
+                            'fastpath_release')
+
+        if ctx.cpuset and ctx.args.control:
+            ctx.cpuset.update_lc(lcs, bes)
+
+        if findbe and ctx.args.control:
+            socket_contention = contended_sockets(ctx, detected)
+            for contention, flag in contention.items():
+                if contention in ctx.socket_res:
+                    flag = socket_contention.get(contention, set())
+                if contention in ctx.controllers:
+                    ctx.controllers[contention].update(bes, flag, False)
+    if ctx.shm:
+        publish_snapshot(ctx)
+    return detected
+
+
+def publish_snapshot(ctx):
+    """
+    Publish latest container state and controller levels to shared memory
+        ctx - agent context
+    """
+    levels = dict()
+    for contention, controller in ctx.controllers.items():
+        for suffix, level in controller.levels().items():
+            levels[contention.name + suffix] = level
+    with ctx.stats.phase('publish'):
+        ctx.shm.publish(levels)
+
+
+def find_suspect(ctx, contended, contention_type, socket=None):
+    """
+    Find name of container whose usage of contended resource increases most
+        ctx - agent context
+        contended - LC container suffering contention
+        contention_type - detected contention
+        socket - socket id to compare usage on, whole node if None
+    """
+    resource_delta_max = -math.inf
+    suspect = "unknown"
+    for cid, container in ctx.metric_cons.items():
+        delta = 0
+        if cid == contended.cid:
+            continue
+        # containers without per socket metrics are compared by total
+        on = socket if container.sockets else None
+        if contention_type == Contention.LLC:
+            delta = container.get_llcoccupany_delta(on)
+        elif contention_type == Contention.MEM_BW:
+            delta = container.get_latest_mbt(on)
+        elif contention_type == Contention.TDP:
+            delta = container.get_freq_delta()
+
+        if delta > 0 and delta > resource_delta_max:
+            resource_delta_max = delta
+            suspect = container.name
+    return suspect
+
+
+def contended_sockets(ctx, detected):
+    """
+    Get dict of contention to set of sockets it is detected on, contention
+    of LC container without per socket metrics applies to all sockets
+        ctx - agent context
+        detected - dict of container id to contentions detected on LC
+                   containers
+    """
+    socket_contention = dict()
+    for cid, contentions in detected.items():
+        sockets = ctx.metric_cons[cid].active_sockets(SOCKET_SHARE)
+        for contention in contentions:
+            socket_contention.setdefault(contention, set()).update(
+                sockets if sockets else ctx.sockets)
+    return socket_contention
 
-    if findbe and ctx.args.control:
-        for contention, flag in contention.items():
-            if contention in ctx.controllers:
-                ctx.controllers[contention].update(bes, flag, False)
+
+def store_metrics(store, con):
+    """
+    Append latest platform metrics of container into metrics store
+        store - metrics store
+        con - container with calculated metrics
+    """
+    values = dict(con.get_metrics())
+    values['UTIL'] = con.utils
+    store.append(store.METRIC, values['TIME'].timestamp(), con.cid,
+                 con.name, values)
+
+
+def calc_metrics(con, timestamp, window):
+    """
+    Calculate derived platform metrics of container from collected counters
+        con - container with collected metrics
+        timestamp - time of this metrics cycle
+        window - seconds platform counters were counted in this cycle
+    """
+    metrics = con.get_metrics()
+    metrics['TIME'] = timestamp
+    if metrics['INST'] == 0:
+        metrics['CPI'] = 0
+        metrics['L3MPKI'] = 0
+    else:
+        metrics['CPI'] = metrics['CYC'] / metrics['INST']
+        metrics['L3MPKI'] = metrics['L3MISS'] * 1000 / metrics['INST']
+    for event in EVENTS:
+        if event.column not in metrics:
+            metrics.pop(event.metric, None)
+            continue
+        base = metrics[event.per]
+        scale = 1000 if event.per == 'INST' else 1
+        metrics[event.metric] = metrics[event.column] * scale / base\
+            if base else 0
+    if con.utils == 0:
+        metrics['NF'] = 0
+    else:
+        metrics['NF'] = int(metrics['CYC'] / window / 10000 / con.utils)
 
 
 def remove_finish_containers(containers, consmap):
@@ -201,64 +439,111 @@ def remove_finish_containers(containers, consmap):
             del consmap[cid]
 
 
-def list_docker_containers():
-    """ list all containers from docker """
-    client = docker.from_env()
-    return client.containers.list()
+def workload_type(ctx, key):
+    """
+    Get workload type of container
+        ctx - agent context
+        key - container key in workload configuration
+    """
+    if key in ctx.lc_set:
+        return 'LC'
+    if key in ctx.be_set:
+        return 'BE'
+    return ''
 
 
-def list_pids(con):
+def append_file(path, text):
     """
-    list all process id of one container
-        con - container object listed from docker
+    Append text to record file
+        path - record file path
+        text - text to be appended
     """
-    res = con.top()
-    procs = res['Processes']
-    pids = []
-    if procs:
-        for pid in procs:
-            pids.append(pid[1])
-    return pids
+    with open(path, 'a') as recf:
+        recf.write(text)
 
 
-def mon_util_cycle(ctx):
+def update_cgroup_stats(cons, timestamp, cpu_stat=False):
     """
-    CPU utilization monitor timer function
+    Update CPU usage and pressure stall information of containers
+        cons - container list
+        timestamp - monotonic time of this sample
+        cpu_stat - update CFS throttling statistics if True
+    """
+    for con in cons:
+        con.update_cpu_usage(timestamp)
+        con.update_pressure()
+        if cpu_stat:
+            con.update_cpu_stat()
+
+
+def fast_path_detect(ctx, cons, bes):
+    """
+    Detect likely contention of LC workloads in utilization cycle and
+    throttle BE workloads until perf based detection confirms it
+        ctx - agent context
+        cons - list of (key, container) in utilization cycle
+        bes - all BE workload containers
+    """
+    reasons = []
+    for key, con in cons:
+        if key in ctx.lc_set:
+            reason = ctx.fastpath.detect(con, ctx.metric_cons.get(con.cid))
+            if reason:
+                reasons.append(con.name + ' (' + reason + ')')
+    if reasons and ctx.controllers[Contention.CPU_CYC].preempt(
+            bes, ctx.fastpath_timeout):
+        print(datetime.now().isoformat(' ') + ' fast path contention ' +
+              'detected on ' + ', '.join(reasons) +
+              ', throttle best effort containers until confirmed')
+        ctx.stats.count('fastpath_throttle')
+
+
+def util_container(ctx, cid, name, cgpath=None):
+    """
+    Get container of utilization cycle, CPU quota and share of container
+    are initialized when it is created or its name is resolved
+        ctx - agent context
+        cid - container id
+        name - container name
+        cgpath - cgroup path of container, default path of cgroup backend
+                 if None
+    """
+    if ctx.args.key_cid:
+        key = cid
+    else:
+        key = name
+    if cid in ctx.util_cons:
+        con = ctx.util_cons[cid]
+        if con.name == name:
+            return key, con
+        # discovery resolves name after container is listed by its id
+        con.name = name
+    else:
+        con = Container(cid, name, [], ctx.args.verbose, cgpath=cgpath)
+        restore_container(ctx, 'util', con)
+        ctx.util_cons[cid] = con
+    if ctx.args.control:
+        if key in ctx.be_set:
+            ctx.cpuq.budgeting([con])
+            ctx.cpuq.set_share(con, CpuQuota.CPU_SHARE_BE)
+        else:
+            ctx.cpuq.set_share(con, CpuQuota.CPU_SHARE_LC)
+    return key, con
+
+
+def set_utils(ctx, cons):
+    """
+    This function takes CPU utilization of containers in one cycle, update
+    system maximal utilization and regulate BE CPU cycles, return total
+    utilization of LC workloads
         ctx - agent context
+        cons - list of (key, container) with updated utilization
     """
     findbe = False
     lc_utils = 0
     be_utils = 0
-    date = datetime.now().isoformat()
     bes = []
-    containers = list_docker_containers()
-    remove_finish_containers(containers, ctx.util_cons)
-
-    for container in containers:
-        cid = container.id
-        name = container.name
-        pids = list_pids(container)
-        if ctx.args.key_cid:
-            key = cid
-        else:
-            key = name
-        if cid in ctx.util_cons:
-            con = ctx.util_cons[cid]
-        else:
-            con = Container(cid, name, pids, ctx.args.verbose)
-            ctx.util_cons[cid] = con
-            if ctx.args.control:
-                if key in ctx.be_set:
-                    ctx.cpuq.budgeting([con])
-                    ctx.cpuq.set_share(con, CpuQuota.CPU_SHARE_BE)
-                else:
-                    ctx.cpuq.set_share(con, CpuQuota.CPU_SHARE_LC)
-        con.update_cpu_usage()
-        if ctx.args.record:
-            with open('./util.csv', 'a') as utilf:
-                utilf.write(date + ',' + cid + ',' + name +
-                            ',' + str(con.utils) + '\n')
-
+    for key, con in cons:
         if key in ctx.lc_set:
             lc_utils = lc_utils + con.utils
 
@@ -267,12 +552,6 @@ def mon_util_cycle(ctx):
             be_utils = be_utils + con.utils
             bes.append(con)
 
-    loadavg = os.getloadavg()[0]
-    if ctx.args.record:
-        with open('./util.csv', 'a') as utilf:
-            utilf.write(date + ',,lcs,' + str(lc_utils) + '\n')
-            utilf.write(date + ',,loadavg1m,' + str(loadavg) + '\n')
-
     if lc_utils > ctx.sysmax_util:
         update_sysmax(ctx, lc_utils)
         if ctx.args.control:
@@ -282,95 +561,338 @@ def mon_util_cycle(ctx):
         exceed, hold = ctx.cpuq.detect_margin_exceed(lc_utils, be_utils)
         if not ctx.args.enable_hold:
             hold = False
-        ctx.controllers[Contention.CPU_CYC].update(bes, exceed, hold)
+        if ctx.fastpath:
+            with ctx.stats.phase('fast_path'):
+                fast_path_detect(ctx, cons, bes)
+        with ctx.stats.phase('control'):
+            ctx.controllers[Contention.CPU_CYC].update(bes, exceed, hold)
+    return lc_utils
 
 
-def mon_metric_cycle(ctx):
+async def mon_util_cycle(ctx, tick):
     """
-    Platform metrics monitor timer function
+    CPU utilization monitor timer function
         ctx - agent context
+        tick - ticker of this cycle
     """
-    cgps = []
-    new_bes = []
-    containers = list_docker_containers()
-    remove_finish_containers(containers, ctx.metric_cons)
+    record = ctx.args.record and not tick.behind
+    date = datetime.now().isoformat()
+    records = []
+    snapshot = []
+    with ctx.stats.phase('docker_list'):
+        containers = await ctx.scheduler.run_blocking(ctx.discovery.list)
+    remove_finish_containers(containers, ctx.util_cons)
 
-    for container in containers:
-        cid = container.id
-        name = container.name
-        pids = list_pids(container)
-        if ctx.args.key_cid:
-            key = cid
-        else:
-            key = name
-        if cid in ctx.metric_cons:
-            con = ctx.metric_cons[cid]
-            con.update_pids(pids)
-        else:
-            thresh = ctx.thresh_map.get(key, [])
-            tdp_thresh = ctx.tdp_thresh_map.get(key, [])
-            con = Container(cid, name, pids, ctx.args.verbose,
-                            thresh, tdp_thresh)
-            ctx.metric_cons[cid] = con
-            con.update_cpu_usage()
-            if key in ctx.be_set and ctx.args.control\
-               and not ctx.args.disable_cat:
-                new_bes.append(con)
+    cons = [util_container(ctx, container.id, container.name,
+                           ctx.discovery.cgpath(container))
+            for container in containers]
+    # checkpoint state of containers not running any more is dropped
+    ctx.restored['util'].clear()
+
+    with ctx.stats.phase('cgroup_read'):
+        await ctx.scheduler.run_blocking(update_cgroup_stats,
+                                         [con for _, con in cons], tick.now,
+                                         ctx.fastpath is not None)
+    store = ctx.store if not tick.behind else None
+    wall = time.time()
+    for key, con in cons:
+        if record:
+            records.append(date + ',' + con.cid + ',' + con.name +
+                           ',' + str(con.utils) + '\n')
+        if store:
+            store.append(store.UTIL, wall, con.cid, con.name,
+                         {'UTIL': con.utils})
+
+        if ctx.prometheus or ctx.shm:
+            snapshot.append((con.cid, con.name, workload_type(ctx, key),
+                             con.utils, con.pressure))
+
+    if ctx.prometheus:
+        ctx.prometheus.update_utils(snapshot)
+    if ctx.shm:
+        ctx.shm.update_utils(snapshot)
+
+    lc_utils = set_utils(ctx, cons)
+    if ctx.shm:
+        publish_snapshot(ctx)
 
-        if key in ctx.lc_set:
-            cgps.append('/sys/fs/cgroup/perf_event/docker/' + cid)
+    loadavg = os.getloadavg()[0]
+    if record:
+        records.append(date + ',,lcs,' + str(lc_utils) + '\n')
+        records.append(date + ',,loadavg1m,' + str(loadavg) + '\n')
+        with ctx.stats.phase('record'):
+            await ctx.scheduler.run_blocking(append_file, './util.csv',
+                                             ''.join(records))
+    if store:
+        store.append(UTIL, wall, '', 'lcs', {'UTIL': lc_utils})
+        store.append(UTIL, wall, '', 'loadavg1m',
+                     {'UTIL': loadavg})
+
+
+async def log_stats(ctx, tick):
+    """
+    Agent statistics log timer function
+        ctx - agent context
+        tick - ticker of this cycle
+    """
+    if tick.ticks > 1:
+        print(datetime.now().isoformat(' ') + ' stats ' + ctx.stats.summary())
 
-    if new_bes:
-        ctx.llc.budgeting(new_bes)
 
-    if cgps:
-        period = str(ctx.args.metric_interval - 2)
-        result = subprocess.run(['./pgos', '-cgroup', ','.join(cgps),
-                                 '-period', period, '-frequency', period,
-                                 '-cycle', '1', '-core', str(os.cpu_count())],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        data = result.stdout.decode('utf-8').splitlines()
-        if ctx.args.verbose:
-            print(result.stdout.decode('utf-8'))
-        set_metrics(ctx, data)
+async def mon_self_cycle(ctx, tick):
+    """
+    Agent self monitor timer function
+        ctx - agent context
+        tick - ticker of this cycle
+    """
+    ctx.selfmon.check(tick.elapsed)
 
 
-def monitor(func, ctx, interval):
+def set_verbose(ctx, verbose):
     """
-    wrap schedule timer function
+    Turn verbose output of agent and its components on or off
         ctx - agent context
-        interval - timer interval
+        verbose - print verbose output if True
+    """
+    ctx.args.verbose = verbose
+    for component in (ctx.cpuq, ctx.cpuset, ctx.cpuf, ctx.fastpath,
+                      ctx.collector, ctx.node, ctx.mvmodel, ctx.sampling,
+                      ctx.selfmon):
+        if component is not None:
+            component.verbose = verbose
+    for cons in (ctx.util_cons, ctx.metric_cons):
+        for con in cons.values():
+            con.verbose = verbose
+
+
+def stretch_intervals(ctx, factor):
     """
-    next_time = time.time()
-    while not ctx.interrupt:
-        func(ctx)
-        while True:
-            next_time += interval
-            delta = next_time - time.time()
-            if delta > 0:
-                break
-        time.sleep(delta)
+    Stretch utilization and platform metrics monitor intervals, only idle
+    gap between metrics collections grows, each collection still counts for
+    configured metric interval so metrics are normalized by the same window
+        ctx - agent context
+        factor - multiple of configured intervals, 1 to restore them
+    """
+    for ticker in ctx.scheduler.tickers:
+        if ticker.name == mon_util_cycle.__name__:
+            ticker.interval = ctx.args.util_interval * factor
+        elif ticker.name == mon_metric_cycle.__name__:
+            ticker.interval = ctx.args.metric_interval * factor
+
+
+def init_selfmon(ctx):
+    """
+    Initialize agent self monitor, backoff steps are turning off verbose
+    output, dropping trace recording and extra metrics samples and then
+    stretching monitor intervals
+        ctx - agent context
+    """
+    args = ctx.args
+    ctx.selfmon = SelfMonitor(args.cpu_budget, args.rss_budget,
+                              verbose=args.verbose)
+    if args.verbose:
+        ctx.selfmon.add_step('verbose output off',
+                             lambda: set_verbose(ctx, False),
+                             lambda: set_verbose(ctx, True))
+    record = args.record
+    samples = args.samples
+    if record or samples > 1:
+        def fidelity(full):
+            args.record = record if full else False
+            args.samples = samples if full else 1
+        ctx.selfmon.add_step('recording and extra samples off',
+                             lambda: fidelity(False), lambda: fidelity(True))
+    ctx.selfmon.add_step('monitor intervals x' + str(BACKOFF_STRETCH),
+                         lambda: stretch_intervals(ctx, BACKOFF_STRETCH),
+                         lambda: stretch_intervals(ctx, 1))
+
+
+def metric_container(ctx, cid, name, pids, cgpath=None):
+    """
+    Get container of metrics cycle, return (key, container, is new) turple,
+    container whose name is resolved after it is listed is also new
+        ctx - agent context
+        cid - container id
+        name - container name
+        pids - process ids of container
+        cgpath - cgroup path of container, default path of cgroup backend
+                 if None
+    """
+    if ctx.args.key_cid:
+        key = cid
+    else:
+        key = name
+    thresh = ctx.thresh_map.get(key, [])
+    tdp_thresh = ctx.tdp_thresh_map.get(key, [])
+    if cid in ctx.metric_cons:
+        con = ctx.metric_cons[cid]
+        con.update_pids(pids)
+        if con.name == name:
+            return key, con, False
+        # discovery resolves name after container is listed by its id
+        con.name = name
+        con.set_thresh(thresh, tdp_thresh)
+        return key, con, True
+
+    con = Container(cid, name, pids, ctx.args.verbose,
+                    thresh, tdp_thresh, cgpath=cgpath,
+                    stat=ctx.args.detect_stat)
+    restore_container(ctx, 'metric', con)
+    ctx.metric_cons[cid] = con
+    con.update_cpu_usage()
+    return key, con, True
+
+
+def budget_new_bes(ctx, new_bes, bes):
+    """
+    Apply current resource levels on newly started BE containers
+        ctx - agent context
+        new_bes - new BE workload containers
+        bes - all BE workload containers
+    """
+    if not ctx.args.disable_cat and ctx.llc:
+        ctx.llc.budgeting(new_bes)
+    if ctx.mba:
+        ctx.mba.budgeting(new_bes)
+    for resources in ctx.socket_res.values():
+        for res in resources.values():
+            res.budgeting(new_bes)
+    if ctx.cpuset:
+        ctx.cpuset.budgeting(new_bes)
+    if ctx.cpuf and not ctx.cpuf.is_full_level():
+        ctx.cpuf.budgeting(bes)
+
+
+async def mon_metric_cycle(ctx, tick):
+    """
+    Platform metrics monitor timer function
+        ctx - agent context
+        tick - ticker of this cycle
+    """
+    mons = []
+    bes = []
+    new_bes = []
+    with ctx.stats.phase('docker_list'):
+        containers = await ctx.scheduler.run_blocking(ctx.discovery.list)
+    remove_finish_containers(containers, ctx.metric_cons)
+    with ctx.stats.phase('pid_list'):
+        pids_list = await asyncio.gather(*[
+            ctx.scheduler.run_blocking(ctx.discovery.pids, container)
+            for container in containers])
+
+    for container, pids in zip(containers, pids_list):
+        key, con, new = metric_container(ctx, container.id, container.name,
+                                         pids,
+                                         ctx.discovery.cgpath(container))
+        if key in ctx.be_set:
+            bes.append(con)
+            if new and ctx.args.control:
+                new_bes.append(con)
+
+        if key in ctx.lc_set or (key in ctx.be_set and ctx.args.collect_be):
+            mons.append(con)
+
+    ctx.restored['metric'].clear()
+    if new_bes:
+        budget_new_bes(ctx, new_bes, bes)
+
+    if mons:
+        collected = mons
+        sampled = None
+        if ctx.sampling:
+            utils = dict([(cid, con.utils)
+                          for cid, con in ctx.util_cons.items()])
+            collected = ctx.sampling.select(mons, utils)
+            sampled = set([con.cid for con in collected])
+            ctx.stats.count('metric_skipped', len(mons) - len(collected))
+        with ctx.stats.phase('metric_collect'):
+            if ctx.node:
+                ctx.node.begin()
+            start = time.monotonic()
+            # collection length follows configured interval, not ticker
+            # interval which is stretched in overhead backoff
+            data = await ctx.collector.collect(
+                collected, (ctx.args.metric_interval - 2) / ctx.args.samples,
+                ctx.args.samples, keep=set([con.cid for con in mons]))
+            if ctx.node:
+                ctx.node.end(time.monotonic() - start)
+        ctx.stats.count('metric_records',
+                        sum([len(records) for records in data]))
+        # counters cover collection window only, tick spacing grows on
+        # overruns and backoff
+        detected = set_metrics(ctx, data, ctx.collector.window, tick.behind,
+                               sampled=sampled)
+        if ctx.sampling:
+            ctx.sampling.update(collected, utils, detected, tick.elapsed)
 
 
 def init_threshbins(jdata):
     """
-    Initialize thresholds in all bins for one workload
-        jdata - thresholds data for one workload
+    Initialize thresholds in all bins for one workload, thresholds of
+    additional event metrics are kept if models have them
+        jdata - threshold rows of one workload sorted by utilization
     """
     threshbins = []
-    for row_turple in jdata.iterrows():
-        row = row_turple[1]
+    for row in jdata:
         thresh = dict()
         thresh['util_start'] = row['UTIL_START']
         thresh['util_end'] = row['UTIL_END']
         thresh['cpi'] = row['CPI_THRESH']
         thresh['mpki'] = row['MPKI_THRESH']
         thresh['mb'] = row['MB_THRESH']
+        for event in EVENTS:
+            if event.metric + '_THRESH' in row:
+                thresh[event.metric] = row[event.metric + '_THRESH']
         threshbins.append(thresh)
     return threshbins
 
 
+def cpu_model(cpuinfo='/proc/cpuinfo'):
+    """ get processor model name, it is default SKU of node """
+    try:
+        with open(cpuinfo) as cpuinfof:
+            for line in cpuinfof:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return ''
+
+
+def init_node(ctx):
+    """
+    Initialize SKU and name of node used to select fleet models
+        ctx - agent context
+    """
+    ctx.sku = ctx.args.sku if ctx.args.sku is not None else cpu_model()
+    ctx.node_name = ctx.args.node_name if ctx.args.node_name is not None\
+        else platform.node()
+    if ctx.args.verbose:
+        print('node ' + ctx.node_name + ' SKU ' + ctx.sku)
+
+
+def select_models(ctx, model_df, key):
+    """
+    Select thresholds of this node from model file, fleet models built by
+    analyze.py have SKU and NODE columns, node specific thresholds of a
+    workload override thresholds of its workload class on node SKU
+        ctx - agent context
+        model_df - threshold rows
+        key - workload key column
+    """
+    if not model_df or 'SKU' not in model_df[0]:
+        return model_df
+    model_df = [row for row in model_df if row['SKU'] == ctx.sku]
+    node_df = [row for row in model_df if row['NODE'] == ctx.node_name]
+    overridden = set([row[key] for row in node_df])
+    class_df = [row for row in model_df
+                if row['NODE'] == '' and row[key] not in overridden]
+    if ctx.args.verbose:
+        print('select ' + str(len(node_df)) + ' node and ' +
+              str(len(class_df)) + ' class thresholds for SKU ' + ctx.sku)
+    return node_df + class_df
+
+
 def init_tdp_map(ctx):
     """
     Initialize thresholds for TDP contention for all workloads
@@ -380,13 +902,9 @@ def init_tdp_map(ctx):
         key = 'CID'
     else:
         key = 'CNAME'
-    tdp_df = pd.read_csv(ctx.tdp_file)
-    cids = tdp_df[key].unique()
-    for cid in cids:
-        tdpdata = tdp_df[tdp_df[key] == cid]
-
-        for row_turple in tdpdata.iterrows():
-            row = row_turple[1]
+    tdp_df = select_models(ctx, read_table(ctx.tdp_file, TDP_COLUMNS), key)
+    for cid, tdpdata in group_rows(tdp_df, key):
+        for row in tdpdata:
             thresh = dict()
             thresh['util'] = row['UTIL']
             thresh['mean'] = row['MEAN']
@@ -411,11 +929,12 @@ def init_threshmap(ctx):
     thresh_file = 'thresh.csv'
     if ctx.args.thresh_file is not None:
         thresh_file = ctx.args.thresh_file
-    thresh_df = pd.read_csv(thresh_file)
-    cids = thresh_df[key].unique()
-    for cid in cids:
-        jdata = thresh_df[thresh_df[key] == cid].sort_values('UTIL_START')
-        bins = init_threshbins(jdata)
+    columns = THRESH_COLUMNS + tuple([event.metric + '_THRESH'
+                                      for event in EVENTS])
+    thresh_df = select_models(ctx, read_table(thresh_file, columns), key)
+    for cid, jdata in group_rows(thresh_df, key):
+        bins = init_threshbins(sorted(jdata,
+                                      key=lambda row: row['UTIL_START']))
         ctx.thresh_map[cid] = bins
 
     if ctx.args.verbose:
@@ -431,11 +950,10 @@ def init_wlset(ctx):
         key = 'CID'
     else:
         key = 'CNAME'
-    wl_df = pd.read_csv(ctx.args.workload_conf_file)
+    wl_df = read_table(ctx.args.workload_conf_file)
     lcs = []
     bes = []
-    for row_turple in wl_df.iterrows():
-        row = row_turple[1]
+    for row in wl_df:
         workload = row[key]
         if row['TYPE'] == 'LC':
             lcs.append(workload)
@@ -455,15 +973,27 @@ def update_sysmax(ctx, lc_utils):
         lc_utils - monitored LC workload utilization maximal value
     """
     ctx.sysmax_util = int(lc_utils)
-    subprocess.Popen('echo ' + str(ctx.sysmax_util) + ' > ' + ctx.sysmax_file,
-                     shell=True)
+    if not ctx.sysmax_file:
+        return
+    try:
+        checkpoint.atomic_write(ctx.sysmax_file,
+                                str(ctx.sysmax_util) + '\n')
+    except (IOError, OSError) as err:
+        print(datetime.now().isoformat(' ') + ' fail to save ' +
+              ctx.sysmax_file + ': ' + str(err))
 
 
 def init_sysmax(ctx):
     """
-    Initialize historical system maximal utilization from model file
+    Initialize historical system maximal utilization from model file, node
+    specific file written by analyze.py from fleet data overrides lcmax.txt
         ctx - agent context
     """
+    node_name = ctx.args.node_name if ctx.args.node_name is not None\
+        else platform.node()
+    node_file = 'lcmax-' + node_name + '.txt'
+    if os.path.isfile(node_file):
+        ctx.sysmax_file = node_file
     result = subprocess.run(['cat', ctx.sysmax_file],
                             stdout=subprocess.PIPE,
                             stderr=subprocess.STDOUT)
@@ -476,6 +1006,205 @@ def init_sysmax(ctx):
         print(ctx.sysmax_util)
 
 
+def checkpoint_state(ctx):
+    """
+    Get agent state kept across restart: system maximal utilization,
+    controller levels and cycle counters, CPU usage baselines and metrics
+    history of containers
+        ctx - agent context
+    """
+    return {'sysmax_util': ctx.sysmax_util,
+            'controllers': dict([(contention.name, controller.checkpoint())
+                                 for contention, controller in
+                                 ctx.controllers.items()]),
+            'util': dict(list(ctx.restored['util'].items()) +
+                         [(cid, con.checkpoint())
+                          for cid, con in ctx.util_cons.items()]),
+            'metric': dict(list(ctx.restored['metric'].items()) +
+                           [(cid, con.checkpoint())
+                            for cid, con in ctx.metric_cons.items()])}
+
+
+async def save_checkpoint(ctx, tick):
+    """
+    Checkpoint timer function
+        ctx - agent context
+        tick - ticker of this cycle
+    """
+    state = checkpoint_state(ctx)
+    with ctx.stats.phase('checkpoint'):
+        try:
+            await ctx.scheduler.run_blocking(checkpoint.save,
+                                             ctx.args.checkpoint, state)
+        except (IOError, OSError) as err:
+            print(datetime.now().isoformat(' ') + ' fail to save ' +
+                  'checkpoint: ' + str(err))
+
+
+def restore_checkpoint(ctx):
+    """
+    Restore agent state from fresh checkpoint, container state is kept
+    until the container is discovered again
+        ctx - agent context
+    """
+    state = checkpoint.load(ctx.args.checkpoint, ctx.args.checkpoint_age)
+    if state is None:
+        return
+    if state['sysmax_util'] > ctx.sysmax_util:
+        ctx.sysmax_util = state['sysmax_util']
+        if ctx.cpuq:
+            ctx.cpuq.update_max_sys_util(ctx.sysmax_util)
+    for contention, controller in ctx.controllers.items():
+        if contention.name in state['controllers']:
+            controller.restore(state['controllers'][contention.name])
+            if ctx.args.verbose:
+                print(contention.name + ' controller levels ' +
+                      str(controller.levels()))
+    for kind in ('util', 'metric'):
+        ctx.restored[kind] = state[kind]
+
+
+def restore_container(ctx, kind, con):
+    """
+    Restore state of newly discovered container from checkpoint
+        ctx - agent context
+        kind - 'util' or 'metric' container
+        con - new container
+    """
+    state = ctx.restored[kind].pop(con.cid, None)
+    if state is not None and state['name'] == con.name:
+        con.restore(state)
+
+
+def init_controllers(ctx):
+    """
+    Initialize resources and controllers used to regulate BE workloads
+        ctx - agent context
+    """
+    ctx.cpuq = CpuQuota(ctx.sysmax_util, ctx.args.margin_ratio,
+                        ctx.args.verbose)
+    quota_controller = NaiveController(ctx.cpuq, ctx.args.quota_cycles)
+    if ctx.args.per_socket:
+        # resctrl monitor data and pqos allocation are indexed by L3 domain
+        ctx.sockets = CpuTopology().l3_domains
+    if ctx.args.per_socket and not ctx.args.disable_cat:
+        ctx.socket_res[Contention.LLC] = dict([
+            (socket, LlcOccup(socket=socket)) for socket in ctx.sockets])
+        llc_controller = PerSocketController(ctx.socket_res[Contention.LLC],
+                                             ctx.args.llc_cycles)
+    else:
+        ctx.llc = LlcOccup()
+        llc_controller = NaiveController(ctx.llc, ctx.args.llc_cycles)
+    if ctx.args.disable_cat:
+        ctx.llc = LlcOccup(init_level=Resource.BUGET_LEV_FULL)
+        ctx.controllers = {Contention.CPU_CYC: quota_controller}
+    else:
+        ctx.controllers = {Contention.CPU_CYC: quota_controller,
+                           Contention.LLC: llc_controller}
+    if ctx.args.enable_mba and ctx.args.per_socket:
+        ctx.socket_res[Contention.MEM_BW] = dict([
+            (socket, MemBw(socket=socket)) for socket in ctx.sockets])
+        ctx.controllers[Contention.MEM_BW] = PerSocketController(
+            ctx.socket_res[Contention.MEM_BW], ctx.args.mba_cycles)
+    elif ctx.args.enable_mba:
+        ctx.mba = MemBw()
+        ctx.controllers[Contention.MEM_BW] = NaiveController(
+            ctx.mba, ctx.args.mba_cycles)
+    if ctx.args.enable_cpuset:
+        ctx.cpuset = CpuSet(CpuTopology(), verbose=ctx.args.verbose)
+        ctx.controllers[Contention.UNKN] = NaiveController(
+            ctx.cpuset, ctx.args.cpuset_cycles)
+    if ctx.args.enable_tdp_control:
+        ctx.cpuf = CpuFreq(verbose=ctx.args.verbose)
+        ctx.controllers[Contention.TDP] = NaiveController(
+            ctx.cpuf, ctx.args.freq_cycles)
+    if ctx.args.fast_path:
+        ctx.fastpath = FastPathDetector(ctx.args.fast_path_cpu_psi,
+                                        ctx.args.fast_path_mem_psi,
+                                        ctx.args.verbose)
+        # wait two metrics cycles for confirmation
+        ctx.fastpath_timeout = int(math.ceil(
+            2.0 * ctx.args.metric_interval / ctx.args.util_interval))
+
+
+def replay(ctx):
+    """
+    Replay recorded utilization and metrics traces through contention
+    detection, attribution and controllers as fast as possible, control
+    writes are captured instead of applied
+        ctx - agent context
+    """
+    recorder = ReplayRecorder()
+    cgroup.set_backend(ReplayBackend())
+    cgroup.set_writer(recorder.write)
+    llcoccup.set_runner(recorder.run)
+    ctx.sysmax_file = None
+    ctx.args.record = False
+    util_cycles = 0
+    metric_cycles = 0
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull,\
+            redirect_stdout(sys.stdout if ctx.args.verbose else devnull):
+        for timestamp, kind, rows in read_traces(*ctx.args.replay):
+            if kind == 'util':
+                cons = []
+                for row in rows:
+                    if not row['CID']:
+                        # LC summary and load average rows
+                        continue
+                    key, con = util_container(ctx, row['CID'],
+                                              row['CNAME'])
+                    con.utils = float(row['UTIL'])
+                    cons.append((key, con))
+                cids = set([con.cid for _, con in cons])
+                for consmap in (ctx.util_cons, ctx.metric_cons):
+                    for cid in list(consmap):
+                        if cid not in cids:
+                            del consmap[cid]
+
+                new_bes = []
+                bes = []
+                for key, con in cons:
+                    if key in ctx.be_set:
+                        _, bcon, new = metric_container(ctx, con.cid,
+                                                        con.name, [])
+                        bcon.utils = con.utils
+                        bes.append(bcon)
+                        if new and ctx.args.control:
+                            new_bes.append(bcon)
+                if new_bes:
+                    budget_new_bes(ctx, new_bes, bes)
+                set_utils(ctx, cons)
+                util_cycles = util_cycles + 1
+            else:
+                records = []
+                recorded = dict()
+                for row in rows:
+                    cid = row['CID']
+                    _, con, _ = metric_container(ctx, cid, row['CNAME'], [])
+                    con.utils = float(row['UTIL'])
+                    for name, column in REPLAY_COLUMNS:
+                        records.append((cid, name, row['TIME'], row[column]))
+                    for event in EVENTS:
+                        if row.get(event.column):
+                            records.append((cid, event.name, row['TIME'],
+                                            row[event.column]))
+                    recorded[cid] = dict(
+                        [(column, float(row[column])) for column in
+                         [stat_column(name, stat) for name in SAMPLE_METRICS
+                          for stat in STATS[1:]] if row.get(column)])
+                detected = set_metrics(ctx, [records],
+                                       ctx.args.metric_interval, True,
+                                       recorded)
+                recorder.add_detections(
+                    dict([(cid, con.name) for cid, con in
+                          ctx.metric_cons.items()]), detected)
+                metric_cycles = metric_cycles + 1
+            recorder.update_levels(timestamp, ctx.controllers)
+    recorder.report(time.perf_counter() - start, util_cycles, metric_cycles)
+    recorder.save_timeline('./replay_levels.csv')
+
+
 def parse_arguments():
     """ agent command line arguments parse function """
 
@@ -508,22 +1237,190 @@ def parse_arguments():
                         in resource regulation', action='store_true')
     parser.add_argument('-p', '--enable_prometheus', help='allow eris send\
                         metrics to prometheus', action='store_true')
+    parser.add_argument('--prometheus-port', help='port to serve prometheus\
+                        metrics scrape', type=int, default=8080)
+    parser.add_argument('--enable-cpuset', help='pin best-efforts task to\
+                        physical cores not shared with busy latency critical\
+                        task and regulate core count', action='store_true')
+    parser.add_argument('--enable-tdp-control', help='cap best-efforts task\
+                        processor frequency while TDP contention is detected',
+                        action='store_true')
+    parser.add_argument('--enable-mba', help='throttle best-efforts task\
+                        memory bandwidth by MBA while memory bandwidth\
+                        contention is detected', action='store_true')
+    parser.add_argument('--per-socket', help='attribute contention and\
+                        regulate LLC and memory bandwidth on each socket\
+                        (L3 cache domain) separately by per socket LLC\
+                        occupancy and memory bandwidth, requires perf\
+                        collector',
+                        action='store_true')
     parser.add_argument('-u', '--util-interval', help='CPU utilization monitor\
                         interval', type=int, choices=range(1, 10), default=2)
     parser.add_argument('-m', '--metric-interval', help='platform metrics\
                         monitor interval', type=int, choices=range(5, 60),
                         default=20)
+    parser.add_argument('--collector', help='platform metrics collector, pgos\
+                        runs pgos tool in each cycle, perf keeps perf events\
+                        and resctrl monitor groups open in agent process',
+                        choices=['pgos', 'perf'], default='pgos')
+    parser.add_argument('--events', help='additional perf events counted\
+                        with instructions, cycles and LLC misses, recorded\
+                        and used to tell memory bandwidth contention apart\
+                        from LLC and hyperthread contention, comma separated\
+                        names of stalls_mem, stalls_l3_miss, offcore_rd,\
+                        l2_misses, l1d_misses or raw events\
+                        COLUMN=rCONFIG[:inst|cyc[:mem|core]]',
+                        type=parse_events, default=[])
+    parser.add_argument('--event-group-size', help='programmable counters\
+                        per logical processor, events are split into groups\
+                        of this size led by instructions and cycles, so\
+                        ratios within each group are not skewed by\
+                        multiplexing', type=int, default=GROUP_SIZE)
+    parser.add_argument('--samples', help='sample count in each platform\
+                        metrics interval, distribution statistics of CPI,\
+                        MPKI and memory bandwidth are calculated from all\
+                        samples, with pgos collector it should divide metric\
+                        interval minus 2 seconds', type=int,
+                        choices=range(1, 20), default=1)
+    parser.add_argument('--detect-stat', help='statistic of metrics samples\
+                        used in contention detection, thresholds should be\
+                        built by analyze.py with same statistic',
+                        choices=STATS, default='mean')
+    parser.add_argument('--fast-path', help='detect likely contention from\
+                        pressure stall information, CFS throttling and cached\
+                        CPI in each utilization cycle and throttle\
+                        best-efforts task until platform metrics based\
+                        detection confirms or releases it',
+                        action='store_true')
+    parser.add_argument('--fast-path-cpu-psi', help='CPU pressure percentage\
+                        (some avg10) of latency critical task to trigger fast\
+                        path throttle', type=float,
+                        default=FastPathDetector.CPU_PSI)
+    parser.add_argument('--fast-path-mem-psi', help='memory pressure\
+                        percentage (some avg10) of latency critical task to\
+                        trigger fast path throttle', type=float,
+                        default=FastPathDetector.MEM_PSI)
+    parser.add_argument('--sampling', help='adaptively sample platform\
+                        metrics of containers on dense nodes, contended and\
+                        busy containers are sampled every cycle, stable ones\
+                        less often and others in rotation',
+                        action='store_true')
+    parser.add_argument('--sample-max', help='maximal containers sampled in\
+                        one metrics cycle, 0 for no limit', type=int,
+                        default=0)
+    parser.add_argument('--sample-budget', help='agent CPU overhead budget in\
+                        percent of one logical processor which bounds\
+                        containers sampled in one metrics cycle, 0 for no\
+                        limit', type=float, default=0)
+    parser.add_argument('--sample-max-interval', help='maximal metrics cycles\
+                        between samples of stable container', type=int,
+                        default=4)
+    parser.add_argument('--sample-hot-util', help='CPU utilization above\
+                        which container is sampled every cycle, 0 to\
+                        disable', type=float, default=0)
+    parser.add_argument('--collect-be', help='collect platform metrics of\
+                        best-efforts task as well, they are used in\
+                        contention attribution', action='store_true')
+    parser.add_argument('--node-metrics', help='collect socket wide platform\
+                        metrics and calculate memory bandwidth and LLC\
+                        headroom', action='store_true')
+    parser.add_argument('--mb-capacity', help='memory bandwidth capacity\
+                        (MB/s) of one socket (L3 cache domain) used in\
+                        headroom calculation, observed peak is used if not\
+                        given', type=float,
+                        default=0)
+    parser.add_argument('--replay', help='replay recorded utilization and\
+                        platform metrics files through contention detection\
+                        and controllers without touching the node, report\
+                        detections and controller levels',
+                        nargs=2, metavar=('UTIL_FILE', 'METRIC_FILE'))
+    parser.add_argument('--store', help='memory mapped metrics store file\
+                        which keeps utilization and platform metrics records\
+                        of recent hours in fixed size rings, it survives\
+                        agent restart and can be read by analyze.py and\
+                        tsstore.py')
+    parser.add_argument('--store-hours', help='hours of records kept in\
+                        metrics store', type=float, default=6)
+    parser.add_argument('--store-containers', help='maximal container count\
+                        used to size metrics store', type=int, default=32)
+    parser.add_argument('--checkpoint', help='checkpoint file of controller\
+                        levels, cycle counters, container CPU usage baselines\
+                        and metrics history, fresh checkpoint is restored on\
+                        agent start so best-efforts tasks are not throttled\
+                        by restart')
+    parser.add_argument('--checkpoint-interval', help='checkpoint interval in\
+                        seconds', type=int, default=10)
+    parser.add_argument('--checkpoint-age', help='maximal checkpoint age in\
+                        seconds to restore', type=int, default=300)
     parser.add_argument('-l', '--llc-cycles', help='cycle number in LLC\
                         controller', type=int, default=6)
     parser.add_argument('-q', '--quota-cycles', help='cycle number in CPU CFS\
                         quota controller', type=int, default=7)
+    parser.add_argument('--cpuset-cycles', help='cycle number in cpuset\
+                        controller', type=int, default=6)
+    parser.add_argument('--freq-cycles', help='cycle number in CPU frequency\
+                        controller', type=int, default=6)
+    parser.add_argument('--mba-cycles', help='cycle number in memory\
+                        bandwidth controller', type=int, default=6)
     parser.add_argument('-k', '--margin-ratio', help='margin ratio related to\
                         one logical processor used in CPU cycle regulation',
                         type=float, default=0.5)
+    parser.add_argument('--discovery', help='container discovery, docker\
+                        lists containers from docker API, cgroup walks\
+                        cgroup hierarchy and watches it with inotify, e.g.\
+                        containerd on kubernetes nodes',
+                        choices=['docker', 'cgroup'], default='docker')
+    parser.add_argument('--discovery-rules', help='json file of cgroup\
+                        discovery rules, each rule has path regular\
+                        expression with cid group, name format string of\
+                        path groups and labels, and optional bundle\
+                        directory whose config.json annotations or docker\
+                        config.v2.json labels and name are labels')
+    parser.add_argument('--cgroup', help='cgroup hierarchy version used to\
+                        monitor and control containers',
+                        choices=['auto', 'v1', 'v2'], default='auto')
+    parser.add_argument('-w', '--workers', help='thread number used to run\
+                        blocking operations', type=int, default=4)
+    parser.add_argument('-s', '--stats', help='interval in seconds to log\
+                        agent phase latency and counter summary, 0 to\
+                        disable', type=int, default=0)
+    parser.add_argument('--shm', help='publish latest container state and\
+                        controller levels in shared memory segment file,\
+                        e.g. /dev/shm/eris, read by shmsnap.py')
+    parser.add_argument('--shm-containers', help='maximal containers in\
+                        shared memory snapshot', type=int, default=256)
+    parser.add_argument('--self-interval', help='interval in seconds to\
+                        measure CPU usage and RSS of agent and its children,\
+                        0 to disable', type=int, default=10)
+    parser.add_argument('--cpu-budget', help='agent CPU budget in percent of\
+                        one logical processor, agent backs off while it is\
+                        exceeded, 0 for no limit', type=float, default=0)
+    parser.add_argument('--rss-budget', help='agent RSS budget in MB, agent\
+                        backs off while it is exceeded, 0 for no limit',
+                        type=float, default=0)
     parser.add_argument('-t', '--thresh-file', help='threshold model file build\
                         from analyze.py tool', type=argparse.FileType('rt'))
+    parser.add_argument('--mv-model', help='multivariate model file built\
+                        from analyze.py tool, contention is detected by joint\
+                        likelihood of CPI, MPKI, memory bandwidth and\
+                        frequency instead of thresholds of each metric')
+    parser.add_argument('--sku', help='node SKU used to select workload class\
+                        thresholds from fleet model, processor model name is\
+                        used if not given')
+    parser.add_argument('--node-name', help='node name used to select node\
+                        specific thresholds from fleet model and maximal\
+                        utilization in lcmax-<node>.txt, host name is used\
+                        if not given')
 
     args = parser.parse_args()
+    window = args.metric_interval - 2
+    if args.collector == 'pgos' and window % args.samples:
+        # pgos counts whole seconds, cut samples would not be comparable
+        # with models built from other sample counts
+        parser.error('pgos counts whole seconds, --samples ' +
+                     str(args.samples) + ' does not divide ' + str(window) +
+                     's collection window of --metric-interval ' +
+                     str(args.metric_interval))
     if args.verbose:
         print(args)
     return args
@@ -533,58 +1430,138 @@ def main():
     """ Script entry point. """
     ctx = Context()
     ctx.args = parse_arguments()
+    cgroup.init_backend(ctx.args.cgroup)
+    set_events(ctx.args.events)
     init_wlset(ctx)
     init_sysmax(ctx)
 
-    if ctx.args.enable_prometheus:
-        ctx.prometheus = PrometheusClient()
-        ctx.prometheus.start()
+    if ctx.args.enable_prometheus and not ctx.args.replay:
+        from prometheus import PrometheusClient
+        ctx.prometheus = PrometheusClient(ctx.args.prometheus_port)
 
     if ctx.args.detect:
+        init_node(ctx)
         init_threshmap(ctx)
         init_tdp_map(ctx)
+        if ctx.args.mv_model:
+            from mvmodel import MvModel
+            models = MvModel.load(ctx.args.mv_model,
+                                  'cid' if ctx.args.key_cid else 'cname',
+                                  ctx.sku, ctx.node_name)
+            ctx.mvmodel = MvModel(models, ctx.args.detect_stat,
+                                  ctx.args.verbose)
 
     if ctx.args.control:
-        ctx.cpuq = CpuQuota(ctx.sysmax_util, ctx.args.margin_ratio,
-                            ctx.args.verbose)
-        quota_controller = NaiveController(ctx.cpuq, ctx.args.quota_cycles)
-        ctx.llc = LlcOccup()
-        llc_controller = NaiveController(ctx.llc, ctx.args.llc_cycles)
-        if ctx.args.disable_cat:
-            ctx.llc = LlcOccup(init_level=Resource.BUGET_LEV_FULL)
-            ctx.controllers = {Contention.CPU_CYC: quota_controller}
-        else:
-            ctx.controllers = {Contention.CPU_CYC: quota_controller,
-                               Contention.LLC: llc_controller}
+        init_controllers(ctx)
+
+    if ctx.args.replay:
+        replay(ctx)
+        return
+
     if ctx.args.record:
         with open('./util.csv', 'w') as utilf:
             utilf.write('TIME,CID,CNAME,UTIL\n')
 
-    util_thread = threading.Thread(target=monitor,
-                                   args=(mon_util_cycle, ctx,
-                                         ctx.args.util_interval))
-    util_thread.start()
+    if ctx.args.checkpoint:
+        restore_checkpoint(ctx)
+
+    if ctx.args.shm:
+        ctx.shm = SnapshotWriter(ctx.args.shm, ctx.args.shm_containers)
+
+    if ctx.args.store:
+        import tsstore
+        ctx.store = tsstore.TsStore(ctx.args.store, tsstore.capacities(
+            ctx.args.store_hours, ctx.args.store_containers,
+            ctx.args.util_interval, ctx.args.metric_interval))
+
+    if ctx.args.discovery == 'cgroup':
+        from discovery import CgroupDiscovery
+        rules = CgroupDiscovery.load_rules(ctx.args.discovery_rules)\
+            if ctx.args.discovery_rules else None
+        ctx.discovery = CgroupDiscovery(rules, ctx.args.verbose)
+    else:
+        from discovery import DockerDiscovery
+        ctx.discovery = DockerDiscovery()
+    ctx.scheduler = Scheduler(ctx, ctx.args.workers)
+    ctx.scheduler.add_stream(ctx.discovery.watch,
+                             ctx.discovery.handle_event,
+                             ctx.discovery.close, ctx.discovery.reset)
+    ctx.scheduler.add_periodic(mon_util_cycle, ctx.args.util_interval)
     if ctx.args.collect_metrics:
         if ctx.args.record:
             with open('./metrics.csv', 'w') as metricf:
                 metricf.write('TIME,CID,CNAME,INST,CYC,CPI,L3MPKI,' +
-                              'L3MISS,NF,UTIL,L3OCC,MBL,MBR\n')
+                              'L3MISS,NF,UTIL,L3OCC,MBL,MBR' + ''.join(
+                                  [',' + stat_column(name, stat)
+                                   for name in SAMPLE_METRICS
+                                   for stat in STATS[1:]]) + ''.join(
+                                       [',' + name for name in
+                                        event_columns()]) + '\n')
+
+        if ctx.args.node_metrics:
+            ctx.node = NodeMetrics(CpuTopology(),
+                                   mb_capacity=ctx.args.mb_capacity,
+                                   verbose=ctx.args.verbose)
+        if ctx.args.sampling:
+            ctx.sampling = SamplingPolicy(ctx.args.sample_max,
+                                          ctx.args.sample_budget,
+                                          ctx.args.sample_max_interval,
+                                          ctx.args.sample_hot_util,
+                                          ctx.args.verbose)
+        events = [(event.type, event.config, event.name)
+                  for event in EVENTS]
+        per = dict([(event.name, 'instructions' if event.per == 'INST' else
+                     'cycles') for event in EVENTS])
+        groups = len(group_events(HW_EVENTS + events,
+                                  ctx.args.event_group_size))
+        if groups > 1:
+            print(datetime.now().isoformat(' ') + ' perf events are counted' +
+                  ' in ' + str(groups) + ' groups led by instructions and' +
+                  ' cycles, events are normalized within own group')
+        if ctx.args.collector == 'perf':
+            ctx.collector = PerfCollector(HW_EVENTS + events,
+                                          per_socket=ctx.args.per_socket,
+                                          group_size=ctx.args.event_group_size,
+                                          per=per, verbose=ctx.args.verbose)
+        else:
+            ctx.collector = PgosCollector(events=events,
+                                          group_size=ctx.args.event_group_size,
+                                          per=per, verbose=ctx.args.verbose)
+            if ctx.args.per_socket:
+                print(datetime.now().isoformat(' ') + ' pgos collector has' +
+                      ' no per socket metrics, contention is applied to' +
+                      ' all sockets')
+        ctx.scheduler.add_periodic(mon_metric_cycle,
+                                   ctx.args.metric_interval)
+    if ctx.args.stats:
+        ctx.scheduler.add_periodic(log_stats, ctx.args.stats)
+    if ctx.args.self_interval:
+        init_selfmon(ctx)
+        ctx.scheduler.add_periodic(mon_self_cycle, ctx.args.self_interval)
+    if ctx.args.checkpoint:
+        ctx.scheduler.add_periodic(save_checkpoint,
+                                   ctx.args.checkpoint_interval)
+    if ctx.args.enable_prometheus:
+        ctx.prometheus.register_stats(ctx.stats, ctx.selfmon)
+        ctx.scheduler.add_task(ctx.prometheus.serve)
+    stat = read_stat()
+    print('eris agent version', __version__, 'is started in ' +
+          '{:.2f}'.format(process_age()) + 's, RSS ' +
+          (str(stat[2] // 1024 // 1024) + 'MB' if stat else 'unknown') +
+          ', ' + str(len(sys.modules)) + ' modules loaded')
+    ctx.scheduler.run()
+    if ctx.collector:
+        ctx.collector.close()
+    if ctx.node:
+        ctx.node.close()
+    if ctx.store:
+        ctx.store.close()
+    if ctx.shm:
+        ctx.shm.close()
+    if ctx.args.checkpoint:
+        checkpoint.save(ctx.args.checkpoint, checkpoint_state(ctx))
+    print('Shutdown eris agent ...exiting')
 
-        metric_thread = threading.Thread(target=monitor,
-                                         args=(mon_metric_cycle, ctx,
-                                               ctx.args.metric_interval))
-        metric_thread.start()
-    print('eris agent version', __version__, 'is started!')
-    try:
-        util_thread.join()
-        if ctx.args.collect_metrics:
-            metric_thread.join()
-    except KeyboardInterrupt:
-        print('Shutdown eris agent ...exiting')
-        ctx.interrupt = True
-    except Exception:
-        traceback.print_exc(file=sys.stdout)
-    sys.exit(0)
 
 __version__ = 0.8
 if __name__ == '__main__':
@@ -0,0 +1,92 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements fast path contention detection on util tick """
+
+from datetime import datetime
+from container import stat_column
+
+
+class FastPathDetector:
+    """
+    This class detects likely contention of LC workloads from signals which
+    are cheap to read in each utilization cycle: CPU and memory pressure
+    stall information, CFS throttling and CPI cached from last metrics cycle.
+    Detection only raises a provisional throttle, perf based contention
+    detection confirms or releases it
+    """
+    CPU_PSI = 10.0
+    MEM_PSI = 10.0
+    THROTTLED_RATIO = 0.2
+    CPI_RATIO = 0.8
+
+    def __init__(self, cpu_psi=CPU_PSI, mem_psi=MEM_PSI, verbose=False):
+        """
+        Class constructor, arguments include:
+            cpu_psi - cpu some avg10 pressure percentage to trigger
+            mem_psi - memory some avg10 pressure percentage to trigger
+            verbose - print signals of every LC container
+        """
+        self.cpu_psi = cpu_psi
+        self.mem_psi = mem_psi
+        self.verbose = verbose
+
+    @staticmethod
+    def __avg10(con, resource):
+        return con.pressure.get(resource, {}).get('some', {}).get('avg10', 0)
+
+    @staticmethod
+    def __cpi_ratio(con):
+        if con is None or not con.thresh or not con.metrics:
+            return None
+        thresh = con.find_bin()
+        if thresh is None or not thresh['cpi']:
+            return None
+        return con.metrics.get(stat_column('CPI', con.stat), 0) /\
+            thresh['cpi']
+
+    def detect(self, con, metric_con=None):
+        """
+        Detect if LC container likely suffers contention, return reason
+        string, None if no contention or confidence is low
+            con - LC container updated in utilization cycle
+            metric_con - same container in metrics cycle with cached
+                         metrics and thresholds, None if not available
+        """
+        cpu = FastPathDetector.__avg10(con, 'cpu')
+        mem = FastPathDetector.__avg10(con, 'memory')
+        cpi_ratio = FastPathDetector.__cpi_ratio(metric_con)
+        if self.verbose:
+            print(datetime.now().isoformat(' ') + ' fast path ' + con.name +
+                  ' cpu psi ' + str(cpu) + ' memory psi ' + str(mem) +
+                  ' throttled ' + str(con.throttled_ratio) +
+                  ' cpi ratio ' + str(cpi_ratio))
+
+        if cpu < self.cpu_psi and mem < self.mem_psi:
+            return None
+        if con.throttled_ratio >= FastPathDetector.THROTTLED_RATIO:
+            # LC is stalled by its own CFS quota, not by BE workloads
+            return None
+        if cpi_ratio is not None and cpi_ratio < FastPathDetector.CPI_RATIO:
+            # last measured CPI is far below threshold
+            return None
+
+        reason = 'cpu psi ' + str(cpu) if cpu >= self.cpu_psi else\
+            'memory psi ' + str(mem)
+        if cpi_ratio is not None:
+            reason = reason + ', cpi ratio ' + '{:.2f}'.format(cpi_ratio)
+        return reason
@@ -0,0 +1,124 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements agent self instrumentation """
+
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Histogram:
+    """ This class implements latency histogram with fixed buckets """
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+               0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(Histogram.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """
+        Add one observation to histogram
+            value - observed latency in seconds
+        """
+        self.counts[bisect_left(Histogram.BUCKETS, value)] += 1
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, quantile):
+        """
+        Get upper bound of bucket which contains given quantile
+            quantile - quantile between 0 and 1
+        """
+        rank = quantile * self.count
+        total = 0
+        for index, count in enumerate(self.counts):
+            total = total + count
+            if total >= rank and count:
+                if index < len(Histogram.BUCKETS):
+                    return min(Histogram.BUCKETS[index], self.max)
+                return self.max
+        return 0.0
+
+    def cumulative(self):
+        """ get cumulative counts of all buckets, last one is +Inf """
+        total = 0
+        counts = []
+        for count in self.counts:
+            total = total + count
+            counts.append(total)
+        return counts
+
+
+class AgentStats:
+    """
+    This class collects latency histograms of agent cycle phases and event
+    counters, all values are accumulated since agent start
+    """
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+
+    def observe(self, name, seconds):
+        """
+        Add latency observation of one phase
+            name - phase name
+            seconds - phase latency
+        """
+        hist = self.phases.get(name)
+        if hist is None:
+            hist = Histogram()
+            self.phases[name] = hist
+        hist.observe(seconds)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measure latency of code block as one phase observation
+            name - phase name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def count(self, name, value=1):
+        """
+        Increase event counter
+            name - counter name
+            value - increment
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """ get one line summary of all phases and counters """
+        items = []
+        for name, hist in self.phases.items():
+            items.append('{}={}/{:.1f}ms/{:.1f}ms/{:.1f}ms'.format(
+                name, hist.count, hist.sum * 1000 / hist.count,
+                hist.quantile(0.95) * 1000, hist.max * 1000))
+        for name, value in self.counters.items():
+            items.append('{}={}'.format(name, value))
+        return ' '.join(items)
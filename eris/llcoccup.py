@@ -21,6 +21,29 @@ import subprocess
 from datetime import datetime
 from mresource import Resource
 
+RUNNER = None
+
+
+def set_runner(runner):
+    """
+    Set function used to run pqos commands, commands are run in background
+    shell if no runner is set
+        runner - function takes command line string
+    """
+    global RUNNER
+    RUNNER = runner
+
+
+def run(cml):
+    """
+    Run pqos or rdtset command through configured runner
+        cml - command line string
+    """
+    if RUNNER is None:
+        subprocess.Popen(cml, shell=True)
+    else:
+        RUNNER(cml)
+
 
 class LlcOccup(Resource):
     """ This class is the resource class of LLC occupancy """
@@ -32,6 +55,17 @@ class LlcOccup(Resource):
 
     USE_PQOS = True
 
+    def __init__(self, init_level=Resource.BUGET_LEV_MIN, socket=None):
+        """
+        Class constructor, arguments include:
+            init_level - initial resource level
+            socket - L3 cache domain id whose LLC is regulated, all
+                     domains if None
+        """
+        super().__init__(init_level)
+        self.socket = socket
+        self.target = 'llc' if socket is None else 'llc@' + str(socket)
+
     def budgeting(self, containers):
         cpids = []
         cns = []
@@ -42,33 +76,33 @@ class LlcOccup(Resource):
         if LlcOccup.USE_PQOS:
             # in POC, assume only eris controls CAT, use fixed CLOS number 1
             cml = 'pqos -I -a' + '\'pid:1=' + ','.join(cpids) + '\''
-            subprocess.Popen(cml, shell=True)
+            run(cml)
 
         if self.is_full_level() or self.quota_level >= len(LlcOccup.LLC_BMP):
             if LlcOccup.USE_PQOS:
-                cml = 'pqos -e' + '\'llc:1=' +\
+                cml = 'pqos -e' + '\'' + self.target + ':1=' +\
                     LlcOccup.LLC_BMP[len(LlcOccup.LLC_BMP) - 1] + '\''
             else:
                 cml = 'rdtset -t ' + '\'l3=' +\
                         LlcOccup.LLC_BMP[len(LlcOccup.LLC_BMP) - 1] + '\''\
                         ' -I -p ' + ','.join(cpids)
-            subprocess.Popen(cml, shell=True)
+            run(cml)
 
             print(datetime.now().isoformat(' ') +
                   ' set best effort container ' + ','.join(cns) +
-                  ' llc occupancy to ' +
+                  ' ' + self.target + ' occupancy to ' +
                   LlcOccup.LLC_BMP[len(LlcOccup.LLC_BMP) - 1])
         else:
             if LlcOccup.USE_PQOS:
-                cml = 'pqos -e' + '\'llc:1=' +\
+                cml = 'pqos -e' + '\'' + self.target + ':1=' +\
                     LlcOccup.LLC_BMP[self.quota_level] + '\''
             else:
                 cml = 'rdtset -t ' + '\'l3=' +\
                     LlcOccup.LLC_BMP[self.quota_level] + '\''\
                     ' -I -p ' + ','.join(cpids)
-            subprocess.Popen(cml, shell=True)
+            run(cml)
 
             print(datetime.now().isoformat(' ') +
                   ' set best effort container ' +
-                  ','.join(cns) + ' llc occupancy to ' +
+                  ','.join(cns) + ' ' + self.target + ' occupancy to ' +
                   LlcOccup.LLC_BMP[self.quota_level])
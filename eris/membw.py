@@ -0,0 +1,67 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements memory bandwidth control based on pqos tool """
+
+from datetime import datetime
+from mresource import Resource
+from llcoccup import run
+
+
+class MemBw(Resource):
+    """
+    This class is the resource class of memory bandwidth, best-efforts
+    workloads share class of service 1 with LLC control and their memory
+    bandwidth is throttled by MBA in steps of 10 percent
+    """
+    MBA_MIN = 10
+    MBA_MAX = 100
+    MBA_STEP = 10
+
+    def __init__(self, init_level=Resource.BUGET_LEV_MIN, socket=None):
+        """
+        Class constructor, arguments include:
+            init_level - initial resource level
+            socket - L3 cache domain id whose memory bandwidth is
+                     regulated, all domains if None
+        """
+        super().__init__(init_level)
+        self.socket = socket
+        self.target = 'mba' if socket is None else 'mba@' + str(socket)
+        self.rate = MemBw.MBA_MIN
+        self.update()
+
+    def update(self):
+        if self.is_full_level():
+            self.rate = MemBw.MBA_MAX
+        else:
+            rate = MemBw.MBA_MIN + (MemBw.MBA_MAX - MemBw.MBA_MIN) *\
+                self.quota_level / Resource.BUGET_LEV_MAX
+            self.rate = int(rate) // MemBw.MBA_STEP * MemBw.MBA_STEP
+
+    def budgeting(self, containers):
+        cpids = []
+        cns = []
+        for con in containers:
+            cpids.append(','.join(con.pids))
+            cns.append(con.name)
+
+        run('pqos -I -a' + '\'pid:1=' + ','.join(cpids) + '\'')
+        run('pqos -e' + '\'' + self.target + ':1=' + str(self.rate) + '\'')
+        print(datetime.now().isoformat(' ') + ' set best effort container ' +
+              ','.join(cns) + ' ' + self.target + ' rate to ' +
+              str(self.rate) + '%')
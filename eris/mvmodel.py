@@ -0,0 +1,241 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements multivariate contention scoring model """
+
+import json
+import math
+from datetime import datetime
+import numpy as np
+from container import Contention, find_bin, stat_column
+
+FEATURES = ('CPI', 'L3MPKI', 'MB', 'NF')
+# contention type indicated by each feature and the direction in which the
+# feature deviates when workload suffers that contention
+INDICATORS = ((1, 1, Contention.LLC), (2, -1, Contention.MEM_BW),
+              (3, -1, Contention.TDP))
+
+
+def feature_vector(metrics, stat):
+    """
+    Get feature values of one metrics record
+        metrics - dict of platform metrics
+        stat - statistic of metrics samples, one of STATS
+    """
+    return [metrics.get(stat_column('CPI', stat), 0),
+            metrics.get(stat_column('L3MPKI', stat), 0),
+            metrics.get(stat_column('MB', stat), 0),
+            metrics.get('NF', 0)]
+
+
+class MvBin:
+    """
+    This class is the joint distribution of standardized features in one
+    utilization bin, a mixture of full covariance Gaussian components
+    """
+
+    def __init__(self, model):
+        """
+        Class constructor, arguments include:
+            model - dict of bin model written by analyze.py
+        """
+        self.threshold = model['threshold']
+        self.center = np.array(model['center'])
+        self.scale = np.array(model['scale'])
+        components = model['components']
+        self.means = np.array([comp['mean'] for comp in components])
+        covariances = np.array([comp['covariance'] for comp in components])
+        self.precisions = np.linalg.inv(covariances)
+        _, logdet = np.linalg.slogdet(covariances)
+        # log of weight and Gaussian normalizer of each component
+        self.log_norms = np.log([comp['weight'] for comp in components]) -\
+            0.5 * (logdet + len(FEATURES) * math.log(2 * math.pi))
+
+    def expand(self, data):
+        """
+        Get standardized feature vectors and mixture component arrays
+        of samples in this bin, used to score training data
+            data - n x features array of feature vectors
+        """
+        count = len(self.means)
+        owner = np.repeat(np.arange(len(data)), count)
+        return ((data - self.center) / self.scale, owner,
+                np.tile(self.means, (len(data), 1)),
+                np.tile(self.precisions, (len(data), 1, 1)),
+                np.tile(self.log_norms, len(data)),
+                np.arange(0, len(owner), count))
+
+
+def score(data, owner, means, precisions, log_norms, starts):
+    """
+    Score standardized feature vectors against their mixtures, return
+    (log likelihood, index of most likely component) of each vector
+        data - n x features array of standardized feature vectors
+        owner - vector index of each component, components of one vector
+                are contiguous
+        means - k x features array of component means
+        precisions - k x features x features array of component precisions
+        log_norms - log weight and normalizer of each component
+        starts - index of first component of each vector
+    """
+    delta = data[owner] - means
+    maha = np.einsum('kf,kfg,kg->k', delta, precisions, delta)
+    log_probs = log_norms - 0.5 * maha
+    likelihood = np.logaddexp.reduceat(log_probs, starts)
+    # most likely component of each vector is picked by position within its
+    # contiguous components, so every vector gets exactly one component
+    order = np.lexsort((-log_probs, owner))
+    return likelihood, order[starts]
+
+
+def contributions(data, owner, means, precisions, best):
+    """
+    Split squared Mahalanobis distance of each vector to its most likely
+    component into per feature contributions, return n x features array
+        data - n x features array of standardized feature vectors
+        owner - vector index of each component
+        means - k x features array of component means
+        precisions - k x features x features array of component precisions
+        best - index of most likely component of each vector
+    """
+    delta = data[owner[best]] - means[best]
+    return delta * np.einsum('nfg,ng->nf', precisions[best], delta), delta
+
+
+class MvModel:
+    """
+    This class detects contention of LC workloads by joint likelihood of
+    CPI, MPKI, memory bandwidth and frequency in utilization bin, all
+    containers are scored in one vectorized pass per metrics cycle and
+    contention type is classified by per feature contribution to distance
+    """
+
+    def __init__(self, models, stat='mean', verbose=False):
+        """
+        Class constructor, arguments include:
+            models - dict of workload key to list of bin model dicts
+            stat - statistic of metrics samples used as features
+            verbose - print scores of every container
+        """
+        self.models = dict()
+        for key, bins in models.items():
+            self.models[key] = sorted([
+                {'util_start': model['util_start'],
+                 'util_end': model['util_end'], 'model': MvBin(model)}
+                for model in bins], key=lambda mvbin: mvbin['util_start'])
+        self.starts = dict([(key, [mvbin['util_start'] for mvbin in bins])
+                            for key, bins in self.models.items()])
+        self.stat = stat
+        self.verbose = verbose
+
+    @staticmethod
+    def load(path, key, sku='', node=''):
+        """
+        Load workload models from file built by analyze.py, node specific
+        models of a workload override models of its class on node SKU
+            path - model file path
+            key - 'cid' or 'cname' used as workload key
+            sku - node SKU
+            node - node name
+        """
+        with open(path) as modelf:
+            entries = json.load(modelf)
+        models = dict()
+        overridden = set()
+        for entry in entries:
+            if entry.get('sku', '') not in ('', sku) or\
+               entry.get('node', '') not in ('', node):
+                continue
+            name = entry[key]
+            if entry.get('node', ''):
+                overridden.add(name)
+                models[name] = entry['bins']
+            elif name not in overridden:
+                models[name] = entry['bins']
+        return models
+
+    def detect(self, cons, keys):
+        """
+        Detect contention of LC containers, return detected contention or
+        None of each container
+            cons - LC containers with calculated metrics
+            keys - workload key of each container
+        """
+        results = [None] * len(cons)
+        scored = []
+        bins = []
+        vectors = []
+        for i, (con, key) in enumerate(zip(cons, keys)):
+            mvbin = find_bin(self.models.get(key, []), con.utils,
+                             self.starts.get(key, []))
+            if mvbin is None:
+                continue
+            features = feature_vector(con.get_metrics(), self.stat)
+            # vector with non-finite feature can not be scored, container
+            # gets no result instead of misaligning scores of others
+            if not np.all(np.isfinite(features)):
+                continue
+            scored.append(i)
+            bins.append(mvbin['model'])
+            vectors.append(features)
+        if not scored:
+            return results
+
+        data = np.array([(features - mvbin.center) / mvbin.scale
+                         for features, mvbin in zip(vectors, bins)])
+        owner = np.concatenate([np.full(len(mvbin.means), i)
+                                for i, mvbin in enumerate(bins)])
+        starts = np.concatenate(([0], np.cumsum(
+            [len(mvbin.means) for mvbin in bins])[:-1]))
+        means = np.concatenate([mvbin.means for mvbin in bins])
+        precisions = np.concatenate([mvbin.precisions for mvbin in bins])
+        log_norms = np.concatenate([mvbin.log_norms for mvbin in bins])
+
+        likelihood, best = score(data, owner, means, precisions, log_norms,
+                                 starts)
+        contrib, delta = contributions(data, owner, means, precisions, best)
+        thresholds = np.array([mvbin.threshold for mvbin in bins])
+        # only CPI worse than normal is performance degradation
+        anomaly = (likelihood < thresholds) & (delta[:, 0] > 0)
+
+        for j, i in enumerate(scored):
+            if self.verbose:
+                print(datetime.now().isoformat(' ') + ' ' + cons[i].name +
+                      ' log likelihood ' + '{:.2f}'.format(likelihood[j]) +
+                      ' threshold ' + '{:.2f}'.format(thresholds[j]) +
+                      ' contributions ' + ', '.join(
+                          [name + ' ' + '{:.2f}'.format(value)
+                           for name, value in zip(FEATURES, contrib[j])]))
+            if not anomaly[j]:
+                continue
+            contention = Contention.UNKN
+            largest = 0
+            for feature, direction, candidate in INDICATORS:
+                if delta[j][feature] * direction > 0 and\
+                   contrib[j][feature] > largest:
+                    largest = contrib[j][feature]
+                    contention = candidate
+            results[i] = contention
+            print(str(contention) + ' is detected at ' +
+                  datetime.now().isoformat(' '))
+            print('Latency critical container ' + cons[i].name +
+                  ', log likelihood = ' + '{:.2f}'.format(likelihood[j]) +
+                  ', ' + ', '.join(
+                      [name + ' = ' + str(value) for name, value in
+                       zip(FEATURES, feature_vector(cons[i].get_metrics(),
+                                                    self.stat))]) + '\n')
+        return results
@@ -28,6 +28,65 @@ class NaiveController:
         self.res = res
         self.cyc_thresh = cyc_thresh
         self.cyc_cnt = 0
+        self.provisional = 0
+        self.saved_level = None
+
+    def preempt(self, be_containers, timeout):
+        """
+        Throttle BE workloads to minimal level before contention is
+        confirmed, previous level is restored if contention is not confirmed
+        in given cycles, return True if BE workloads are throttled
+            be_containers - all BE workload containers
+            timeout - update cycles to wait for confirmation
+        """
+        if self.provisional or self.res.is_min_level():
+            return False
+        self.saved_level = self.res.quota_level
+        self.provisional = timeout
+        self.cyc_cnt = 0
+        self.res.set_level(Resource.BUGET_LEV_MIN)
+        self.res.budgeting(be_containers)
+        return True
+
+    def confirm(self, be_containers, detected):
+        """
+        Confirm or release provisional throttle by contention detection
+            be_containers - all BE workload containers
+            detected - if resource contention detected on LC workloads
+        """
+        if not self.provisional:
+            return
+        self.provisional = 0
+        if not detected:
+            self.__release(be_containers)
+
+    def __release(self, be_containers):
+        self.res.set_level(self.saved_level)
+        self.res.budgeting(be_containers)
+
+    def checkpoint(self):
+        """ get controller state kept across agent restart """
+        return {'level': self.res.quota_level, 'cyc_cnt': self.cyc_cnt,
+                'provisional': self.provisional,
+                'saved_level': self.saved_level}
+
+    def levels(self):
+        """ get dict of resource name suffix to current level """
+        return {'': self.res.quota_level}
+
+    def restore(self, state):
+        """
+        Restore controller state saved by checkpoint, BE workloads are
+        budgeted with restored level when they are discovered
+            state - controller state
+        """
+        if 'level' not in state:
+            # saved by controller of other kind
+            return
+        self.cyc_cnt = state['cyc_cnt']
+        self.provisional = state['provisional']
+        self.saved_level = state['saved_level']
+        self.res.set_level(state['level'])
 
     def update(self, be_containers, detected, hold):
         """
@@ -38,7 +97,15 @@ class NaiveController:
             hold - if current resource level need to be maintained
         """
 
+        if self.provisional and not detected:
+            # keep BE throttled until contention is confirmed or released
+            self.provisional = self.provisional - 1
+            if self.provisional == 0:
+                self.__release(be_containers)
+            return
+
         if detected:
+            self.provisional = 0
             self.cyc_cnt = 0
             if self.res.is_min_level():
                 # already throttled BE to minimal
@@ -58,3 +125,56 @@ class NaiveController:
                     self.cyc_cnt = 0
                     self.res.increase_level()
                     self.res.budgeting(be_containers)
+
+
+class PerSocketController:
+    """
+    This class runs one naive controller for each socket, resource of one
+    socket is regulated only by contention detected on that socket
+    """
+
+    def __init__(self, resources, cyc_thresh=3):
+        """
+        Class constructor, arguments include:
+            resources - dict of socket id to resource of that socket
+            cyc_thresh - cycle number to increase resource level
+        """
+        self.controllers = dict([(socket, NaiveController(res, cyc_thresh))
+                                 for socket, res in resources.items()])
+
+    def levels(self):
+        """ get dict of resource name suffix to current level """
+        return dict([('@' + str(socket), controller.res.quota_level)
+                     for socket, controller in
+                     sorted(self.controllers.items())])
+
+    def checkpoint(self):
+        """ get controller state kept across agent restart """
+        return {'sockets': dict([(str(socket), controller.checkpoint())
+                                 for socket, controller in
+                                 self.controllers.items()])}
+
+    def restore(self, state):
+        """
+        Restore controller state saved by checkpoint
+            state - controller state
+        """
+        sockets = state.get('sockets', dict())
+        for socket, controller in self.controllers.items():
+            if str(socket) in sockets:
+                controller.restore(sockets[str(socket)])
+
+    def update(self, be_containers, detected, hold):
+        """
+        Update contention detection result to controllers of all sockets
+            be_containers - all BE workload containers
+            detected - set of socket ids with contention detected on LC
+                       workloads, or bool which applies to all sockets
+            hold - if current resource level need to be maintained
+        """
+        for socket, controller in self.controllers.items():
+            if isinstance(detected, bool):
+                flag = detected
+            else:
+                flag = socket in detected
+            controller.update(be_containers, flag, hold)
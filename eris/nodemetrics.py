@@ -0,0 +1,151 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements node and socket level platform metrics """
+
+import os
+from datetime import datetime
+import perfmon
+
+
+class NodeMetrics:
+    """
+    This class collects socket wide instructions, cycles, LLC occupancy and
+    memory bandwidth of all processes, remaining memory bandwidth and LLC
+    headroom of each socket are calculated from them. Memory bandwidth
+    capacity is the larger one of configured value and observed peak.
+    Sockets are L3 cache domains, the same ids resctrl and pqos use
+    """
+    RESCTRL = '/sys/fs/resctrl'
+
+    def __init__(self, topology, resctrl=RESCTRL, mb_capacity=0,
+                 verbose=False):
+        """
+        Class constructor, arguments include:
+            topology - processor topology
+            resctrl - resctrl file system mount point
+            mb_capacity - memory bandwidth capacity (MB/s) of one L3 domain, 0
+                          to use observed peak
+            verbose - print socket metrics of every cycle
+        """
+        self.topology = topology
+        self.resctrl = resctrl
+        self.rdt = os.path.isdir(os.path.join(resctrl, 'mon_data'))
+        self.verbose = verbose
+        self.mb_capacity = dict([(socket, mb_capacity)
+                                 for socket in topology.l3_domains])
+        self.llc_size = dict([(socket, self.__llc_size(socket))
+                              for socket in topology.l3_domains])
+        self.groups = []
+        for cpu in topology.cpus:
+            try:
+                self.groups.append((topology.l3[cpu], perfmon.PerfGroup(
+                    -1, cpu, perfmon.HW_EVENTS, 0)))
+            except OSError as err:
+                print(datetime.now().isoformat(' ') + ' fail to open ' +
+                      'system wide perf event on cpu ' + str(cpu) + ': ' +
+                      str(err))
+                self.close()
+                break
+        self.last_rdt = None
+        self.sockets = dict()
+
+    def __llc_size(self, socket):
+        """ get LLC size of L3 domain in KB from sysfs cache information """
+        cpus = self.topology.l3_cpus(socket)
+        if not cpus:
+            return 0
+        path = os.path.join(self.topology.sysfs_root, 'cpu' + str(cpus[0]),
+                            'cache', 'index3', 'size')
+        try:
+            with open(path) as sizef:
+                size = sizef.read().strip()
+        except IOError:
+            return 0
+        if size.endswith('K'):
+            return int(size[:-1])
+        if size.endswith('M'):
+            return int(size[:-1]) * 1024
+        return int(size) // 1024
+
+    def __read_rdt(self):
+        # sum of all control groups covers every process on the L3 domain
+        domains = dict()
+        for group in perfmon.ctrl_groups(self.resctrl):
+            path = os.path.join(self.resctrl, group)
+            for domain, values in perfmon.read_mon_data(path).items():
+                total = domains.setdefault(domain, [0, 0, 0])
+                for i in range(len(total)):
+                    total[i] = total[i] + values[i]
+        return domains
+
+    def begin(self):
+        """ start one measurement window """
+        dummy = [0] * len(perfmon.HW_EVENTS)
+        for _, group in self.groups:
+            group.read(dummy)
+        if self.rdt:
+            self.last_rdt = self.__read_rdt()
+
+    def end(self, elapsed):
+        """
+        Finish measurement window and update socket metrics
+            elapsed - window length in seconds
+        """
+        counts = dict([(socket, [0] * len(perfmon.HW_EVENTS))
+                       for socket in self.topology.l3_domains])
+        for socket, group in self.groups:
+            group.read(counts[socket])
+        rdt = self.__read_rdt() if self.rdt else dict()
+
+        for socket in self.topology.l3_domains:
+            inst, cyc, _ = counts[socket]
+            metrics = {'INST': inst, 'CYC': cyc,
+                       'IPC': inst / cyc if cyc else 0,
+                       'L3OCC': 0, 'MBL': 0, 'MBR': 0}
+            if socket in rdt and self.last_rdt and socket in self.last_rdt:
+                occupancy, local, total = rdt[socket]
+                _, last_local, last_total = self.last_rdt[socket]
+                local = max(local - last_local, 0)
+                total = max(total - last_total, 0)
+                metrics['L3OCC'] = occupancy // 1024
+                metrics['MBL'] = local / 1024.0 / 1024.0 / elapsed
+                metrics['MBR'] = max(total - local, 0) / 1024.0 / 1024.0 /\
+                    elapsed
+            metrics['MB'] = metrics['MBL'] + metrics['MBR']
+            if metrics['MB'] > self.mb_capacity[socket]:
+                self.mb_capacity[socket] = metrics['MB']
+            metrics['MB_HEADROOM'] = self.mb_capacity[socket] - metrics['MB']
+            metrics['LLC_HEADROOM'] = max(self.llc_size[socket] -
+                                          metrics['L3OCC'], 0)
+            self.sockets[socket] = metrics
+            if self.verbose:
+                print(datetime.now().isoformat(' ') + ' socket ' +
+                      str(socket) + ' ' + str(metrics))
+
+    def mb_headroom_ratio(self):
+        """ get minimal ratio of memory bandwidth headroom of all sockets """
+        ratios = [metrics['MB_HEADROOM'] / self.mb_capacity[socket]
+                  for socket, metrics in self.sockets.items()
+                  if self.mb_capacity[socket]]
+        return min(ratios) if ratios else 0
+
+    def close(self):
+        """ close system wide perf events """
+        for _, group in self.groups:
+            group.close()
+        self.groups = []
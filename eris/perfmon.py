@@ -0,0 +1,478 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements in process cgroup perf event and RDT monitor """
+
+import ctypes
+import fcntl
+import os
+import platform
+import struct
+from collections import namedtuple
+from datetime import datetime
+
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_SOFTWARE = 1
+PERF_TYPE_HW_CACHE = 3
+PERF_TYPE_RAW = 4
+PERF_COUNT_HW_CPU_CYCLES = 0
+PERF_COUNT_HW_INSTRUCTIONS = 1
+PERF_COUNT_HW_CACHE_MISSES = 3
+PERF_COUNT_HW_CACHE_L1D = 0
+PERF_COUNT_HW_CACHE_OP_READ = 0
+PERF_COUNT_HW_CACHE_RESULT_MISS = 1
+PERF_COUNT_SW_CPU_CLOCK = 0
+PERF_COUNT_SW_TASK_CLOCK = 1
+PERF_COUNT_SW_CONTEXT_SWITCHES = 3
+
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FORMAT_GROUP = 1 << 3
+PERF_FLAG_PID_CGROUP = 1 << 2
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_RESET = 0x2403
+PERF_IOC_FLAG_GROUP = 1
+PERF_ATTR_SIZE = 112
+PERF_ATTR_DISABLED = 1 << 0
+
+NR_PERF_EVENT_OPEN = {'x86_64': 298, 'i686': 336, 'aarch64': 241,
+                      'ppc64le': 319}
+
+# same events and names as pgos tool output
+HW_EVENTS = [(PERF_TYPE_HARDWARE, PERF_COUNT_HW_INSTRUCTIONS, 'instructions'),
+             (PERF_TYPE_HARDWARE, PERF_COUNT_HW_CPU_CYCLES, 'cycles'),
+             (PERF_TYPE_HARDWARE, PERF_COUNT_HW_CACHE_MISSES, 'LLC misses')]
+SW_EVENTS = [(PERF_TYPE_SOFTWARE, PERF_COUNT_SW_CPU_CLOCK, 'cpu clock'),
+             (PERF_TYPE_SOFTWARE, PERF_COUNT_SW_TASK_CLOCK, 'task clock'),
+             (PERF_TYPE_SOFTWARE, PERF_COUNT_SW_CONTEXT_SWITCHES,
+              'context switches')]
+# instructions and cycles are counted by fixed counters on x86, others take
+# one programmable counter each
+FIXED_EVENTS = ((PERF_TYPE_HARDWARE, PERF_COUNT_HW_INSTRUCTIONS),
+                (PERF_TYPE_HARDWARE, PERF_COUNT_HW_CPU_CYCLES))
+# programmable counters per logical processor with hyperthreading enabled
+GROUP_SIZE = 4
+
+# additional event, its counter is recorded in column and metric is the
+# counter per kilo instructions (per INST) or per cycle (per CYC), kind is
+# contention the event is evidence of, 'mem' for memory bandwidth and
+# latency, 'core' for core resources shared with hyperthread sibling
+Event = namedtuple('Event', ['name', 'type', 'config', 'column', 'metric',
+                             'per', 'kind'])
+# raw configs are event | umask << 8 | cmask << 24 of Intel Skylake and later
+EVENTS = {
+    'stalls_mem': Event('memory stall cycles', PERF_TYPE_RAW, 0x140014a3,
+                        'STALL_MEM', 'MEMSTALL', 'CYC', 'mem'),
+    'stalls_l3_miss': Event('L3 miss stall cycles', PERF_TYPE_RAW,
+                            0x060006a3, 'STALL_L3', 'L3STALL', 'CYC',
+                            'mem'),
+    'offcore_rd': Event('offcore data read outstanding', PERF_TYPE_RAW,
+                        0x0860, 'OFFCORE_RD', 'RDOCC', 'CYC', 'mem'),
+    'l2_misses': Event('L2 misses', PERF_TYPE_RAW, 0x3f24, 'L2MISS',
+                       'L2MPKI', 'INST', 'core'),
+    'l1d_misses': Event('L1D misses', PERF_TYPE_HW_CACHE,
+                        PERF_COUNT_HW_CACHE_L1D |
+                        PERF_COUNT_HW_CACHE_OP_READ << 8 |
+                        PERF_COUNT_HW_CACHE_RESULT_MISS << 16,
+                        'L1DMISS', 'L1DMPKI', 'INST', 'core')}
+EVENT_KINDS = ('mem', 'core', '')
+
+LIBC = None
+
+
+def parse_event(spec):
+    """
+    Parse one additional event, spec is name in EVENTS or raw event
+    COLUMN=rCONFIG[:inst|cyc[:mem|core]], e.g. STALL_X=r140014a3:cyc:mem
+        spec - event specification
+    """
+    if spec in EVENTS:
+        return EVENTS[spec]
+    if '=' not in spec:
+        raise ValueError('unknown event ' + spec + ', known events are ' +
+                         ', '.join(sorted(EVENTS)))
+    column, raw = spec.split('=', 1)
+    items = raw.split(':')
+    if not column.isidentifier() or not items[0].startswith('r'):
+        raise ValueError('invalid raw event ' + spec)
+    config = int(items[0][1:], 16)
+    per = items[1].upper() if len(items) > 1 else 'INST'
+    if per == 'CYC':
+        metric = column + 'PC'
+    elif per == 'INST':
+        metric = column + 'PKI'
+    else:
+        raise ValueError('event ' + spec + ' is normalized by inst or cyc')
+    kind = items[2] if len(items) > 2 else ''
+    if kind not in EVENT_KINDS or len(items) > 3:
+        raise ValueError('event ' + spec + ' is evidence of mem or core')
+    return Event(column, PERF_TYPE_RAW, config, column.upper(),
+                 metric.upper(), per, kind)
+
+
+def parse_events(spec):
+    """
+    Parse comma separated additional events, see parse_event
+        spec - events specification
+    """
+    events = []
+    for item in spec.split(','):
+        if item.strip():
+            event = parse_event(item.strip())
+            if event.column in [other.column for other in events]:
+                raise ValueError('duplicated event ' + item)
+            events.append(event)
+    return events
+
+
+def group_events(events, size=GROUP_SIZE):
+    """
+    Split events into groups which fit programmable counters, return list of
+    groups of event indexes. All events of one group are scheduled together,
+    every group is led by instructions and cycles on fixed counters, so
+    its events are normalized by base counters of their own group and their
+    ratios are not skewed by multiplexing
+        events - list of (type, config, name) tuples
+        size - programmable counters per logical processor
+    """
+    bases = [i for i, event in enumerate(events)
+             if tuple(event[:2]) in FIXED_EVENTS]
+    groups = [list(bases)]
+    used = 0
+    for i in range(len(events)):
+        if i in bases:
+            continue
+        if used >= size:
+            groups.append(list(bases))
+            used = 0
+        groups[-1].append(i)
+        used = used + 1
+    return groups
+
+
+def perf_event_open(attr, pid, cpu, group_fd, flags):
+    """
+    Call perf_event_open system call, return event file descriptor
+        attr - perf_event_attr buffer
+        pid - process id, or cgroup directory fd with PERF_FLAG_PID_CGROUP
+        cpu - logical processor number
+        group_fd - group leader fd, -1 to create new group
+        flags - perf_event_open flags
+    """
+    global LIBC
+    if LIBC is None:
+        LIBC = ctypes.CDLL(None, use_errno=True)
+    nr = NR_PERF_EVENT_OPEN.get(platform.machine())
+    if nr is None:
+        raise OSError('perf_event_open is not supported on ' +
+                      platform.machine())
+    fd = LIBC.syscall(nr, attr, ctypes.c_int(pid), ctypes.c_int(cpu),
+                      ctypes.c_int(group_fd), ctypes.c_ulong(flags))
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+
+def event_attr(etype, config, leader):
+    """
+    Build perf_event_attr of one group member
+        etype - event type
+        config - event config
+        leader - True if event is group leader
+    """
+    attr = ctypes.create_string_buffer(PERF_ATTR_SIZE)
+    struct.pack_into('IIQ', attr, 0, etype, PERF_ATTR_SIZE, config)
+    struct.pack_into('QQ', attr, 32,
+                     PERF_FORMAT_GROUP | PERF_FORMAT_TOTAL_TIME_ENABLED |
+                     PERF_FORMAT_TOTAL_TIME_RUNNING,
+                     PERF_ATTR_DISABLED if leader else 0)
+    return attr
+
+
+class PerfGroup:
+    """
+    This class is one perf event group of a cgroup on one logical processor,
+    counters are kept open and each read returns deltas since last read
+    """
+
+    def __init__(self, target, cpu, events, flags=PERF_FLAG_PID_CGROUP):
+        """
+        Class constructor, arguments include:
+            target - perf_event cgroup directory fd, or -1 to count all
+                     processes with flags 0
+            cpu - logical processor number
+            events - list of (type, config, name) tuples
+            flags - perf_event_open flags
+        """
+        self.fds = []
+        try:
+            for etype, config, _ in events:
+                leader = not self.fds
+                self.fds.append(perf_event_open(
+                    event_attr(etype, config, leader), target, cpu,
+                    -1 if leader else self.fds[0], flags))
+        except OSError:
+            self.close()
+            raise
+        self.format = struct.Struct('Q' * (3 + len(events)))
+        self.buf = bytearray(self.format.size)
+        self.last = [0] * (2 + len(events))
+        fcntl.ioctl(self.fds[0], PERF_EVENT_IOC_RESET, PERF_IOC_FLAG_GROUP)
+        fcntl.ioctl(self.fds[0], PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP)
+
+    def read(self, result):
+        """
+        Add scaled counter deltas since last read into result
+            result - list of counter values, one per event
+        """
+        if os.readv(self.fds[0], [self.buf]) != len(self.buf):
+            return
+        values = self.format.unpack_from(self.buf)
+        enabled = values[1] - self.last[0]
+        running = values[2] - self.last[1]
+        for i in range(len(self.fds)):
+            delta = values[3 + i] - self.last[2 + i]
+            if running and enabled != running:
+                # whole group is scheduled together, scale by multiplexing
+                delta = int(round(delta * enabled / running))
+            if running:
+                result[i] = result[i] + delta
+        self.last[:] = values[1:]
+
+    def close(self):
+        """ close all counters of this group """
+        for fd in reversed(self.fds):
+            os.close(fd)
+        self.fds = []
+
+
+class CgroupCounters:
+    """
+    This class counts perf events of one cgroup on all logical processors
+    """
+
+    def __init__(self, path, cpus, events, group_size=GROUP_SIZE, per=None):
+        """
+        Class constructor, arguments include:
+            path - perf_event cgroup directory
+            cpus - logical processors to be monitored
+            events - list of (type, config, name) tuples
+            group_size - programmable counters per logical processor, events
+                         are split into groups of this size
+            per - dict of event name to name of base event, instructions or
+                  cycles, event counted outside first group is scaled to
+                  first group by its base counter in own group, cycles is
+                  used if not given
+        """
+        self.fd = os.open(path, os.O_RDONLY)
+        self.layout = group_events(events, group_size)
+        names = [event[2] for event in events]
+        self.bases = dict()
+        for i, name in enumerate(names):
+            base = per.get(name, 'cycles') if per else 'cycles'
+            if base in names:
+                self.bases[i] = names.index(base)
+        self.groups = []
+        self.counts = [[0] * len(indexes) for indexes in self.layout]
+        self.result = [0] * len(events)
+        for cpu in cpus:
+            for layout, indexes in enumerate(self.layout):
+                try:
+                    self.groups.append((layout, PerfGroup(
+                        self.fd, cpu, [events[i] for i in indexes])))
+                except OSError as err:
+                    print(datetime.now().isoformat(' ') +
+                          ' fail to open perf event ' +
+                          events[indexes[-1]][2] + ' on cpu ' + str(cpu) +
+                          ' for ' + path + ': ' + str(err))
+
+    def read(self):
+        """
+        Get counter deltas since last read, one value per event, None for
+        event whose group was not scheduled
+        """
+        for counts in self.counts:
+            for i in range(len(counts)):
+                counts[i] = 0
+        for layout, group in self.groups:
+            group.read(self.counts[layout])
+        first = dict(zip(self.layout[0], self.counts[0]))
+        for i, value in first.items():
+            self.result[i] = value
+        for indexes, counts in zip(self.layout[1:], self.counts[1:]):
+            own = dict(zip(indexes, counts))
+            for i in indexes:
+                if i in first:
+                    continue
+                base = self.bases.get(i)
+                if base in own and base in first:
+                    # base counter of own group is 0 if the group was never
+                    # scheduled, which is no count rather than a real zero
+                    self.result[i] = int(round(
+                        own[i] * first[base] / own[base]))\
+                        if own[base] else None
+                else:
+                    self.result[i] = own[i]
+        return self.result
+
+    def close(self):
+        """ close all event groups and cgroup directory """
+        for _, group in self.groups:
+            group.close()
+        self.groups = []
+        os.close(self.fd)
+
+
+MON_EVENTS = ('llc_occupancy', 'mbm_local_bytes', 'mbm_total_bytes')
+
+
+def thread_ids(pid, proc='/proc'):
+    """
+    List thread ids of one process, empty if process is gone
+        pid - process id
+        proc - proc file system mount point
+    """
+    try:
+        return os.listdir(os.path.join(proc, str(pid), 'task'))
+    except OSError:
+        return []
+
+
+def read_mon_data(path):
+    """
+    Read resctrl monitor data of all L3 domains, return dict of domain id
+    to [LLC occupancy, local memory bytes, total memory bytes]
+        path - resctrl control or monitor group directory
+    """
+    domains = dict()
+    mon_data = os.path.join(path, 'mon_data')
+    for domain in os.listdir(mon_data):
+        values = [0, 0, 0]
+        for i, name in enumerate(MON_EVENTS):
+            try:
+                with open(os.path.join(mon_data, domain, name)) as monf:
+                    values[i] = int(monf.read())
+            except (IOError, ValueError):
+                pass
+        domains[int(domain.split('_')[-1])] = values
+    return domains
+
+
+def ctrl_groups(root):
+    """
+    List resctrl control groups, default group is ''
+        root - resctrl file system mount point
+    """
+    groups = ['']
+    for name in sorted(os.listdir(root)):
+        if name not in ('info', 'mon_groups', 'mon_data') and\
+           os.path.isfile(os.path.join(root, name, 'tasks')):
+            groups.append(name)
+    return groups
+
+
+def find_ctrl_group(root, pid):
+    """
+    Find resctrl control group of process, default group is ''
+        root - resctrl file system mount point
+        pid - process id
+    """
+    for group in ctrl_groups(root)[1:]:
+        try:
+            with open(os.path.join(root, group, 'tasks')) as tasksf:
+                if str(pid) in tasksf.read().split():
+                    return group
+        except IOError:
+            pass
+    return ''
+
+
+class ResctrlGroup:
+    """
+    This class monitors LLC occupancy and memory bandwidth of one container
+    through a resctrl monitor group in the control group of its processes
+    """
+
+    def __init__(self, root, name, ctrl=''):
+        """
+        Class constructor, arguments include:
+            root - resctrl file system mount point
+            name - monitor group name
+            ctrl - control group name, '' for default group
+        """
+        self.ctrl = ctrl
+        self.path = os.path.join(root, ctrl, 'mon_groups', name)
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        self.tids = set()
+        self.last = None
+        self.domains = dict()
+
+    def assign(self, pids):
+        """
+        Move all threads of new processes and new threads of container into
+        monitor group, resctrl tasks file moves one thread per write
+            pids - process ids of container
+        """
+        tids = set()
+        for pid in pids:
+            tids.update(thread_ids(pid))
+        # thread ids of finished threads may be reused
+        self.tids.intersection_update(tids)
+        for tid in tids - self.tids:
+            try:
+                with open(os.path.join(self.path, 'tasks'), 'w') as tasksf:
+                    tasksf.write(tid)
+                self.tids.add(tid)
+            except (IOError, OSError):
+                # thread is gone or belongs to other control group
+                pass
+
+    def read(self):
+        """ get (LLC occupancy bytes, local, total memory bytes) tuple """
+        values = [0, 0, 0]
+        for domain in read_mon_data(self.path).values():
+            for i in range(len(values)):
+                values[i] = values[i] + domain[i]
+        return values
+
+    def update(self):
+        """
+        get (LLC occupancy, local, total memory bytes delta) tuple, the
+        same tuple of each L3 domain is kept in domains
+        """
+        data = read_mon_data(self.path)
+        last = self.last
+        self.last = data
+        self.domains = dict()
+        for domain, values in data.items():
+            if last is None or domain not in last:
+                self.domains[domain] = (values[0], 0, 0)
+            else:
+                self.domains[domain] = (values[0],
+                                        values[1] - last[domain][1],
+                                        values[2] - last[domain][2])
+        return tuple([sum([values[i] for values in self.domains.values()])
+                      for i in range(len(MON_EVENTS))])
+
+    def close(self):
+        """ remove monitor group, processes go back to parent group """
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
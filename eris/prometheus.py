@@ -17,34 +17,231 @@
 
 """ This module start a prometheus client and expose collected metrics """
 
+import asyncio
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST,\
+    REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily,\
+    HistogramMetricFamily
+from container import Contention
+from instrument import Histogram
 
 
-from prometheus_client import Gauge, start_http_server
+class ContainerCollector:
+    """
+    This class renders latest snapshot of container utilization, platform
+    metrics and contention detection result on scrape, series of finished
+    containers are dropped with the snapshot they belong to
+    """
+    METRICS = [
+        ('cma_unhalted_cycles', 'Unhalted cycles of a container',
+         lambda m: m['CYC']),
+        ('cma_instructions', 'Instructions of a container',
+         lambda m: m['INST']),
+        ('cma_llc_misses', 'Last level cache misses of a container',
+         lambda m: m['L3MISS']),
+        ('cma_cycles_per_instruction', 'Cycles per instruction of a ' +
+         'container', lambda m: m['CPI']),
+        ('cma_llc_misses_per_kilo_instructions', 'Last level cache misses ' +
+         'per kilo instructions of a container', lambda m: m['L3MPKI']),
+        ('cma_average_frequency', 'Normalized frequency of a container',
+         lambda m: m['NF']),
+        ('cma_memory_bandwidth', 'Memory bandwidth (MB/s) of a container',
+         lambda m: m['MBL'] + m['MBR']),
+        ('cma_llc_occupancy', 'Last level cache occupancy (KB) of a ' +
+         'container', lambda m: m['L3OCC']),
+        ('cma_llc_occupancy_bytes', 'Last level cache occupancy (bytes) ' +
+         'of a container', lambda m: m['L3OCC'] * 1024),
+    ]
+    CONTENTIONS = [
+        ('cma_contention_llc_detected', 'Last level cache contention ' +
+         'detected on a container', (Contention.LLC,)),
+        ('cma_contention_other_detected', 'Memory bandwidth or unknown ' +
+         'contention detected on a container',
+         (Contention.MEM_BW, Contention.UNKN)),
+        ('cma_contention_tdp_detected', 'TDP contention detected on a ' +
+         'container', (Contention.TDP,)),
+    ]
+    NODE_METRICS = [
+        ('cma_node_instructions_per_cycle', 'Instructions per cycle of a ' +
+         'socket', lambda m: m['IPC']),
+        ('cma_node_memory_bandwidth', 'Memory bandwidth (MB/s) of a socket',
+         lambda m: m['MB']),
+        ('cma_node_llc_occupancy_bytes', 'Last level cache occupancy ' +
+         '(bytes) of a socket', lambda m: m['L3OCC'] * 1024),
+        ('cma_node_memory_bandwidth_headroom', 'Remaining memory ' +
+         'bandwidth (MB/s) of a socket', lambda m: m['MB_HEADROOM']),
+        ('cma_node_llc_headroom_bytes', 'Unoccupied last level cache ' +
+         '(bytes) of a socket', lambda m: m['LLC_HEADROOM'] * 1024),
+    ]
 
-class PrometheusClient:
     def __init__(self):
-        self.gauge_cpu_usage_percentage = Gauge('cma_cpu_usage_percentage', 'CPU usage percentage of a container', ["container"])
-        self.gauge_llc_misses = Gauge('cma_llc_misses', 'CPU usage percentage of a container', ["container"])
-        self.gauge_unhalted_cycles = Gauge('cma_unhalted_cycles', 'CPU usage percentage of a container', ["container"])
-        self.gauge_instructions = Gauge('cma_instructions', 'Instructions of a container', ["container"])
-        self.gauge_average_frequency = Gauge('cma_average_frequency', 'Instructions of a container', ["container"])
-        self.gauge_memory_bandwidth = Gauge('cma_memory_bandwidth', 'Instructions of a container', ["container"])
-        self.gauge_llc_occupancy =  Gauge('cma_llc_occupancy', 'Instructions of a container', ["container"])
-        self.gauge_llc_occupancy_bytes = Gauge('cma_llc_occupancy_bytes', 'Instructions of a container', ["container"])
-        self.gauge_contention_llc_detected = Gauge('cma_contention_llc_detected', 'Instructions of a container', ["container"])
-        self.gauge_contention_other_detected = Gauge('cma_contention_other_detected', 'Instructions of a container', ["container"])
-        self.gauge_contention_tdp_detected = Gauge('cma_contention_tdp_detected', 'Instructions of a container', ["container"])
-
-
-    def start(self):
-        start_http_server(8080)
-
-    def send_metrics(self, container_name, cpu_usage_percentage, unhalted_cycle, llc_miss, instructions, average_frequency, memory_bandwidth, llc_occupancy, llc_occupancy_bytes):
-        self.gauge_cpu_usage_percentage.labels(container_name).set(cpu_usage_percentage)
-        self.gauge_unhalted_cycles.labels(container_name).set(unhalted_cycle)
-        self.gauge_llc_misses.labels(container_name).set(llc_miss)
-        self.gauge_instructions.labels(container_name).set(instructions)
-        self.gauge_average_frequency.labels(container_name).set(average_frequency)
-        self.gauge_memory_bandwidth.labels(container_name).set(memory_bandwidth)
-        self.gauge_llc_occupancy.labels(container_name).set(llc_occupancy)
-        self.gauge_llc_occupancy_bytes.labels(container_name).set(llc_occupancy_bytes)
+        self.utils = dict()
+        self.metrics = dict()
+        self.node = dict()
+
+    def collect(self):
+        """ collect container gauges from latest snapshot """
+        utils = self.utils
+        metrics = self.metrics
+        labels = ['container', 'type']
+        gauge = GaugeMetricFamily('cma_cpu_usage_percentage',
+                                  'CPU usage percentage of a container',
+                                  labels=labels)
+        for name, wtype, util, _ in utils.values():
+            gauge.add_metric([name, wtype], util)
+        yield gauge
+
+        for kind in ('some', 'full'):
+            gauge = GaugeMetricFamily('cma_pressure_' + kind + '_avg10',
+                                      'Percentage of time in last 10 ' +
+                                      'seconds ' + kind + ' tasks of a ' +
+                                      'container stalled on resource',
+                                      labels=labels + ['resource'])
+            for name, wtype, _, pressure in utils.values():
+                for resource, stall in pressure.items():
+                    if kind in stall:
+                        gauge.add_metric([name, wtype, resource],
+                                         stall[kind].get('avg10', 0))
+            yield gauge
+
+        for metric, desc, func in ContainerCollector.METRICS:
+            gauge = GaugeMetricFamily(metric, desc, labels=labels)
+            for cid, (name, wtype, values, _) in metrics.items():
+                if cid in utils and values:
+                    gauge.add_metric([name, wtype], func(values))
+            yield gauge
+
+        for metric, desc, types in ContainerCollector.CONTENTIONS:
+            gauge = GaugeMetricFamily(metric, desc, labels=labels)
+            for cid, (name, wtype, _, contentions) in metrics.items():
+                if cid in utils and wtype == 'LC':
+                    gauge.add_metric([name, wtype],
+                                     int(any(contention in contentions
+                                             for contention in types)))
+            yield gauge
+
+        node = self.node
+        for metric, desc, func in ContainerCollector.NODE_METRICS:
+            gauge = GaugeMetricFamily(metric, desc, labels=['socket'])
+            for socket, values in node.items():
+                gauge.add_metric([str(socket)], func(values))
+            yield gauge
+
+
+class AgentStatsCollector:
+    """ This class renders agent self instrumentation on scrape """
+
+    def __init__(self, stats, selfmon=None):
+        self.stats = stats
+        self.selfmon = selfmon
+
+    def collect(self):
+        """ collect agent phase histograms and counters """
+        bounds = [str(bound) for bound in Histogram.BUCKETS] + ['+Inf']
+        phases = HistogramMetricFamily('cma_agent_phase_seconds',
+                                       'Latency of agent cycle phase',
+                                       labels=['phase'])
+        for name, hist in list(self.stats.phases.items()):
+            phases.add_metric([name], list(zip(bounds, hist.cumulative())),
+                              hist.sum)
+        yield phases
+        counters = CounterMetricFamily('cma_agent_events',
+                                       'Agent event counter',
+                                       labels=['event'])
+        for name, value in list(self.stats.counters.items()):
+            counters.add_metric([name], value)
+        yield counters
+
+        selfmon = self.selfmon
+        if selfmon is None:
+            return
+        cpu = GaugeMetricFamily('cma_agent_cpu_usage_percentage',
+                                'CPU usage percentage of agent',
+                                labels=['process'])
+        cpu.add_metric(['agent'], selfmon.cpu)
+        cpu.add_metric(['children'], selfmon.children_cpu)
+        yield cpu
+        rss = GaugeMetricFamily('cma_agent_rss_bytes',
+                                'Resident set size of agent',
+                                labels=['process'])
+        rss.add_metric(['agent'], selfmon.rss)
+        rss.add_metric(['children'], selfmon.children_rss)
+        yield rss
+        yield GaugeMetricFamily('cma_agent_backoff_level',
+                                'Overhead backoff steps applied by agent',
+                                value=selfmon.level)
+
+
+class PrometheusClient:
+    """ This class exposes agent data to prometheus through scrape """
+
+    def __init__(self, port=8080):
+        self.port = port
+        self.containers = ContainerCollector()
+        REGISTRY.register(self.containers)
+
+    def update_utils(self, utils):
+        """
+        Replace utilization snapshot with all running containers
+            utils - list of (cid, name, type, utilization, pressure) turple
+        """
+        snapshot = dict()
+        for cid, name, wtype, util, pressure in utils:
+            snapshot[cid] = (name, wtype, util, dict(pressure))
+        self.containers.utils = snapshot
+        self.containers.metrics = {cid: value for cid, value in
+                                   self.containers.metrics.items()
+                                   if cid in snapshot}
+
+    def update_metrics(self, metrics):
+        """
+        Update platform metrics snapshot with latest metrics cycle, metrics
+        of containers not sampled in this cycle are kept until they are gone
+        from utilization snapshot
+            metrics - list of (cid, name, type, metrics, contentions) turple
+        """
+        # scrape reads snapshot in executor thread, it is replaced not changed
+        snapshot = dict(self.containers.metrics)
+        for cid, name, wtype, values, contentions in metrics:
+            snapshot[cid] = (name, wtype, values, contentions)
+        self.containers.metrics = snapshot
+
+    def update_node(self, sockets):
+        """
+        Replace socket metrics snapshot with latest metrics cycle
+            sockets - dict of socket id to socket metrics
+        """
+        self.containers.node = dict(sockets)
+
+    def register_stats(self, stats, selfmon=None):
+        """
+        expose agent self instrumentation statistics
+            stats - agent phase and counter statistics
+            selfmon - agent self monitor, usage is not exposed if None
+        """
+        REGISTRY.register(AgentStatsCollector(stats, selfmon))
+
+    async def serve(self, ctx):
+        """ serve metrics scrape requests in agent event loop """
+        server = await asyncio.start_server(
+            lambda reader, writer: self.__handle(ctx, reader, writer),
+            port=self.port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            server.close()
+
+    async def __handle(self, ctx, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+            body = await ctx.scheduler.run_blocking(generate_latest)
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: ' +
+                         CONTENT_TYPE_LATEST.encode('utf-8') +
+                         b'\r\nContent-Length: ' +
+                         str(len(body)).encode('utf-8') + b'\r\n\r\n' + body)
+            await writer.drain()
+        finally:
+            writer.close()
@@ -0,0 +1,190 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements trace reading and recording stubs for replay """
+
+import csv
+import heapq
+from collections import OrderedDict
+from datetime import datetime
+import cgroup
+from mresource import Resource
+
+
+def parse_time(text):
+    """
+    Parse timestamp recorded by agent in isoformat
+        text - timestamp string
+    """
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError('invalid timestamp ' + text)
+
+
+def read_cycles(path, kind):
+    """
+    Read recorded trace file and yield (time, kind, rows) for each agent
+    cycle, rows of one cycle share same timestamp
+        path - util.csv or metrics.csv recorded by agent
+        kind - trace kind returned with each cycle
+    """
+    with open(path) as tracef:
+        rows = []
+        last = None
+        for row in csv.DictReader(tracef):
+            if row['TIME'] != last and rows:
+                yield parse_time(last), kind, rows
+                rows = []
+            last = row['TIME']
+            rows.append(row)
+        if rows:
+            yield parse_time(last), kind, rows
+
+
+def read_traces(util_file, metric_file):
+    """
+    Merge utilization and metrics traces into one cycle stream ordered by
+    time, files are streamed so traces of weeks do not need to fit memory
+        util_file - util.csv recorded by agent
+        metric_file - metrics.csv recorded by agent
+    """
+    return heapq.merge(read_cycles(util_file, 'util'),
+                       read_cycles(metric_file, 'metric'),
+                       key=lambda cycle: (cycle[0], cycle[1] == 'metric'))
+
+
+class ReplayBackend(cgroup.CgroupV1):
+    """
+    This class is the cgroup backend used in replay, containers have no
+    cgroup and utilization comes from trace
+    """
+
+    def __init__(self):
+        super().__init__(root='')
+
+    def container_path(self, cid):
+        return cid
+
+    def cpu_usage(self, cgpath):
+        raise ValueError('no cgroup in replay')
+
+    def cpu_period(self, cgpath):
+        return 100000
+
+    def cpuset(self, cgpath):
+        return ''
+
+    def cpu_stat(self, cgpath):
+        return dict()
+
+    def pressure(self, cgpath, resource):
+        return dict()
+
+    def pids(self, cgpath):
+        return []
+
+
+class ReplayRecorder:
+    """
+    This class captures control writes and commands in replay and records
+    detections and controller level timeline
+    """
+
+    def __init__(self):
+        self.writes = 0
+        self.commands = 0
+        self.levels = dict()
+        self.timeline = []
+        self.cycles = dict()
+        self.detections = OrderedDict()
+
+    def write(self, path, value):
+        """ capture cgroup or sysfs write """
+        self.writes = self.writes + 1
+
+    def run(self, cml):
+        """ capture pqos command """
+        self.commands = self.commands + 1
+
+    def update_levels(self, timestamp, controllers):
+        """
+        Record level changes of all controllers after one cycle
+            timestamp - cycle time in trace
+            controllers - dict of contention to controller
+        """
+        for contention, controller in controllers.items():
+            for suffix, level in controller.levels().items():
+                name = contention.name + suffix
+                if self.levels.get(name) != level:
+                    self.levels[name] = level
+                    self.timeline.append((timestamp, name, level))
+                counts = self.cycles.setdefault(name, [0, 0, 0])
+                counts[0] = counts[0] + 1
+                if level == Resource.BUGET_LEV_MIN:
+                    counts[1] = counts[1] + 1
+                elif level == Resource.BUGET_LEV_FULL:
+                    counts[2] = counts[2] + 1
+
+    def add_detections(self, names, detected):
+        """
+        Count contentions detected in one metrics cycle
+            names - dict of container id to container name
+            detected - dict of container id to detected contentions
+        """
+        for cid, contentions in detected.items():
+            counts = self.detections.setdefault(names[cid], dict())
+            for contention in contentions:
+                counts[contention.name] = counts.get(contention.name, 0) + 1
+
+    def save_timeline(self, path):
+        """ save controller level timeline into csv file """
+        with open(path, 'w') as timelinef:
+            timelinef.write('TIME,CONTROLLER,LEVEL\n')
+            for timestamp, name, level in self.timeline:
+                timelinef.write(timestamp.isoformat() + ',' + name + ',' +
+                                str(level) + '\n')
+
+    def report(self, elapsed, util_cycles, metric_cycles):
+        """
+        Print replay summary
+            elapsed - replay wall time in seconds
+            util_cycles - utilization cycles replayed
+            metric_cycles - metrics cycles replayed
+        """
+        samples = util_cycles + metric_cycles
+        print('replayed ' + str(util_cycles) + ' utilization cycles and ' +
+              str(metric_cycles) + ' metrics cycles in ' +
+              '{:.2f}'.format(elapsed) + 's, ' +
+              '{:.0f}'.format(samples / elapsed if elapsed else 0) +
+              ' samples/s')
+        print('captured ' + str(self.writes) + ' cgroup writes and ' +
+              str(self.commands) + ' pqos commands')
+        print('detections:')
+        for name, counts in self.detections.items():
+            print('    ' + name + ' ' + ' '.join(
+                [key + '=' + str(value) for key, value in
+                 sorted(counts.items())]))
+        print('controllers:')
+        for name, (cycles, mins, fulls) in sorted(self.cycles.items()):
+            changes = len([item for item in self.timeline
+                           if item[1] == name])
+            print('    ' + name + ' level changes=' + str(changes) +
+                  ' min=' + '{:.1%}'.format(mins / cycles) +
+                  ' full=' + '{:.1%}'.format(fulls / cycles))
@@ -0,0 +1,182 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements adaptive sampling of platform metrics """
+
+import os
+from collections import deque
+from datetime import datetime
+
+
+class SamplingPolicy:
+    """
+    This class selects containers whose platform metrics are collected in
+    each metrics cycle on dense nodes. Recently contended containers and
+    containers with high or changing utilization are sampled every cycle,
+    sampling interval of containers with stable CPI doubles up to a maximal
+    interval, and due containers are rotated through a per cycle capacity
+    bounded by container count and agent CPU overhead budget, part of which
+    is reserved for containers waiting past maximal interval
+    """
+    # cycles a container stays hot after contention is detected on it
+    HOT_CYCLES = 3
+    # CPI within this ratio of its history mean is stable
+    STABLE_CPI = 0.1
+    # sampled CPI values kept per container to judge stability
+    CPI_HISTORY = 5
+    # utilization change ratio since last sample which makes container hot
+    UTIL_CHANGE = 0.2
+    # smoothing factor of per container overhead estimation
+    ALPHA = 0.3
+
+    def __init__(self, max_containers=0, budget=0, max_interval=4,
+                 hot_util=0, verbose=False):
+        """
+        Class constructor, arguments include:
+            max_containers - maximal containers sampled in one cycle, 0 for
+                             no limit
+            budget - agent CPU overhead budget in percent of one logical
+                     processor, 0 for no limit
+            max_interval - maximal cycles between samples of stable
+                           container
+            hot_util - utilization above which container is sampled every
+                       cycle, 0 to disable
+            verbose - print sampling decision of every cycle
+        """
+        self.max_containers = max_containers
+        self.budget = budget
+        self.max_interval = max_interval
+        self.hot_util = hot_util
+        self.verbose = verbose
+        self.cycle = 0
+        self.states = dict()
+        self.cost = 0
+        self.last_cpu = None
+
+    @staticmethod
+    def cpu_time():
+        """ get CPU seconds consumed by agent and its finished children """
+        times = os.times()
+        return times[0] + times[1] + times[2] + times[3]
+
+    def capacity(self):
+        """ get maximal containers sampled in current cycle """
+        capacity = self.max_containers if self.max_containers else None
+        if self.budget and self.cost:
+            allowed = max(1, int(self.budget / self.cost))
+            capacity = allowed if capacity is None else min(capacity,
+                                                            allowed)
+        return capacity
+
+    def __hot(self, state, util):
+        if self.cycle < state['hot_until']:
+            return True
+        if self.hot_util and util >= self.hot_util:
+            return True
+        last = state['util']
+        return last is not None and\
+            abs(util - last) > SamplingPolicy.UTIL_CHANGE * max(last, 1)
+
+    def select(self, cons, utils):
+        """
+        Select containers to be sampled in this cycle, hot containers come
+        first and then due containers which waited longest, except slots
+        reserved for containers waiting past maximal interval
+            cons - containers to be monitored
+            utils - dict of container id to latest CPU utilization
+        """
+        self.cycle = self.cycle + 1
+        cids = set([con.cid for con in cons])
+        for cid in list(self.states):
+            if cid not in cids:
+                del self.states[cid]
+
+        due = []
+        for con in cons:
+            # new container is due as if sampled maximal interval ago
+            state = self.states.setdefault(con.cid, {
+                'last': self.cycle - self.max_interval, 'interval': 1,
+                'hot_until': 0, 'util': None,
+                'cpi': deque([], SamplingPolicy.CPI_HISTORY)})
+            hot = self.__hot(state, utils.get(con.cid, 0))
+            if hot:
+                state['interval'] = 1
+            waited = self.cycle - state['last']
+            if hot or waited >= state['interval']:
+                due.append((0 if hot else 1, -waited, len(due), con))
+
+        due.sort(key=lambda item: item[:3])
+        capacity = self.capacity()
+        if capacity is not None and len(due) > capacity:
+            # hot containers may fill capacity every cycle, reserved slots
+            # keep other containers sampled at most some cycles late
+            overdue = [item for item in due
+                       if item[0] and -item[1] > self.max_interval]
+            reserved = overdue[:max(1, capacity // self.max_interval)]
+            indexes = set([item[2] for item in reserved])
+            due = reserved + [item for item in due if item[2] not in indexes]
+        sampled = [item[3] for item in due[:capacity]]
+        if self.verbose:
+            print(datetime.now().isoformat(' ') + ' sample ' +
+                  str(len(sampled)) + ' of ' + str(len(cons)) +
+                  ' containers, ' + str(len(due)) + ' due, capacity ' +
+                  str(capacity))
+        return sampled
+
+    def update(self, sampled, utils, detected, elapsed):
+        """
+        Update sampling intervals and overhead estimation after one cycle
+            sampled - containers sampled in this cycle
+            utils - dict of container id to CPU utilization
+            detected - dict of container id to detected contentions
+            elapsed - seconds since last cycle
+        """
+        for con in sampled:
+            state = self.states.get(con.cid)
+            if state is None:
+                continue
+            state['last'] = self.cycle
+            state['util'] = utils.get(con.cid, 0)
+            state['cpi'].append(con.get_metrics().get('CPI', 0))
+            if detected.get(con.cid):
+                state['hot_until'] = self.cycle + SamplingPolicy.HOT_CYCLES
+                state['interval'] = 1
+            elif self.__stable(state['cpi']):
+                state['interval'] = min(state['interval'] * 2,
+                                        self.max_interval)
+            else:
+                state['interval'] = 1
+
+        cpu = SamplingPolicy.cpu_time()
+        if self.last_cpu is not None and elapsed and sampled:
+            # fixed overhead of agent is charged to sampled containers too
+            overhead = (cpu - self.last_cpu) * 100.0 / elapsed
+            cost = overhead / len(sampled)
+            self.cost = cost if not self.cost else\
+                SamplingPolicy.ALPHA * cost +\
+                (1 - SamplingPolicy.ALPHA) * self.cost
+        self.last_cpu = cpu
+
+    @staticmethod
+    def __stable(history):
+        # history is kept here as container metrics history is only
+        # updated when contention detection is enabled
+        if len(history) < 2:
+            return False
+        mean = (sum(history) - history[-1]) / (len(history) - 1)
+        return mean > 0 and\
+            abs(history[-1] - mean) <= SamplingPolicy.STABLE_CPI * mean
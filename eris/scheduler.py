@@ -0,0 +1,224 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements asyncio based scheduler of agent tasks """
+
+import asyncio
+import signal
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import cgroup
+
+
+class Ticker:
+    """
+    This class generates ticks aligned to a monotonic clock, ticks missed
+    while one cycle overruns its interval are skipped and accounted
+    """
+
+    def __init__(self, name, interval, clock):
+        """
+        Class constructor, arguments include:
+            name - ticker name used in report
+            interval - tick interval in seconds
+            clock - monotonic clock function
+        """
+        self.name = name
+        self.interval = interval
+        self.clock = clock
+        self.deadline = clock()
+        self.now = self.deadline
+        self.last = None
+        self.elapsed = interval
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.behind = False
+
+    def tick(self):
+        """ mark start of one cycle and measure window since last cycle """
+        self.now = self.clock()
+        if self.last is not None:
+            self.elapsed = self.now - self.last
+        self.last = self.now
+        self.ticks = self.ticks + 1
+
+    def next_delay(self):
+        """ get delay to next aligned tick after one cycle is finished """
+        now = self.clock()
+        self.deadline = self.deadline + self.interval
+        if now > self.deadline:
+            missed = int((now - self.deadline) // self.interval) + 1
+            self.overruns = self.overruns + 1
+            self.skipped = self.skipped + missed
+            print(datetime.now().isoformat(' ') + ' ' + self.name +
+                  ' cycle overruns by ' +
+                  '{:.3f}'.format(now - self.deadline) + 's, skipped ' +
+                  str(missed) + ' ticks, total overruns ' +
+                  str(self.overruns) + ' skipped ' + str(self.skipped))
+            self.deadline = self.deadline + missed * self.interval
+            self.behind = True
+        else:
+            self.behind = False
+        return self.deadline - now
+
+
+class Scheduler:
+    """
+    This class runs agent periodic jobs, tasks and event streams as
+    cooperative coroutines in one event loop, blocking calls are off loaded
+    to a bounded thread pool executor
+    """
+    # first and maximal delay in seconds before broken event stream is
+    # opened again
+    RECONNECT_MIN = 1
+    RECONNECT_MAX = 60
+
+    def __init__(self, ctx, max_workers=4):
+        self.ctx = ctx
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = []
+        self.streams = []
+        self.tasks = []
+        self.tickers = []
+        self.write_queue = None
+
+    def add_periodic(self, func, interval):
+        """
+        Add periodic job
+            func - coroutine function called with agent context and ticker
+            interval - job interval in seconds
+        """
+        self.jobs.append(lambda: self.__periodic(func, interval))
+
+    def add_task(self, func):
+        """
+        Add long running task
+            func - coroutine function called with agent context
+        """
+        self.jobs.append(lambda: func(self.ctx))
+
+    def add_stream(self, source, handler, close=None, reset=None):
+        """
+        Add blocking event stream, events are read in a daemon thread and
+        handled in event loop, stream is opened again with backoff if it
+        fails or ends before shutdown
+            source - function returns event iterator
+            handler - function called in event loop with each event
+            close - function to stop event iterator on shutdown
+            reset - function called in stream thread when stream breaks,
+                    e.g. to drop state kept up to date by events
+        """
+        self.streams.append((source, handler, close, reset))
+
+    def run_blocking(self, func, *args):
+        """
+        Run blocking function in executor, return awaitable result
+            func - blocking function
+            args - function arguments
+        """
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    async def __periodic(self, func, interval):
+        ticker = Ticker(func.__name__, interval, self.loop.time)
+        self.tickers.append(ticker)
+        stats = self.ctx.stats
+        while not self.ctx.interrupt:
+            ticker.tick()
+            try:
+                with stats.phase(ticker.name):
+                    await func(self.ctx, ticker)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+            skipped = ticker.skipped
+            delay = ticker.next_delay()
+            if ticker.behind:
+                stats.count(ticker.name + '_overruns')
+                stats.count(ticker.name + '_skipped',
+                            ticker.skipped - skipped)
+            await asyncio.sleep(delay)
+
+    def __pump(self, source, handler, reset):
+        delay = Scheduler.RECONNECT_MIN
+        while not self.ctx.interrupt:
+            try:
+                for event in source():
+                    if self.ctx.interrupt:
+                        return
+                    delay = Scheduler.RECONNECT_MIN
+                    self.loop.call_soon_threadsafe(handler, event)
+                reason = 'ended'
+            except Exception as err:
+                reason = 'failed: ' + str(err)
+            if self.ctx.interrupt:
+                return
+            print(datetime.now().isoformat(' ') + ' event stream ' +
+                  reason + ', open again in ' + str(delay) + 's')
+            if reset:
+                reset()
+            time.sleep(delay)
+            delay = min(delay * 2, Scheduler.RECONNECT_MAX)
+
+    def __queue_write(self, path, value):
+        self.loop.call_soon_threadsafe(self.write_queue.put_nowait,
+                                       (path, value))
+
+    async def __write_cgroups(self):
+        while True:
+            path, value = await self.write_queue.get()
+            with self.ctx.stats.phase('cgroup_write'):
+                await self.run_blocking(cgroup.write_file, path, value)
+
+    def stop(self):
+        """ stop all agent tasks """
+        self.ctx.interrupt = True
+        for task in self.tasks:
+            task.cancel()
+
+    def run(self):
+        """ run event loop until agent is stopped """
+        asyncio.set_event_loop(self.loop)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, self.stop)
+        self.write_queue = asyncio.Queue()
+        cgroup.set_writer(self.__queue_write)
+
+        for source, handler, _, reset in self.streams:
+            threading.Thread(target=self.__pump,
+                             args=(source, handler, reset),
+                             daemon=True).start()
+        self.tasks = [self.loop.create_task(job()) for job in self.jobs]
+        self.tasks.append(self.loop.create_task(self.__write_cgroups()))
+        try:
+            self.loop.run_until_complete(asyncio.gather(
+                *self.tasks, return_exceptions=True))
+        finally:
+            cgroup.set_writer(None)
+            while not self.write_queue.empty():
+                cgroup.write_file(*self.write_queue.get_nowait())
+            for _, _, close, _ in self.streams:
+                if close:
+                    close()
+            self.executor.shutdown(wait=True)
+            self.loop.close()
@@ -0,0 +1,195 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements agent self monitoring and overhead backoff """
+
+import glob
+import os
+from datetime import datetime
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def read_stat(pid='self', proc='/proc'):
+    """
+    Read (CPU ticks, waited children CPU ticks, RSS bytes) of one process,
+    None if process is gone
+        pid - process id
+        proc - proc file system mount point
+    """
+    try:
+        with open(os.path.join(proc, str(pid), 'stat')) as statf:
+            # command may contain spaces, fields follow last ')'
+            fields = statf.read().rsplit(')', 1)[1].split()
+    except (IOError, IndexError):
+        return None
+    return (int(fields[11]) + int(fields[12]),
+            int(fields[13]) + int(fields[14]), int(fields[21]) * PAGE_SIZE)
+
+
+def process_age(pid='self', proc='/proc'):
+    """
+    Get seconds since process started, 0 if unknown
+        pid - process id
+        proc - proc file system mount point
+    """
+    try:
+        with open(os.path.join(proc, str(pid), 'stat')) as statf:
+            fields = statf.read().rsplit(')', 1)[1].split()
+        with open(os.path.join(proc, 'uptime')) as uptimef:
+            uptime = float(uptimef.read().split()[0])
+    except (IOError, IndexError, ValueError):
+        return 0
+    return max(uptime - int(fields[19]) / CLK_TCK, 0)
+
+
+def child_pids(pid='self', proc='/proc'):
+    """
+    List running children of process, e.g. pgos and pqos of agent
+        pid - process id
+        proc - proc file system mount point
+    """
+    pids = []
+    for path in glob.glob(os.path.join(proc, str(pid), 'task', '*',
+                                       'children')):
+        try:
+            with open(path) as childf:
+                pids.extend(childf.read().split())
+        except IOError:
+            pass
+    return pids
+
+
+class SelfMonitor:
+    """
+    This class measures CPU usage and RSS of agent and its running pgos and
+    pqos children in each check. While usage exceeds budget, one more
+    backoff step is applied in each check, steps are released in reverse
+    order after usage stays well below budget for several checks
+    """
+    # usage ratio of budget below which backoff is released
+    RELEASE_RATIO = 0.7
+    # checks below release ratio before one step is released
+    RELEASE_CHECKS = 3
+
+    def __init__(self, cpu_budget=0, rss_budget=0, proc='/proc',
+                 verbose=False):
+        """
+        Class constructor, arguments include:
+            cpu_budget - CPU budget in percent of one logical processor, 0
+                         for no limit
+            rss_budget - RSS budget in MB, 0 for no limit
+            proc - proc file system mount point
+            verbose - print usage of every check
+        """
+        self.cpu_budget = cpu_budget
+        self.rss_budget = rss_budget
+        self.proc = proc
+        self.verbose = verbose
+        self.steps = []
+        self.level = 0
+        self.below = 0
+        self.last = None
+        self.cpu = 0
+        self.children_cpu = 0
+        self.rss = 0
+        self.children_rss = 0
+        self.children = 0
+
+    def add_step(self, name, apply, release):
+        """
+        Add backoff step, steps are applied in order they are added
+            name - step name printed when step is applied or released
+            apply - function called to reduce agent overhead
+            release - function called to restore agent fidelity
+        """
+        self.steps.append((name, apply, release))
+
+    def measure(self, elapsed):
+        """
+        Measure agent usage since last measurement
+            elapsed - seconds since last measurement
+        """
+        stat = read_stat('self', self.proc)
+        if stat is None:
+            return
+        ticks, waited, rss = stat
+        live_ticks = 0
+        live_rss = 0
+        pids = child_pids('self', self.proc)
+        for pid in pids:
+            child = read_stat(pid, self.proc)
+            if child is not None:
+                live_ticks = live_ticks + child[0] + child[1]
+                live_rss = live_rss + child[2]
+        # children move from running to waited when they finish
+        total = (ticks, waited + live_ticks)
+        if self.last is not None and elapsed > 0:
+            scale = 100.0 / CLK_TCK / elapsed
+            self.cpu = max(total[0] - self.last[0], 0) * scale
+            self.children_cpu = max(total[1] - self.last[1], 0) * scale
+        self.last = total
+        self.rss = rss
+        self.children_rss = live_rss
+        self.children = len(pids)
+
+    def usage(self):
+        """ get largest ratio of usage to budget, 0 if no budget """
+        ratios = [0]
+        if self.cpu_budget:
+            ratios.append((self.cpu + self.children_cpu) / self.cpu_budget)
+        if self.rss_budget:
+            ratios.append((self.rss + self.children_rss) / 1024.0 /
+                          1024.0 / self.rss_budget)
+        return max(ratios)
+
+    def check(self, elapsed):
+        """
+        Measure agent usage and apply or release one backoff step
+            elapsed - seconds since last check
+        """
+        self.measure(elapsed)
+        usage = self.usage()
+        if self.verbose:
+            print(datetime.now().isoformat(' ') + ' agent cpu ' +
+                  '{:.1f}'.format(self.cpu) + '% children cpu ' +
+                  '{:.1f}'.format(self.children_cpu) + '% rss ' +
+                  str(self.rss // 1024) + 'KB children rss ' +
+                  str(self.children_rss // 1024) + 'KB backoff level ' +
+                  str(self.level))
+        if usage > 1:
+            self.below = 0
+            if self.level < len(self.steps):
+                name, apply, _ = self.steps[self.level]
+                self.level = self.level + 1
+                print(datetime.now().isoformat(' ') + ' agent usage ' +
+                      '{:.0%}'.format(usage) + ' of budget, back off: ' +
+                      name)
+                apply()
+        elif usage < SelfMonitor.RELEASE_RATIO and self.level:
+            self.below = self.below + 1
+            if self.below >= SelfMonitor.RELEASE_CHECKS:
+                self.below = 0
+                self.level = self.level - 1
+                name, _, release = self.steps[self.level]
+                print(datetime.now().isoformat(' ') + ' agent usage ' +
+                      '{:.0%}'.format(usage) + ' of budget, release: ' +
+                      name)
+                release()
+        else:
+            self.below = 0
@@ -0,0 +1,320 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements shared memory snapshot of latest agent state """
+
+import argparse
+import mmap
+import os
+import struct
+import time
+
+DEFAULT_PATH = '/dev/shm/eris'
+MAGIC = b'ERISSHM1'
+VERSION = 1
+# magic, version, record capacity, level slots, record size, sequence,
+# publish time and record count
+HEADER = struct.Struct('<8sIIIIQdI')
+SEQ_OFFSET = 24
+# sequence written when agent closes segment, it is odd so readers never
+# take records of closed segment as consistent
+CLOSED_SEQ = (1 << 64) - 1
+HEADER_SIZE = 64
+# controller name and level
+LEVEL = struct.Struct('<16si')
+LEVEL_SLOTS = 16
+# container id, name, type, contention flags, then utilization, CPI, MPKI,
+# memory bandwidth, normalized frequency, LLC occupancy and metrics time
+RECORD = struct.Struct('<64s64s2sH7d')
+RECORD_OFFSET = HEADER_SIZE + LEVEL.size * LEVEL_SLOTS
+# contention of flag bit i is CONTENTIONS[i], same order as Contention
+CONTENTIONS = ('UNKN', 'CPU_CYC', 'LLC', 'MEM_BW', 'TDP')
+NAN = float('nan')
+
+
+def pack_name(name, size):
+    """
+    Encode name into fixed size field, truncated on character boundary so
+    readers always decode it
+        name - name string
+        size - field size in bytes
+    """
+    return name.encode('utf-8')[:size].decode('utf-8', 'ignore').encode(
+        'utf-8')
+
+
+def segment_size(capacity):
+    """
+    Get size of segment holding given container records
+        capacity - maximal container records
+    """
+    return RECORD_OFFSET + RECORD.size * capacity
+
+
+class SnapshotWriter:
+    """
+    This class publishes latest utilization, platform metrics, contention
+    of containers and controller levels into shared memory segment, readers
+    get consistent copy by checking sequence number which is odd while
+    writer updates the segment. New segment is built in a temporary file
+    and renamed over the path, so readers still mapping segment of previous
+    agent are not truncated under them
+    """
+
+    def __init__(self, path=DEFAULT_PATH, capacity=256):
+        """
+        Class constructor, arguments include:
+            path - segment file path, in tmpfs such as /dev/shm
+            capacity - maximal container records, others are dropped
+        """
+        self.path = path
+        self.capacity = capacity
+        self.seq = 0
+        self.utils = dict()
+        self.metrics = dict()
+        self.dropped = False
+        size = segment_size(capacity)
+        temp = path + '.' + str(os.getpid())
+        self.fd = os.open(temp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(self.fd, size)
+            self.mmap = mmap.mmap(self.fd, size, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+            HEADER.pack_into(self.mmap, 0, MAGIC, VERSION, capacity,
+                             LEVEL_SLOTS, RECORD.size, 0, 0, 0)
+            os.rename(temp, path)
+        except Exception:
+            os.close(self.fd)
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise
+
+    def update_utils(self, utils):
+        """
+        Replace utilization snapshot with all running containers
+            utils - list of (cid, name, type, utilization, pressure) turple
+        """
+        self.utils = dict([(cid, (name, wtype, util))
+                           for cid, name, wtype, util, _ in utils])
+        self.metrics = dict([(cid, value) for cid, value in
+                             self.metrics.items() if cid in self.utils])
+
+    def update_metrics(self, metrics):
+        """
+        Update platform metrics snapshot with latest metrics cycle, metrics
+        of containers not sampled in this cycle are kept
+            metrics - list of (cid, name, type, metrics, contentions) turple
+        """
+        for cid, _, _, values, contentions in metrics:
+            flags = 0
+            for contention in contentions:
+                flags = flags | (1 << (contention.value - 1))
+            self.metrics[cid] = (
+                flags, values.get('CPI', NAN), values.get('L3MPKI', NAN),
+                values.get('MBL', NAN) + values.get('MBR', 0),
+                values.get('NF', NAN), values.get('L3OCC', NAN),
+                values['TIME'].timestamp() if 'TIME' in values else NAN)
+
+    def publish(self, levels):
+        """
+        Write current snapshot into segment
+            levels - dict of controller name to resource level
+        """
+        cids = list(self.utils)
+        if len(cids) > self.capacity and not self.dropped:
+            self.dropped = True
+            print('snapshot holds only ' + str(self.capacity) +
+                  ' of ' + str(len(cids)) + ' containers')
+        cids = cids[:self.capacity]
+
+        self.seq = self.seq + 1
+        struct.pack_into('<Q', self.mmap, SEQ_OFFSET, self.seq)
+        for i, (name, level) in enumerate(
+                sorted(levels.items())[:LEVEL_SLOTS]):
+            LEVEL.pack_into(self.mmap, HEADER_SIZE + i * LEVEL.size,
+                            pack_name(name, 16), level)
+        for i in range(len(levels), LEVEL_SLOTS):
+            LEVEL.pack_into(self.mmap, HEADER_SIZE + i * LEVEL.size, b'', 0)
+        for i, cid in enumerate(cids):
+            name, wtype, util = self.utils[cid]
+            flags, cpi, mpki, mbw, freq, occupancy, mtime =\
+                self.metrics.get(cid, (0,) + (NAN,) * 6)
+            RECORD.pack_into(self.mmap, RECORD_OFFSET + i * RECORD.size,
+                             pack_name(cid, 64), pack_name(name, 64),
+                             pack_name(wtype, 2), flags, util, cpi, mpki,
+                             mbw, freq, occupancy, mtime)
+        HEADER.pack_into(self.mmap, 0, MAGIC, VERSION, self.capacity,
+                         LEVEL_SLOTS, RECORD.size, self.seq, time.time(),
+                         len(cids))
+        self.seq = self.seq + 1
+        struct.pack_into('<Q', self.mmap, SEQ_OFFSET, self.seq)
+
+    def close(self):
+        """
+        Mark segment closed, then unmap and remove it, readers see agent is
+        gone by closed sequence
+        """
+        struct.pack_into('<Q', self.mmap, SEQ_OFFSET, CLOSED_SEQ)
+        self.mmap.close()
+        try:
+            # path may already be replaced by segment of a new agent
+            if os.stat(self.path).st_ino == os.fstat(self.fd).st_ino:
+                os.unlink(self.path)
+        except OSError:
+            pass
+        os.close(self.fd)
+
+
+class SnapshotReader:
+    """
+    This class reads snapshot published by agent, it only depends on
+    python standard library so local consumers can use it without agent
+    dependencies. Restarted agent publishes in a new segment file renamed
+    over the path, consumers should open reader again when stale() is True
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        Class constructor, arguments include:
+            path - segment file path
+        """
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(self.fd).st_size
+            if size < RECORD_OFFSET:
+                raise ValueError(path + ' is not an eris snapshot')
+            self.mmap = mmap.mmap(self.fd, size, mmap.MAP_SHARED,
+                                  mmap.PROT_READ)
+        except Exception:
+            os.close(self.fd)
+            raise
+        magic, version, capacity, slots, record_size, _, _, _ =\
+            HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION or slots != LEVEL_SLOTS or\
+           record_size != RECORD.size or size < segment_size(capacity):
+            self.close()
+            raise ValueError(path + ' has unknown snapshot layout')
+
+    def stale(self):
+        """
+        Check if agent closed the segment or path is replaced by segment of
+        another agent, reader should be opened again
+        """
+        if struct.unpack_from('<Q', self.mmap, SEQ_OFFSET)[0] == CLOSED_SEQ:
+            return True
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.fd).st_ino
+        except OSError:
+            return True
+
+    def read_raw(self, retries=1000):
+        """
+        Get consistent copy of segment as (header, bytes) turple, None if
+        writer keeps updating the segment or it is closed
+            retries - times to retry while writer updates the segment
+        """
+        for _ in range(retries):
+            header = HEADER.unpack_from(self.mmap, 0)
+            seq = header[5]
+            if seq == CLOSED_SEQ:
+                return None
+            if seq % 2:
+                continue
+            data = self.mmap[HEADER_SIZE:RECORD_OFFSET +
+                             header[7] * RECORD.size]
+            if struct.unpack_from('<Q', self.mmap, SEQ_OFFSET)[0] == seq:
+                return header, data
+        return None
+
+    def read(self, retries=1000):
+        """
+        Get latest snapshot as dict with sequence, publish time, controller
+        levels and list of container dicts, None if writer keeps updating
+        the segment or it is closed
+            retries - times to retry while writer updates the segment
+        """
+        raw = self.read_raw(retries)
+        if raw is None:
+            return None
+        header, data = raw
+        levels = dict()
+        for i in range(LEVEL_SLOTS):
+            name, level = LEVEL.unpack_from(data, i * LEVEL.size)
+            name = name.rstrip(b'\0').decode('utf-8', 'ignore')
+            if name:
+                levels[name] = level
+        containers = []
+        offset = RECORD_OFFSET - HEADER_SIZE
+        for i in range(header[7]):
+            cid, name, wtype, flags, util, cpi, mpki, mbw, freq, occupancy,\
+                mtime = RECORD.unpack_from(data, offset + i * RECORD.size)
+            containers.append({
+                'cid': cid.rstrip(b'\0').decode('utf-8'),
+                'name': name.rstrip(b'\0').decode('utf-8', 'ignore'),
+                'type': wtype.decode('utf-8'), 'util': util, 'cpi': cpi,
+                'mpki': mpki, 'mb': mbw, 'nf': freq, 'l3occ': occupancy,
+                'metrics_time': mtime,
+                'contentions': [contention for bit, contention in
+                                enumerate(CONTENTIONS) if flags & (1 << bit)]
+            })
+        return {'seq': header[5], 'time': header[6], 'levels': levels,
+                'containers': containers}
+
+    def close(self):
+        """ unmap segment """
+        self.mmap.close()
+        os.close(self.fd)
+
+
+def main():
+    """ Script entry point, print latest snapshot published by agent """
+    parser = argparse.ArgumentParser(description='This tool prints latest\
+                                     container state published by eris agent\
+                                     in shared memory.')
+    parser.add_argument('path', help='snapshot segment file', nargs='?',
+                        default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    reader = SnapshotReader(args.path)
+    start = time.perf_counter()
+    snapshot = reader.read()
+    elapsed = time.perf_counter() - start
+    gone = snapshot is None and reader.stale()
+    reader.close()
+    if snapshot is None:
+        print('agent is gone' if gone else
+              'snapshot is being updated, try again')
+        return
+    print('sequence ' + str(snapshot['seq']) + ' published at ' +
+          time.strftime('%Y-%m-%d %H:%M:%S',
+                        time.localtime(snapshot['time'])) +
+          ', read in ' + '{:.1f}'.format(elapsed * 1e6) + 'us')
+    print('levels ' + ', '.join([name + '=' + str(level) for name, level in
+                                 sorted(snapshot['levels'].items())]))
+    print('CID,CNAME,TYPE,UTIL,CPI,L3MPKI,MB,NF,L3OCC,CONTENTIONS')
+    for con in snapshot['containers']:
+        print(','.join([con['cid'], con['name'], con['type']] +
+                       [str(con[name]) for name in
+                        ('util', 'cpi', 'mpki', 'mb', 'nf', 'l3occ')] +
+                       ['|'.join(con['contentions'])]))
+
+
+if __name__ == '__main__':
+    main()
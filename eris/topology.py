@@ -0,0 +1,101 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module reads processor topology from sysfs """
+
+import os
+from container import parse_cpuset
+
+
+class CpuTopology:
+    """
+    This class is the abstraction of processor topology, logical processors
+    are grouped into physical cores (hyperthread siblings), sockets and L3
+    cache domains. L3 domain ids index resctrl monitor data and pqos llc@
+    and mba@ allocation, they differ from socket ids on processors with
+    sub-NUMA clustering or several L3 caches per package
+    """
+    SYSFS_CPU = '/sys/devices/system/cpu'
+
+    def __init__(self, sysfs_root=SYSFS_CPU):
+        self.sysfs_root = sysfs_root
+        self.cpus = self.__read_cpulist('online')
+        self.socket = dict()
+        self.l3 = dict()
+        self.siblings = dict()
+        cores = dict()
+        for cpu in self.cpus:
+            socket = self.__read_int(cpu, 'physical_package_id')
+            core = self.__read_int(cpu, 'core_id')
+            self.socket[cpu] = socket
+            self.l3[cpu] = self.__read_l3(cpu, socket)
+            cores.setdefault((socket, core), []).append(cpu)
+
+        self.cores = []
+        for key in sorted(cores):
+            core = tuple(sorted(cores[key]))
+            self.cores.append(core)
+            for cpu in core:
+                self.siblings[cpu] = core
+        self.sockets = sorted(set(self.socket.values()))
+        self.l3_domains = sorted(set(self.l3.values()))
+
+    def __read_cpulist(self, name):
+        try:
+            with open(os.path.join(self.sysfs_root, name)) as cpusf:
+                return parse_cpuset(cpusf.read())
+        except (IOError, ValueError):
+            return list(range(os.cpu_count()))
+
+    def __read_int(self, cpu, name):
+        try:
+            with open(os.path.join(self.sysfs_root, 'cpu' + str(cpu),
+                                   'topology', name)) as topof:
+                return int(topof.read().strip())
+        except (IOError, ValueError):
+            # no topology information, treat processor as its own core
+            return 0 if name == 'physical_package_id' else cpu
+
+    def __read_l3(self, cpu, socket):
+        try:
+            with open(os.path.join(self.sysfs_root, 'cpu' + str(cpu),
+                                   'cache', 'index3', 'id')) as idf:
+                return int(idf.read().strip())
+        except (IOError, ValueError):
+            # no cache id, one L3 cache per socket
+            return socket
+
+    def core_of(self, cpu):
+        """
+        Get all hyperthread siblings of one logical processor
+            cpu - logical processor number
+        """
+        return self.siblings.get(cpu, (cpu,))
+
+    def socket_cpus(self, socket):
+        """
+        Get all logical processors in one socket
+            socket - socket (physical package) id
+        """
+        return [cpu for cpu in self.cpus if self.socket[cpu] == socket]
+
+    def l3_cpus(self, domain):
+        """
+        Get all logical processors sharing one L3 cache
+            domain - L3 cache domain id
+        """
+        return [cpu for cpu in self.cpus if self.l3[cpu] == domain]
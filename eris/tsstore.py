@@ -0,0 +1,296 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" This module implements memory mapped time series store of recent metrics """
+
+import argparse
+import mmap
+import os
+import struct
+import time
+import numpy as np
+from container import SAMPLE_METRICS, STATS, stat_column
+
+UTIL = 'util'
+METRIC = 'metric'
+UTIL_FIELDS = ('UTIL',)
+METRIC_FIELDS = ('INST', 'CYC', 'CPI', 'L3MPKI', 'L3MISS', 'NF', 'UTIL',
+                 'L3OCC', 'MBL', 'MBR') + tuple(
+                     [stat_column(name, stat) for name in SAMPLE_METRICS
+                      for stat in STATS[1:]])
+KINDS = (UTIL, METRIC)
+
+MAGIC = b'ERISTS02'
+# magic, sequence, then record size, capacity, head and count of each ring,
+# sequence is odd while a record is appended
+HEADER = struct.Struct('8sQ' + 'QQQQ' * len(KINDS))
+SEQ_OFFSET = 8
+HEADER_SIZE = 4096
+
+
+def record_dtype(fields):
+    """
+    Get numpy record type of ring, strings are fixed size and truncated
+        fields - names of value fields
+    """
+    return np.dtype([('TIME', '<f8'), ('CID', 'S64'), ('CNAME', 'S64')] +
+                    [(name, '<f8') for name in fields])
+
+
+DTYPES = {UTIL: record_dtype(UTIL_FIELDS), METRIC: record_dtype(METRIC_FIELDS)}
+
+
+class TsStore:
+    """
+    This class stores recent utilization and platform metrics records in a
+    file mapped into memory, each record kind has a fixed size ring so disk
+    usage is bounded and oldest records are overwritten. Records are kept
+    across agent restarts as long as ring capacities do not change, readers
+    get consistent copy by checking sequence number which is odd while a
+    record is appended
+    """
+    # record kinds, callers resolve them through store without importing
+    # this module
+    UTIL = UTIL
+    METRIC = METRIC
+
+    def __init__(self, path, capacities=None):
+        """
+        Class constructor, arguments include:
+            path - store file path
+            capacities - dict of record kind to ring capacity, store is
+                         created or resized if given, otherwise existing
+                         store is opened read only
+        """
+        self.path = path
+        self.readonly = capacities is None
+        if self.readonly:
+            self.fd = os.open(path, os.O_RDONLY)
+        else:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self.__map(capacities)
+        except Exception:
+            os.close(self.fd)
+            raise
+
+    def __layout(self, capacities):
+        size = HEADER_SIZE
+        layout = dict()
+        for kind in KINDS:
+            layout[kind] = (size, capacities[kind])
+            size = size + DTYPES[kind].itemsize * capacities[kind]
+        return layout, size
+
+    def __read_header(self, buf):
+        values = HEADER.unpack_from(buf, 0)
+        if values[0] != MAGIC:
+            return None, None
+        header = dict()
+        for i, kind in enumerate(KINDS):
+            header[kind] = list(values[2 + i * 4:6 + i * 4])
+        return values[1], header
+
+    def __map(self, capacities):
+        size = os.fstat(self.fd).st_size
+        seq, header = None, None
+        if size >= HEADER_SIZE:
+            with open(self.path, 'rb') as storef:
+                seq, header = self.__read_header(storef.read(HEADER.size))
+        if self.readonly:
+            if header is None:
+                raise ValueError(self.path + ' is not a metrics store')
+            capacities = dict([(kind, header[kind][1]) for kind in KINDS])
+        layout, total = self.__layout(capacities)
+        fresh = header is None or size != total or any(
+            [header[kind][:2] != [DTYPES[kind].itemsize, capacities[kind]]
+             for kind in KINDS])
+        if fresh and self.readonly:
+            raise ValueError(self.path + ' has unknown record layout')
+        if fresh:
+            # capacity or record layout changed, start an empty store
+            os.ftruncate(self.fd, 0)
+            os.ftruncate(self.fd, total)
+            header = dict([(kind, [DTYPES[kind].itemsize, capacities[kind],
+                                   0, 0]) for kind in KINDS])
+            seq = 0
+        # append interrupted by agent crash left sequence odd, its record
+        # is not counted
+        self.seq = seq + seq % 2
+
+        self.mmap = mmap.mmap(self.fd, total, mmap.MAP_SHARED,
+                              mmap.PROT_READ if self.readonly else
+                              mmap.PROT_READ | mmap.PROT_WRITE)
+        self.header = header
+        self.rings = dict()
+        for kind in KINDS:
+            offset, capacity = layout[kind]
+            self.rings[kind] = np.ndarray(capacity, dtype=DTYPES[kind],
+                                          buffer=self.mmap, offset=offset)
+        if fresh:
+            self.__write_header()
+
+    def __write_header(self):
+        values = [MAGIC, self.seq]
+        for kind in KINDS:
+            values.extend(self.header[kind])
+        HEADER.pack_into(self.mmap, 0, *values)
+
+    def append(self, kind, timestamp, cid, cname, values):
+        """
+        Append one record, oldest record is overwritten if ring is full
+            kind - record kind, UTIL or METRIC
+            timestamp - record time in seconds since epoch
+            cid - container id
+            cname - container name
+            values - dict of field name to value, missing fields are NaN
+        """
+        ring = self.rings[kind]
+        header = self.header[kind]
+        capacity = header[1]
+        if not capacity:
+            return
+        self.seq = self.seq + 1
+        struct.pack_into('<Q', self.mmap, SEQ_OFFSET, self.seq)
+        record = ring[header[2]]
+        record['TIME'] = timestamp
+        record['CID'] = cid.encode('utf-8')
+        record['CNAME'] = cname.encode('utf-8')
+        for name in DTYPES[kind].names[3:]:
+            record[name] = values.get(name, np.nan)
+        # record is complete before it is counted
+        header[2] = (header[2] + 1) % capacity
+        header[3] = min(header[3] + 1, capacity)
+        self.seq = self.seq + 1
+        self.__write_header()
+
+    def __copy(self, kind, header):
+        ring = self.rings[kind]
+        _, capacity, head, count = header[kind]
+        if count < capacity:
+            return ring[:count].copy()
+        return np.concatenate((ring[head:], ring[:head]))
+
+    def records(self, kind, retries=1000):
+        """
+        Get copy of all records of one kind ordered from oldest to newest
+            kind - record kind, UTIL or METRIC
+            retries - times to retry while agent appends records
+        """
+        if not self.readonly:
+            return self.__copy(kind, self.header)
+        for _ in range(retries):
+            # pick up records appended by agent since last call
+            seq, header = self.__read_header(self.mmap)
+            if seq % 2 == 0:
+                records = self.__copy(kind, header)
+                if struct.unpack_from('<Q', self.mmap, SEQ_OFFSET)[0] == seq:
+                    self.header = header
+                    return records
+            time.sleep(0.001)
+        raise ValueError(self.path + ' is kept updated, fail to read ' +
+                         'consistent records')
+
+    def query(self, kind, cid=None, cname=None, start=None, end=None):
+        """
+        Get records of one kind in time range, ordered by time
+            kind - record kind, UTIL or METRIC
+            cid - container id, all containers if None
+            cname - container name, all containers if None
+            start - range start in seconds since epoch, inclusive
+            end - range end in seconds since epoch, exclusive
+        """
+        records = self.records(kind)
+        mask = np.ones(len(records), dtype=bool)
+        if cid is not None:
+            mask &= records['CID'] == cid.encode('utf-8')
+        if cname is not None:
+            mask &= records['CNAME'] == cname.encode('utf-8')
+        if start is not None:
+            mask &= records['TIME'] >= start
+        if end is not None:
+            mask &= records['TIME'] < end
+        return records[mask]
+
+    def frame(self, kind, cid=None, cname=None, start=None, end=None):
+        """
+        Get records of query as dataframe with same columns as util.csv or
+        metrics.csv recorded by agent, TIME is in UTC
+            kind - record kind, UTIL or METRIC
+            cid - container id, all containers if None
+            cname - container name, all containers if None
+            start - range start in seconds since epoch, inclusive
+            end - range end in seconds since epoch, exclusive
+        """
+        import pandas as pd
+        records = self.query(kind, cid, cname, start, end)
+        data = pd.DataFrame(records)
+        for name in ('CID', 'CNAME'):
+            data[name] = data[name].str.decode('utf-8')
+        data['TIME'] = pd.to_datetime(data['TIME'], unit='s')
+        return data
+
+    def flush(self):
+        """ write mapped pages back to store file """
+        if not self.readonly:
+            self.mmap.flush()
+
+    def close(self):
+        """ flush and unmap store file """
+        self.rings = dict()
+        self.flush()
+        self.mmap.close()
+        os.close(self.fd)
+
+
+def capacities(hours, containers, util_interval, metric_interval):
+    """
+    Get ring capacities to hold records of recent hours
+        hours - hours of records to keep
+        containers - maximal container count on node
+        util_interval - CPU utilization monitor interval in seconds
+        metric_interval - platform metrics monitor interval in seconds
+    """
+    seconds = hours * 3600
+    # lcs and loadavg1m records are added in each utilization cycle
+    return {UTIL: int(seconds / util_interval * (containers + 2)),
+            METRIC: int(seconds / metric_interval * containers)}
+
+
+def main():
+    """ Script entry point, print records of store in csv format """
+    parser = argparse.ArgumentParser(description='This tool prints recent\
+                                     utilization or platform metrics records\
+                                     kept by eris agent in metrics store.')
+    parser.add_argument('store', help='metrics store file')
+    parser.add_argument('-k', '--kind', help='record kind', choices=KINDS,
+                        default=METRIC)
+    parser.add_argument('--cid', help='container id')
+    parser.add_argument('--cname', help='container name')
+    parser.add_argument('--since', help='print records of last seconds',
+                        type=float)
+    args = parser.parse_args()
+
+    store = TsStore(args.store)
+    start = time.time() - args.since if args.since else None
+    data = store.frame(args.kind, args.cid, args.cname, start)
+    print(data.to_csv(index=False), end='')
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -29,7 +29,9 @@ import "C"
 import (
 	"flag"
 	"fmt"
+	"math"
 	"os"
+	"strconv"
 	"strings"
 	"time"
 	"unsafe"
@@ -40,10 +42,23 @@ var cycle = flag.Int("cycle", 1, "monitor time")
 var frequency = flag.Int64("frequency", 5, "sample frequency")
 var period = flag.Int64("period", 1, "sample period")
 var cgroupPath = flag.String("cgroup", "", "cgroups to be monitored")
+var software = flag.Bool("software", false, "monitor software events instead of hardware events")
+var events = flag.String("events", "", "additional hardware events, comma separated type:config:inst|cyc:name, inst or cyc is base counter the event is normalized by")
+var groupSize = flag.Int("group", 4, "programmable counters per core, events are split into groups of this size")
 
+var types = []C.uint32_t{C.PERF_TYPE_HARDWARE, C.PERF_TYPE_HARDWARE, C.PERF_TYPE_HARDWARE}
 var metrics = []C.uint64_t{C.PERF_COUNT_HW_INSTRUCTIONS, C.PERF_COUNT_HW_CPU_CYCLES, C.PERF_COUNT_HW_CACHE_MISSES}
 var metricsDescription = []string{"instructions", "cycles", "LLC misses"}
 
+// index of base counter of each event, events counted outside first group
+// are scaled to first group by it, -1 for default events
+var bases = []int{-1, -1, -1}
+
+// software events are available without PMU, e.g. in virtual machines
+var swTypes = []C.uint32_t{C.PERF_TYPE_SOFTWARE, C.PERF_TYPE_SOFTWARE, C.PERF_TYPE_SOFTWARE}
+var swMetrics = []C.uint64_t{C.PERF_COUNT_SW_CPU_CLOCK, C.PERF_COUNT_SW_TASK_CLOCK, C.PERF_COUNT_SW_CONTEXT_SWITCHES}
+var swMetricsDescription = []string{"cpu clock", "task clock", "context switches"}
+
 type Cgroup struct {
 	Path        string
 	Name        string
@@ -69,6 +84,10 @@ func NewCgroup(path string) (*Cgroup, error) {
 
 func (this *Cgroup) GetPgosHandler() {
 	f, err := os.OpenFile(this.Path+"/tasks", os.O_RDONLY, os.ModePerm)
+	if err != nil {
+		// cgroup v2 has no tasks file, processes are listed in cgroup.procs
+		f, err = os.OpenFile(this.Path+"/cgroup.procs", os.O_RDONLY, os.ModePerm)
+	}
 	if err != nil {
 		println(err.Error())
 		return
@@ -76,13 +95,17 @@ func (this *Cgroup) GetPgosHandler() {
 	defer f.Close()
 	pids := []C.pid_t{}
 	for {
-		var pid uint16
+		var pid uint32
 		n, err := fmt.Fscanf(f, "%d\n", &pid)
 		if n == 0 || err != nil {
 			break
 		}
 		pids = append(pids, C.pid_t(pid))
 	}
+	if len(pids) == 0 {
+		this.PgosHandler = -1
+		return
+	}
 	this.PgosHandler = C.pgos_mon_start_pids(C.unsigned(len(pids)), (*C.pid_t)(unsafe.Pointer(&pids[0])))
 
 	return
@@ -96,6 +119,104 @@ func (this *Cgroup) Close() error {
 	return nil
 }
 
+// parse additional events and append them to monitored events
+func parseEvents(spec string) error {
+	for _, item := range strings.Split(spec, ",") {
+		fields := strings.SplitN(item, ":", 4)
+		if len(fields) != 4 {
+			return fmt.Errorf("invalid event %s", item)
+		}
+		eventType, err := strconv.ParseUint(fields[0], 0, 32)
+		if err != nil {
+			return err
+		}
+		config, err := strconv.ParseUint(fields[1], 0, 64)
+		if err != nil {
+			return err
+		}
+		// instructions and cycles are first two default events
+		base := 1
+		if fields[2] == "inst" {
+			base = 0
+		} else if fields[2] != "cyc" {
+			return fmt.Errorf("event %s is normalized by inst or cyc", item)
+		}
+		types = append(types, C.uint32_t(eventType))
+		metrics = append(metrics, C.uint64_t(config))
+		metricsDescription = append(metricsDescription, fields[3])
+		bases = append(bases, base)
+	}
+	return nil
+}
+
+// check if event is counted by fixed counter
+func isFixed(i int) bool {
+	return types[i] == C.PERF_TYPE_HARDWARE && (metrics[i] == C.PERF_COUNT_HW_INSTRUCTIONS || metrics[i] == C.PERF_COUNT_HW_CPU_CYCLES)
+}
+
+// split events into groups of event indexes which fit programmable counters,
+// every group is led by instructions and cycles on fixed counters, so events
+// are normalized by base counters scheduled together with them
+func groupEvents(size int) [][]int {
+	fixed := []int{}
+	for i := 0; i < len(metrics); i++ {
+		if isFixed(i) {
+			fixed = append(fixed, i)
+		}
+	}
+	groups := [][]int{append([]int{}, fixed...)}
+	used := 0
+	for i := 0; i < len(metrics); i++ {
+		if isFixed(i) {
+			continue
+		}
+		if used >= size {
+			groups = append(groups, append([]int{}, fixed...))
+			used = 0
+		}
+		groups[len(groups)-1] = append(groups[len(groups)-1], i)
+		used++
+	}
+	return groups
+}
+
+// scale event counted outside first group to first group by its base counter
+// in own group, so ratios are not skewed by multiplexing between groups,
+// return value of each event and whether it is counted, event is not counted
+// if base counter of own group is 0 as the group was never scheduled
+func scaleEvents(groups [][]int, results [][]uint64, j int) ([]uint64, []bool) {
+	values := make([]uint64, len(metrics))
+	counted := make([]bool, len(metrics))
+	first := map[int]uint64{}
+	for g, group := range groups {
+		own := map[int]uint64{}
+		for k, e := range group {
+			own[e] = results[g][j*len(group)+k]
+		}
+		for _, e := range group {
+			if g == 0 {
+				values[e] = own[e]
+				counted[e] = true
+				first[e] = own[e]
+				continue
+			}
+			if _, ok := first[e]; ok {
+				continue
+			}
+			ownBase, ownOk := own[bases[e]]
+			firstBase, firstOk := first[bases[e]]
+			if !ownOk || !firstOk {
+				values[e] = own[e]
+				counted[e] = true
+			} else if ownBase > 0 {
+				values[e] = uint64(math.Round(float64(own[e]) * float64(firstBase) / float64(ownBase)))
+				counted[e] = true
+			}
+		}
+	}
+	return values, counted
+}
+
 func main() {
 	pqosLog, err := os.OpenFile("/tmp/pqos.log", os.O_CREATE|os.O_WRONLY|os.O_TRUNC, os.ModePerm)
 	if err != nil {
@@ -127,19 +248,65 @@ func main() {
 		fds = append(fds, int32(c.File.Fd()))
 	}
 
+	if len(fds) == 0 {
+		println("no cgroup to be monitored")
+		return
+	}
+	if *software {
+		types, metrics, metricsDescription = swTypes, swMetrics, swMetricsDescription
+	} else if *events != "" {
+		if err := parseEvents(*events); err != nil {
+			println(err.Error())
+			return
+		}
+	}
+
 	frequencyDuration := fmt.Sprintf("%ds", *frequency-(*period))
 	d, err := time.ParseDuration(frequencyDuration)
 	if err != nil {
 		println(err.Error())
 		return
 	}
+	p := time.Duration(*period) * time.Second
+
+	// counters are opened once and kept running, each sample reads deltas,
+	// one collector per event group
+	groups := groupEvents(*groupSize)
+	collectors := make([]*C.struct_collector, 0, len(groups))
+	results := make([][]uint64, 0, len(groups))
+	for _, group := range groups {
+		groupTypes := make([]C.uint32_t, len(group))
+		groupMetrics := make([]C.uint64_t, len(group))
+		for k, e := range group {
+			groupTypes[k] = types[e]
+			groupMetrics[k] = metrics[e]
+		}
+		collector := C.collector_open((*C.int)(unsafe.Pointer(&fds[0])), C.int(len(fds)), C.int(*coreCount), &groupTypes[0], &groupMetrics[0], C.int(len(group)))
+		if collector == nil {
+			println("fail to open perf collector")
+			return
+		}
+		defer C.collector_close(collector)
+		collectors = append(collectors, collector)
+		results = append(results, make([]uint64, len(fds)*len(group)))
+	}
+
 	for i := 0; i < *cycle; i++ {
-		result := make([]uint64, len(fds)*len(metrics))
 		now := time.Now().Unix()
-		C.collect((*C.pid_t)(unsafe.Pointer((&fds[0]))), C.int(len(fds)), C.int(*coreCount), &metrics[0], C.int(len(metrics)), (*C.uint64_t)(unsafe.Pointer(&result[0])), C.unsigned(*period))
+		for _, collector := range collectors {
+			C.collector_read(collector, nil)
+		}
+		time.Sleep(p)
+		for g, collector := range collectors {
+			C.collector_read(collector, (*C.uint64_t)(unsafe.Pointer(&results[g][0])))
+		}
 		for j := 0; j < len(cgroups); j++ {
+			values, counted := scaleEvents(groups, results, j)
 			for k := 0; k < len(metrics); k++ {
-				fmt.Printf("%s\t%s\t%d\t%d\n", cgroups[j].Name, metricsDescription[k], now, result[j*len(metrics)+k])
+				if !counted[k] {
+					continue
+				}
+				fmt.Printf("%s\t%s\t%d\t%d\n", cgroups[j].Name, metricsDescription[k], now, values[k])
 			}
 			pgosValue := C.pgos_mon_poll(cgroups[j].PgosHandler)
 			fmt.Printf("%s\t%s\t%d\t%+v\n", cgroups[j].Name, "LLC occupancy", now, pgosValue.llc/1024)
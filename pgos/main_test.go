@@ -0,0 +1,80 @@
+// Copyright (C) 2018 Intel Corporation
+// 
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+// 
+// http://www.apache.org/licenses/LICENSE-2.0
+// 
+// Unless required by applicable law or agreed to in writing,
+// software distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions
+// and limitations under the License.
+// 
+// 
+// SPDX-License-Identifier: Apache-2.0
+
+package main
+
+import (
+	"reflect"
+	"testing"
+)
+
+// add events to default ones and restore them when test ends
+func withEvents(t *testing.T, spec string) {
+	savedTypes, savedMetrics := types, metrics
+	savedDescription, savedBases := metricsDescription, bases
+	t.Cleanup(func() {
+		types, metrics = savedTypes, savedMetrics
+		metricsDescription, bases = savedDescription, savedBases
+	})
+	if err := parseEvents(spec); err != nil {
+		t.Fatal(err)
+	}
+}
+
+func TestParseEventsRejectsUnknownBase(t *testing.T) {
+	withEvents(t, "4:0x1:cyc:a")
+	if err := parseEvents("4:0x2:foo:b"); err == nil {
+		t.Error("event with unknown base is accepted")
+	}
+}
+
+func TestGroupEventsLeadsEveryGroupWithFixedEvents(t *testing.T) {
+	withEvents(t, "4:0x1:cyc:a,4:0x2:inst:b,4:0x3:cyc:c,4:0x4:inst:d")
+	groups := groupEvents(4)
+	expected := [][]int{{0, 1, 2, 3, 4, 5}, {0, 1, 6}}
+	if !reflect.DeepEqual(groups, expected) {
+		t.Errorf("groups %v, expected %v", groups, expected)
+	}
+}
+
+func TestScaleEventsByOwnGroupBase(t *testing.T) {
+	withEvents(t, "4:0x1:cyc:a,4:0x2:inst:b,4:0x3:cyc:c,4:0x4:inst:d,4:0x5:cyc:e")
+	groups := groupEvents(4)
+	// two cgroups, second group of second cgroup was never scheduled
+	results := [][]uint64{
+		{1000, 2000, 10, 20, 30, 40, 500, 1000, 30, 40, 50, 60},
+		{3000, 6000, 60, 120, 0, 0, 5, 6},
+	}
+	values, counted := scaleEvents(groups, results, 0)
+	expected := []uint64{1000, 2000, 10, 20, 30, 40, 20, 40}
+	if !reflect.DeepEqual(values, expected) {
+		t.Errorf("values %v, expected %v", values, expected)
+	}
+	for k, ok := range counted {
+		if !ok {
+			t.Errorf("event %d is not counted", k)
+		}
+	}
+
+	values, counted = scaleEvents(groups, results, 1)
+	if values[2] != 30 || !counted[2] {
+		t.Errorf("first group event %d, counted %v", values[2], counted[2])
+	}
+	if counted[6] || counted[7] {
+		t.Errorf("events of unscheduled group are counted %v", counted)
+	}
+}
@@ -28,11 +28,20 @@
 #include <errno.h>
 
 
-struct read_format {
-    uint64_t value;         /* The value of the event */
-    uint64_t time_enabled;  /* if PERF_FORMAT_TOTAL_TIME_ENABLED */
-    uint64_t time_running;  /* if PERF_FORMAT_TOTAL_TIME_RUNNING */
-    uint64_t id;            /* if PERF_FORMAT_ID */
+struct perf_group {
+    int *fds;               /* event fds, fds[0] is the group leader */
+    uint64_t *last;         /* raw event values of last read */
+    uint64_t last_enabled;  /* time enabled of last read */
+    uint64_t last_running;  /* time running of last read */
+};
+
+struct collector {
+    int cgroup_count;
+    int cpus;
+    int metrics_count;
+    struct perf_group *groups;  /* one group per cgroup per cpu */
+    uint64_t *buf;              /* group read buffer */
+    size_t buf_size;
 };
 
 
@@ -43,74 +52,145 @@ static long perf_event_open(struct perf_event_attr *hw_event, pid_t pid, int cpu
     return ret;
 }
 
-static int open_perf_fd(pid_t pid, int cpu, uint64_t metric) {
+static int open_perf_fd(int cgroup_fd, int cpu, uint32_t type, uint64_t metric, int group_fd) {
     struct perf_event_attr pe;
     memset(&pe, 0, sizeof(struct perf_event_attr));
-    pe.type = PERF_TYPE_HARDWARE;
+    pe.type = type;
     pe.size = sizeof(struct perf_event_attr);
     pe.config = metric;
-    pe.disabled = 1;
-    pe.read_format = PERF_FORMAT_TOTAL_TIME_ENABLED |
-	 	 	PERF_FORMAT_TOTAL_TIME_RUNNING |
-	   		PERF_FORMAT_ID; 
+    /* members follow the leader, only the leader is enabled explicitly */
+    pe.disabled = group_fd == -1 ? 1 : 0;
+    pe.read_format = PERF_FORMAT_GROUP |
+            PERF_FORMAT_TOTAL_TIME_ENABLED |
+            PERF_FORMAT_TOTAL_TIME_RUNNING;
 
-    int fd = perf_event_open(&pe, pid, cpu, -1, PERF_FLAG_PID_CGROUP);
+    int fd = perf_event_open(&pe, cgroup_fd, cpu, group_fd, PERF_FLAG_PID_CGROUP);
     return fd;
 }
 
-static uint64_t scale_counter_value(struct read_format rf) {
-    double scaling_rate;
-    if (rf.time_running == 0 || rf.time_enabled == 0)
-    	return 0;	    
+static void close_group(struct perf_group *group, int metrics_count) {
+    int i;
+    if (group->fds == NULL) {
+        return;
+    }
+    for (i = metrics_count - 1;i >= 0;i --) {
+        if (group->fds[i] >= 0) {
+            close(group->fds[i]);
+        }
+    }
+    free(group->fds);
+    free(group->last);
+    group->fds = NULL;
+    group->last = NULL;
+}
 
-    if (rf.time_enabled != rf.time_running) {
-    	scaling_rate = rf.time_enabled / rf.time_running;
-	return round(rf.value * scaling_rate);
-    } else {
-	return rf.value;
+static void collector_close(struct collector *c) {
+    int i;
+    if (c == NULL) {
+        return;
     }
+    if (c->groups != NULL) {
+        for (i = 0;i < c->cgroup_count * c->cpus;i ++) {
+            close_group(&c->groups[i], c->metrics_count);
+        }
+        free(c->groups);
+    }
+    free(c->buf);
+    free(c);
 }
 
-static void collect(pid_t* pids, int pid_count, int cpus, uint64_t* metrics, int metrics_count, uint64_t* result, unsigned period)  {
-    struct read_format rf; 
+/*
+ * Open one event group per cgroup per cpu, counters are kept open and
+ * running until collector_close is called.
+ */
+static struct collector *collector_open(int *cgroup_fds, int cgroup_count, int cpus, uint32_t *types, uint64_t *metrics, int metrics_count) {
     int i, j, k;
-    int fds[10000], fd_index = 0, result_index = 0;
-    for (i = 0;i < pid_count;i ++) {
-        for (j = 0;j < metrics_count;j ++) {
-            for (k = 0;k < cpus;k ++) {
-                fds[fd_index] = open_perf_fd(pids[i], k, metrics[j]);
-                if (fds[fd_index] == -1) {
+    struct collector *c = calloc(1, sizeof(struct collector));
+    if (c == NULL) {
+        return NULL;
+    }
+    c->cgroup_count = cgroup_count;
+    c->cpus = cpus;
+    c->metrics_count = metrics_count;
+    c->groups = calloc(cgroup_count * cpus, sizeof(struct perf_group));
+    /* nr, time_enabled, time_running followed by one value per event */
+    c->buf_size = (3 + metrics_count) * sizeof(uint64_t);
+    c->buf = malloc(c->buf_size);
+    if (c->groups == NULL || c->buf == NULL) {
+        collector_close(c);
+        return NULL;
+    }
+
+    for (i = 0;i < cgroup_count;i ++) {
+        for (k = 0;k < cpus;k ++) {
+            struct perf_group *group = &c->groups[i * cpus + k];
+            group->fds = malloc(metrics_count * sizeof(int));
+            group->last = calloc(metrics_count, sizeof(uint64_t));
+            if (group->fds == NULL || group->last == NULL) {
+                collector_close(c);
+                return NULL;
+            }
+            for (j = 0;j < metrics_count;j ++) {
+                group->fds[j] = -1;
+            }
+            for (j = 0;j < metrics_count;j ++) {
+                group->fds[j] = open_perf_fd(cgroup_fds[i], k, types[j], metrics[j], j == 0 ? -1 : group->fds[0]);
+                if (group->fds[j] == -1) {
                     printf("fail to open perf event, error %s \n", strerror(errno));
                     fflush(stdout);
-                    return;
+                    close_group(group, metrics_count);
+                    break;
                 }
-                fd_index ++;
-
+            }
+            if (group->fds != NULL) {
+                ioctl(group->fds[0], PERF_EVENT_IOC_RESET, PERF_IOC_FLAG_GROUP);
+                ioctl(group->fds[0], PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP);
             }
         }
     }
+    return c;
+}
 
-    for (i = 0;i < fd_index;i ++) {
-        ioctl(fds[i], PERF_EVENT_IOC_RESET, 0);
-        ioctl(fds[i], PERF_EVENT_IOC_ENABLE, 0);
+/*
+ * Read all groups and add scaled counter deltas since last read into
+ * result, which holds metrics_count values per cgroup. result can be NULL
+ * to only record a new baseline.
+ */
+static void collector_read(struct collector *c, uint64_t *result) {
+    int i, j, k;
+    if (c == NULL) {
+        return;
     }
-    sleep(period);
-    fd_index = 0;
-    for (i = 0;i < pid_count;i ++) {
-        for (j = 0;j < metrics_count;j ++) {
-            for (k = 0;k < cpus;k ++) {
-                ioctl(fds[fd_index], PERF_EVENT_IOC_DISABLE, 0);
-                int n = read(fds[fd_index], &rf, sizeof(struct read_format));
-                if (n == -1) {
+    if (result != NULL) {
+        memset(result, 0, c->cgroup_count * c->metrics_count * sizeof(uint64_t));
+    }
+    for (i = 0;i < c->cgroup_count;i ++) {
+        for (k = 0;k < c->cpus;k ++) {
+            struct perf_group *group = &c->groups[i * c->cpus + k];
+            if (group->fds == NULL) {
+                continue;
+            }
+            int n = read(group->fds[0], c->buf, c->buf_size);
+            if (n < (int)(3 * sizeof(uint64_t)) || c->buf[0] != (uint64_t)c->metrics_count) {
+                continue;
+            }
+            uint64_t enabled = c->buf[1] - group->last_enabled;
+            uint64_t running = c->buf[2] - group->last_running;
+            group->last_enabled = c->buf[1];
+            group->last_running = c->buf[2];
+            for (j = 0;j < c->metrics_count;j ++) {
+                uint64_t value = c->buf[3 + j];
+                uint64_t delta = value - group->last[j];
+                group->last[j] = value;
+                if (result == NULL || running == 0) {
                     continue;
                 }
-                close(fds[fd_index]);
-                fd_index ++;
-                result[result_index] += scale_counter_value(rf);
+                /* whole group is scheduled together, scale by multiplexing ratio */
+                if (enabled != running) {
+                    delta = (uint64_t)round((double)delta * enabled / running);
+                }
+                result[i * c->metrics_count + j] += delta;
             }
-            result_index ++;
         }
     }
-    return;
 }
-
@@ -0,0 +1,64 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" Tests of container state restored from checkpoint """
+
+import pytest
+import cgroup
+from container import Container
+
+
+class FakeBackend:
+    def __init__(self):
+        self.usage = 0
+
+    def cpu_usage(self, cgpath):
+        return self.usage
+
+
+@pytest.fixture
+def backend():
+    fake = FakeBackend()
+    cgroup.set_backend(fake)
+    yield fake
+    cgroup.set_backend(None)
+
+
+def restored(usage, utils=50.0):
+    con = Container('c' * 64, 'lc', [], False, cgpath='docker/c')
+    con.restore({'cpu_usage': usage, 'timestamp': 100.0, 'utils': utils,
+                 'cpu_stat': {}, 'metrics': {}, 'history': []})
+    return con
+
+
+def test_restored_baseline_covers_agent_restart(backend):
+    con = restored(10 * 10 ** 9)
+    backend.usage = 15 * 10 ** 9
+    con.update_cpu_usage(110.0)
+    assert con.utils == pytest.approx(50.0)
+
+
+def test_restored_baseline_of_restarted_container_is_dropped(backend):
+    con = restored(10 * 10 ** 9)
+    # same cid restarted, new cgroup counts from 0
+    backend.usage = 2 * 10 ** 9
+    con.update_cpu_usage(110.0)
+    assert con.utils >= 0
+    assert con.cpu_usage == 2 * 10 ** 9
+    backend.usage = 3 * 10 ** 9
+    con.update_cpu_usage(120.0)
+    assert con.utils == pytest.approx(10.0)
@@ -0,0 +1,103 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" Tests of CPU frequency control on fake cpufreq sysfs """
+
+import pytest
+from container import parse_cpuset
+from cpufreq import CpuFreq
+from mresource import Resource
+from naivectrl import NaiveController
+
+MIN_FREQ = 1000000
+MAX_FREQ = 3000000
+
+
+class FakeContainer:
+    def __init__(self, name, cpusets):
+        self.name = name
+        self.cpusets = cpusets
+
+    def update_cpusets(self):
+        pass
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    (tmp_path / 'online').write_text('0-3\n')
+    for cpu in range(4):
+        freq = tmp_path / ('cpu' + str(cpu)) / 'cpufreq'
+        freq.mkdir(parents=True)
+        (freq / 'cpuinfo_min_freq').write_text(str(MIN_FREQ))
+        (freq / 'cpuinfo_max_freq').write_text(str(MAX_FREQ))
+        (freq / 'scaling_max_freq').write_text(str(MAX_FREQ))
+    return tmp_path
+
+
+def max_freqs(sysfs):
+    return [int((sysfs / ('cpu' + str(cpu)) / 'cpufreq' /
+                 'scaling_max_freq').read_text()) for cpu in range(4)]
+
+
+def test_parse_cpuset():
+    assert parse_cpuset('0-2,5,7-8\n') == [0, 1, 2, 5, 7, 8]
+    assert parse_cpuset('') == []
+
+
+def test_cap_and_restore_best_effort_cpus(sysfs):
+    cpuf = CpuFreq(sysfs_root=str(sysfs))
+    bes = [FakeContainer('be', [2, 3])]
+    cpuf.set_level(Resource.BUGET_LEV_MIN)
+    cpuf.budgeting(bes)
+    assert max_freqs(sysfs) == [MAX_FREQ, MAX_FREQ, MIN_FREQ, MIN_FREQ]
+
+    cpuf.set_level(Resource.BUGET_LEV_MAX // 2)
+    cpuf.budgeting(bes)
+    middle = (MIN_FREQ + MAX_FREQ) // 2
+    assert max_freqs(sysfs) == [MAX_FREQ, MAX_FREQ, middle, middle]
+
+    cpuf.set_level(Resource.BUGET_LEV_FULL)
+    cpuf.budgeting(bes)
+    assert max_freqs(sysfs) == [MAX_FREQ] * 4
+    assert not cpuf.capped
+
+
+def test_moved_best_effort_cpus_are_released(sysfs):
+    cpuf = CpuFreq(Resource.BUGET_LEV_MIN, sysfs_root=str(sysfs))
+    cpuf.budgeting([FakeContainer('be', [2, 3])])
+    cpuf.budgeting([FakeContainer('be', [3])])
+    assert max_freqs(sysfs) == [MAX_FREQ, MAX_FREQ, MAX_FREQ, MIN_FREQ]
+
+
+def test_unpinned_best_effort_is_not_capped(sysfs):
+    cpuf = CpuFreq(Resource.BUGET_LEV_MIN, sysfs_root=str(sysfs))
+    cpuf.budgeting([FakeContainer('be', [0, 1, 2, 3])])
+    assert max_freqs(sysfs) == [MAX_FREQ] * 4
+
+
+def test_tdp_controller_caps_and_steps_back(sysfs):
+    cpuf = CpuFreq(sysfs_root=str(sysfs))
+    ctrl = NaiveController(cpuf, cyc_thresh=1)
+    bes = [FakeContainer('be', [3])]
+    ctrl.update(bes, True, False)
+    assert max_freqs(sysfs)[3] == MIN_FREQ
+    ctrl.update(bes, False, False)
+    assert MIN_FREQ < max_freqs(sysfs)[3] < MAX_FREQ
+    for _ in range(Resource.BUGET_LEV_MAX):
+        ctrl.update(bes, False, False)
+    assert cpuf.is_full_level()
+    assert max_freqs(sysfs) == [MAX_FREQ] * 4
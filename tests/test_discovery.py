@@ -0,0 +1,66 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" Tests of cgroup hierarchy container discovery """
+
+import pytest
+import cgroup
+from discovery import CgroupDiscovery, IN_Q_OVERFLOW
+
+CID1 = '1' * 64
+CID2 = '2' * 64
+
+
+@pytest.fixture
+def discovery(tmp_path):
+    cgroup.set_backend(cgroup.CgroupV2(str(tmp_path)))
+    (tmp_path / 'docker' / CID1).mkdir(parents=True)
+    disc = CgroupDiscovery([{'path': r'docker/(?P<cid>[0-9a-f]{64})$'}])
+    yield disc
+    disc.close()
+    cgroup.set_backend(None)
+
+
+def test_overflow_rescans_hierarchy(discovery, tmp_path):
+    assert [con.id for con in discovery.list()] == [CID1]
+    (tmp_path / 'docker' / CID2).mkdir()
+    # event of new directory is lost in overflowed queue
+    assert [con.id for con in discovery.list()] == [CID1]
+    discovery.handle_event(IN_Q_OVERFLOW)
+    assert sorted([con.id for con in discovery.list()]) == [CID1, CID2]
+
+
+def test_fallback_name_is_looked_up_again(tmp_path):
+    cgroup.set_backend(cgroup.CgroupV2(str(tmp_path / 'cgroup')))
+    (tmp_path / 'cgroup' / 'docker' / CID1).mkdir(parents=True)
+    containers = tmp_path / 'containers'
+    bundle = containers / CID1
+    disc = CgroupDiscovery([{'path': r'docker/(?P<cid>[0-9a-f]{64})$',
+                             'name': '{name}',
+                             'bundle': str(containers / '{cid}')}])
+    try:
+        assert [con.name for con in disc.list()] == [CID1]
+        bundle.mkdir(parents=True)
+        (bundle / 'config.v2.json').write_text(
+            '{"Name": "/cassandra", "Config": {"Labels": {"app": "db"}}}')
+        found = disc.list()
+        assert [con.name for con in found] == ['cassandra']
+        assert found[0].labels['app'] == 'db'
+        assert disc.list() is found
+    finally:
+        disc.close()
+        cgroup.set_backend(None)
@@ -0,0 +1,68 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" Tests of multivariate contention scoring model """
+
+import numpy as np
+from container import Contention
+from mvmodel import FEATURES, MvModel, score
+
+IDENTITY = np.identity(len(FEATURES)).tolist()
+
+
+def bin_model(components, threshold=-20):
+    return {'util_start': 0, 'util_end': 100, 'threshold': threshold,
+            'center': [0] * len(FEATURES), 'scale': [1] * len(FEATURES),
+            'components': [{'weight': 1.0 / len(components), 'mean': mean,
+                            'covariance': IDENTITY}
+                           for mean in components]}
+
+
+class FakeContainer:
+    def __init__(self, name, metrics):
+        self.name = name
+        self.utils = 50
+        self.metrics = metrics
+
+    def get_metrics(self):
+        return self.metrics
+
+
+def test_score_picks_one_component_per_vector():
+    data = np.array([[0.0, 0, 0, 0], [5.0, 0, 0, 0], [np.nan, 0, 0, 0]])
+    means = np.array([[0.0, 0, 0, 0], [5.0, 0, 0, 0]] * 3)
+    owner = np.repeat(np.arange(3), 2)
+    precisions = np.tile(np.identity(4), (6, 1, 1))
+    likelihood, best = score(data, owner, means, precisions, np.zeros(6),
+                             np.arange(0, 6, 2))
+    assert len(likelihood) == 3
+    assert list(best[:2]) == [0, 3]
+    assert owner[best[2]] == 2
+
+
+def test_detect_skips_non_finite_row():
+    model = MvModel({'lc': [bin_model([[0, 0, 0, 0], [1, 0, 0, 0]])]})
+    cons = [FakeContainer('normal', {'CPI': 0, 'L3MPKI': 0, 'MB': 0,
+                                     'NF': 0}),
+            FakeContainer('broken', {'CPI': float('nan'), 'L3MPKI': 0,
+                                     'MB': 0, 'NF': 0}),
+            FakeContainer('llc', {'CPI': 10, 'L3MPKI': 10, 'MB': 0,
+                                  'NF': 0}),
+            FakeContainer('inf', {'CPI': 0, 'L3MPKI': float('inf'),
+                                  'MB': 0, 'NF': 0})]
+    results = model.detect(cons, ['lc'] * len(cons))
+    assert results == [None, None, Contention.LLC, None]
@@ -0,0 +1,63 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" Tests of perf event grouping and per group normalization """
+
+from perfmon import HW_EVENTS, CgroupCounters, group_events
+
+EXTRA = [(4, config, name) for config, name in
+         ((0x1, 'a'), (0x2, 'b'), (0x3, 'c'), (0x4, 'd'))]
+
+
+class FakeGroup:
+    def __init__(self, values):
+        self.values = values
+
+    def read(self, result):
+        for i, value in enumerate(self.values):
+            result[i] = result[i] + value
+
+
+def counters(values, per):
+    """ build counters of HW_EVENTS + EXTRA with fake groups """
+    events = HW_EVENTS + EXTRA
+    counts = CgroupCounters.__new__(CgroupCounters)
+    counts.layout = group_events(events, 4)
+    names = [event[2] for event in events]
+    counts.bases = dict([(i, names.index(per.get(name, 'cycles')))
+                         for i, name in enumerate(names)])
+    counts.counts = [[0] * len(indexes) for indexes in counts.layout]
+    counts.result = [0] * len(events)
+    counts.groups = [(layout, FakeGroup(group_values))
+                     for layout, group_values in enumerate(values)]
+    return counts
+
+
+def test_every_group_is_led_by_fixed_events():
+    assert group_events(HW_EVENTS + EXTRA, 4) == [[0, 1, 2, 3, 4, 5],
+                                                   [0, 1, 6]]
+
+
+def test_event_is_scaled_by_base_of_own_group():
+    counts = counters([[1000, 2000, 10, 20, 30, 40], [3000, 6000, 60]],
+                      {'d': 'instructions'})
+    assert counts.read() == [1000, 2000, 10, 20, 30, 40, 20]
+
+
+def test_event_of_unscheduled_group_has_no_value():
+    counts = counters([[1000, 2000, 10, 20, 30, 40], [0, 0, 0]], {})
+    assert counts.read()[6] is None
@@ -0,0 +1,124 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Tests of pgos perf group reads, perf.c is built with a shim whose group
+leader reads from a pipe fed with perf group read buffers
+"""
+
+import ctypes
+import os
+import shutil
+import struct
+import subprocess
+import pytest
+
+PGOS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pgos')
+
+SHIM = '''
+#include "perf.c"
+
+/* collector of one cgroup on one cpu whose group leader is fd */
+struct collector *fake_open(int fd, int metrics_count) {
+    int j;
+    struct collector *c = calloc(1, sizeof(struct collector));
+    c->cgroup_count = 1;
+    c->cpus = 1;
+    c->metrics_count = metrics_count;
+    c->groups = calloc(1, sizeof(struct perf_group));
+    c->buf_size = (3 + metrics_count) * sizeof(uint64_t);
+    c->buf = malloc(c->buf_size);
+    c->groups[0].fds = malloc(metrics_count * sizeof(int));
+    c->groups[0].last = calloc(metrics_count, sizeof(uint64_t));
+    for (j = 0; j < metrics_count; j++) {
+        c->groups[0].fds[j] = j == 0 ? fd : -1;
+    }
+    return c;
+}
+
+void fake_read(struct collector *c, uint64_t *result) {
+    collector_read(c, result);
+}
+
+void fake_close(struct collector *c) {
+    collector_close(c);
+}
+'''
+
+COUNT = 2
+
+
+@pytest.fixture
+def perf(tmp_path):
+    if shutil.which('gcc') is None:
+        pytest.skip('gcc is not available')
+    (tmp_path / 'shim.c').write_text(SHIM)
+    lib = str(tmp_path / 'shim.so')
+    subprocess.run(['gcc', '-shared', '-fPIC', '-I', PGOS, '-o', lib,
+                    str(tmp_path / 'shim.c'), '-lm'], check=True)
+    perf = ctypes.CDLL(lib)
+    perf.fake_open.restype = ctypes.c_void_p
+    perf.fake_read.argtypes = [ctypes.c_void_p,
+                               ctypes.POINTER(ctypes.c_uint64)]
+    perf.fake_close.argtypes = [ctypes.c_void_p]
+    rfd, wfd = os.pipe()
+    collector = perf.fake_open(rfd, COUNT)
+
+    def read(enabled, running, values, nr=COUNT):
+        os.write(wfd, struct.pack('Q' * (3 + len(values)), nr, enabled,
+                                  running, *values))
+        result = (ctypes.c_uint64 * COUNT)()
+        perf.fake_read(collector, result)
+        return list(result)
+
+    def baseline(enabled, running, values):
+        os.write(wfd, struct.pack('Q' * (3 + COUNT), COUNT, enabled,
+                                  running, *values))
+        perf.fake_read(collector, None)
+
+    yield baseline, read
+    perf.fake_close(collector)
+    os.close(wfd)
+
+
+def test_counters_are_read_as_deltas(perf):
+    baseline, read = perf
+    baseline(100, 100, [10, 20])
+    assert read(200, 200, [50, 80]) == [40, 60]
+    assert read(300, 300, [60, 100]) == [10, 20]
+
+
+def test_deltas_are_scaled_by_multiplexing(perf):
+    baseline, read = perf
+    baseline(100, 100, [10, 20])
+    # group ran half of the time it was enabled
+    assert read(300, 200, [50, 80]) == [80, 120]
+
+
+def test_group_not_scheduled_adds_nothing(perf):
+    baseline, read = perf
+    baseline(100, 100, [10, 20])
+    assert read(200, 100, [10, 20]) == [0, 0]
+    # baseline still moves, next deltas start from last read
+    assert read(300, 200, [30, 50]) == [20, 30]
+
+
+def test_mismatched_group_is_skipped(perf):
+    baseline, read = perf
+    baseline(100, 100, [10, 20])
+    assert read(200, 200, [50, 80, 90], nr=COUNT + 1) == [0, 0]
@@ -0,0 +1,61 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" Tests of adaptive sampling of platform metrics """
+
+from sampling import SamplingPolicy
+
+
+class FakeContainer:
+    def __init__(self, cid, cpi=1.0):
+        self.cid = cid
+        self.metrics = {'CPI': cpi}
+        # detection is off, container metrics history stays empty
+        self.metrics_history = []
+
+    def get_metrics(self):
+        return self.metrics
+
+
+def run(policy, cons, utils, cycles):
+    """ run sampling cycles, return sampled container ids of each cycle """
+    rounds = []
+    for _ in range(cycles):
+        sampled = policy.select(cons, utils)
+        policy.update(sampled, utils, {}, 0)
+        rounds.append([con.cid for con in sampled])
+    return rounds
+
+
+def test_stable_container_interval_grows_without_detection():
+    policy = SamplingPolicy(max_interval=4)
+    rounds = run(policy, [FakeContainer('a')], {'a': 10}, 12)
+    assert policy.states['a']['interval'] == 4
+    assert sum([1 for cids in rounds if cids]) < 12
+
+
+def test_hot_containers_do_not_starve_others():
+    policy = SamplingPolicy(max_containers=2, max_interval=4, hot_util=50)
+    cons = [FakeContainer(cid) for cid in ('h1', 'h2', 'c1', 'c2')]
+    utils = {'h1': 90, 'h2': 90, 'c1': 10, 'c2': 10}
+    rounds = run(policy, cons, utils, 20)
+    for cid in ('c1', 'c2'):
+        cycles = [i for i, cids in enumerate(rounds) if cid in cids]
+        assert cycles
+        gaps = [b - a for a, b in zip(cycles, cycles[1:])]
+        assert max(gaps + [cycles[0]]) <= 2 * policy.max_interval
+    assert all(['h1' in cids or 'h2' in cids for cids in rounds])
@@ -0,0 +1,44 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" Tests of shared memory snapshot of container state """
+
+from shmsnap import SnapshotReader, SnapshotWriter, pack_name
+
+CID = 'c' * 64
+
+
+def test_pack_name_truncates_on_character_boundary():
+    assert pack_name('a' * 63 + 'é', 64) == b'a' * 63
+    assert pack_name('中' * 30, 64).decode('utf-8') == '中' * 21
+    assert pack_name('llc', 16) == b'llc'
+
+
+def test_long_multibyte_names_are_readable(tmp_path):
+    path = str(tmp_path / 'snapshot')
+    writer = SnapshotWriter(path, 4)
+    # 64 byte field ends inside a 3 byte character
+    name = 'ns/服务' * 10
+    writer.update_utils([(CID, name, 'LC', 12.5, None)])
+    writer.publish({'a' + 'é' * 10: 3})
+    reader = SnapshotReader(path)
+    snapshot = reader.read()
+    assert name.startswith(snapshot['containers'][0]['name'])
+    assert len(snapshot['containers'][0]['name'].encode('utf-8')) <= 64
+    assert snapshot['levels'] == {'a' + 'é' * 7: 3}
+    reader.close()
+    writer.close()
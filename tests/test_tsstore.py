@@ -0,0 +1,69 @@
+# Copyright (C) 2018 Intel Corporation
+#  
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#  
+# http://www.apache.org/licenses/LICENSE-2.0
+#  
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions
+# and limitations under the License.
+#  
+#
+# SPDX-License-Identifier: Apache-2.0
+
+""" Tests of memory mapped metrics store """
+
+import struct
+import pytest
+from tsstore import SEQ_OFFSET, UTIL, METRIC, TsStore
+
+CID = 'c' * 64
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / 'store')
+    writer = TsStore(path, {UTIL: 4, METRIC: 2})
+    yield path, writer
+    writer.close()
+
+
+def test_reader_sees_appended_records(store):
+    path, writer = store
+    reader = TsStore(path)
+    for i in range(6):
+        writer.append(UTIL, float(i), CID, 'lc', {'UTIL': i * 10})
+    records = reader.records(UTIL)
+    assert list(records['TIME']) == [2.0, 3.0, 4.0, 5.0]
+    assert list(records['UTIL']) == [20, 30, 40, 50]
+    assert writer.seq % 2 == 0
+    reader.close()
+
+
+def test_reader_does_not_copy_record_being_appended(store):
+    path, writer = store
+    writer.append(UTIL, 1.0, CID, 'lc', {'UTIL': 10})
+    reader = TsStore(path)
+    # writer is in the middle of an append
+    struct.pack_into('<Q', writer.mmap, SEQ_OFFSET, writer.seq + 1)
+    with pytest.raises(ValueError):
+        reader.records(UTIL, retries=3)
+    struct.pack_into('<Q', writer.mmap, SEQ_OFFSET, writer.seq)
+    assert list(reader.records(UTIL)['UTIL']) == [10]
+    reader.close()
+
+
+def test_reopened_store_keeps_records_after_interrupted_append(store):
+    path, writer = store
+    writer.append(METRIC, 1.0, CID, 'lc', {'CPI': 1.5})
+    struct.pack_into('<Q', writer.mmap, SEQ_OFFSET, writer.seq + 1)
+    writer.flush()
+    reopened = TsStore(path, {UTIL: 4, METRIC: 2})
+    assert reopened.seq % 2 == 0
+    reopened.append(METRIC, 2.0, CID, 'lc', {'CPI': 2.5})
+    assert list(TsStore(path).records(METRIC)['CPI']) == [1.5, 2.5]
+    reopened.close()